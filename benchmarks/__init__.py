@@ -0,0 +1,3 @@
+"""
+Benchmarks for the data pipeline. See run.py.
+"""
@@ -0,0 +1,482 @@
+"""
+Times each stage of the data pipeline on synthetic and real case data, and
+compares the results with a checked-in baseline.
+
+The stages are the same steps generate_all_json() and the Lambda take:
+    ingest     parse the csv, record case counts and per capita counts,
+               correct downward revisions and record increases
+    metrics    growth factor and doubling time, vectorized
+    new_cases  the new case data, from the same case matrices
+    serialize  encode covid_data.json and new_case_data.json
+    formats    encode covid_data_columnar.json, covid_data.bin and
+               new_case_data.bin, the Lambda's other formats of the same
+               data (see chalicelib/columnar.py and chalicelib/binary.py)
+    gzip       gzip every encoded artifact, as S3Publisher does
+    total      all of the above, whose peak memory includes whatever the
+               earlier stages keep alive for the later ones, such as the
+               case data
+
+Each stage is timed with a RunTimer (see chalicelib/stage_timer.py). Its
+wall time is the fastest of --repeat runs, and its peak memory is what
+tracemalloc sees it allocate in one more run, since tracing slows everything
+down.
+
+The case data is built as a CaseData by default, as generate_all_json()
+does (see chalicelib/case_data.py), or with --builder dict as the
+date-first dict of dicts that build_covid_data() fills, to compare the two.
+
+Only the case metrics are recorded by default, as the Lambda does. With
+--deaths, every death metric is recorded too, in the same pass (see
+chalicelib/metrics.py). Those results are compared with their own
+baseline, baseline_deaths.json, and the time of each of their stages is
+reported as a ratio of the cases-only baseline's, which is what deaths
+cost. The ratios are saved with the deaths baseline.
+
+A whole run with deaths takes about 1.6 to 1.7 times as long as one
+without them. That misses the aim of well under twice as long. The run
+writes 1.8 to 1.95 times as much JSON, and serializing, encoding and
+gzipping it are most of the run. Reading the csv costs little extra, as
+deaths are read in the same pass.
+
+The checked-in baselines were recorded with the Python and numpy versions
+in requirements.txt and the CI, 3.6 and 1.18.2. Each results file records
+the versions it ran on, and a comparison says so when they differ from
+the baseline's.
+
+Usage, from the repository root:
+    python -m benchmarks.run
+    python -m benchmarks.run --scenario small nyt --output results.json
+    python -m benchmarks.run --save-baseline
+    python -m benchmarks.run --builder dict --output dict.json
+    python -m benchmarks.run --deaths --output deaths.json
+    python -m benchmarks.run --deaths --save-baseline
+
+The exit status is 1 if any stage is slower, or uses more memory, than the
+baseline by more than the tolerance. Results are only compared with a
+baseline run with the same builder and metrics.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import sys
+from collections import defaultdict
+
+import numpy as np
+
+from charting_covid_data.chalicelib.artifacts import iter_json_chunks, \
+    write_gzip
+from charting_covid_data.chalicelib.binary import write_case_data, \
+    write_metric_arrays, write_new_case_data
+from charting_covid_data.chalicelib.case_data import CaseData
+from charting_covid_data.chalicelib.case_matrix import CaseMatrix
+from charting_covid_data.chalicelib.columnar import ColumnarCaseData, \
+    get_columnar_case_data
+from charting_covid_data.chalicelib.create_covid_json import \
+    calculate_growth_metrics, correct_case_counts, get_series_matrices, \
+    read_case_counts, record_case_counts, record_growth_metrics, \
+    record_increases, record_per_capita
+from charting_covid_data.chalicelib.create_new_case_json import \
+    get_new_case_data
+from charting_covid_data.chalicelib.dates import DateTable
+from charting_covid_data.chalicelib.metrics import ALL_METRICS, \
+    DEFAULT_METRICS, get_metric_names, has_growth_metrics
+from charting_covid_data.chalicelib.stage_timer import RunTimer
+
+from .synthetic import generate_case_data
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+# The baseline of the results with every death metric, see --deaths
+DEATHS_BASELINE_PATH = os.path.join(ROOT, "benchmarks",
+                                    "baseline_deaths.json")
+
+# The parameters the Lambda runs the pipeline with
+GROWTH_METRIC_DAYS = 5
+MINIMUM_CASE_COUNT = 50
+
+STAGES = ["ingest", "metrics", "new_cases", "serialize", "formats", "gzip",
+          "total"]
+
+# How the case data is built, see run_pipeline()
+BUILDERS = ["lean", "dict"]
+
+# Synthetic scenarios, by the parameters of generate_case_data(). "nyt" is
+# the real data in source_data/.
+SCENARIOS = {
+    "small": {"counties": 300, "days": 60, "revision_rate": 0.002,
+              "gap_rate": 0.01},
+    "medium": {"counties": 3000, "days": 120, "revision_rate": 0.002,
+               "gap_rate": 0.01},
+    "large": {"counties": 3200, "days": 365, "revision_rate": 0.002,
+              "gap_rate": 0.01},
+    "nyt": None
+}
+
+# A stage only regresses if it's slower than the baseline by this fraction
+# and by at least MIN_REGRESSION_SECONDS, so tiny stages don't flag noise
+TIME_TOLERANCE = 0.5
+MIN_REGRESSION_SECONDS = 0.05
+MEMORY_TOLERANCE = 0.2
+
+
+def to_csv(rows: list) -> str:
+    output = io.StringIO()
+    csv.writer(output, lineterminator="\n").writerows(rows)
+    return output.getvalue()
+
+
+def load_scenario(name: str) -> (str, str, dict):
+    """
+    Returns a tuple of the county csv, state csv and fips_data for a
+    scenario.
+    """
+    params = SCENARIOS[name]
+    if params is None:
+        csv_data = []
+        for file_name in ["us-counties.csv", "us-states.csv"]:
+            # As fetch_case_data() decodes the download
+            with open(os.path.join(ROOT, "source_data", file_name),
+                      encoding="utf-8") as f:
+                csv_data.append(f.read())
+        with open(os.path.join(ROOT, "data", "fips_data.json"),
+                  encoding="utf-8") as f:
+            fips_data = json.load(f)
+        return csv_data[0], csv_data[1], fips_data
+
+    county_input, state_input, fips_data = generate_case_data(**params)
+    return to_csv(county_input), to_csv(state_input), fips_data
+
+
+def run_pipeline(county_csv: str, state_csv: str, fips_data: dict,
+        timer: RunTimer, builder: str="lean",
+        metrics: list=DEFAULT_METRICS) -> dict:
+    """
+    Runs every stage on a scenario's input, timing each with timer, and
+    building the case data with builder, one of BUILDERS, with the given
+    metrics. Returns the sizes of the encoded output.
+    """
+    if builder == "lean":
+        case_data, case_matrices = build_lean(county_csv, state_csv,
+            fips_data, timer, metrics)
+    else:
+        case_data, case_matrices = build_dict(county_csv, state_csv,
+            fips_data, timer, metrics)
+
+    with timer.stage("new_cases"):
+        new_case_data = {}
+        for case_matrix in case_matrices:
+            new_case_data.update(
+                get_new_case_data(case_matrix, MINIMUM_CASE_COUNT))
+
+    with timer.stage("serialize"):
+        encoded = [b"".join(iter_json_chunks(case_data)),
+                   b"".join(iter_json_chunks(new_case_data))]
+
+    with timer.stage("formats"):
+        columnar, binary = encode_formats(case_data, new_case_data, builder)
+        encoded.append(columnar)
+
+    with timer.stage("gzip"):
+        stats = [write_gzip([data], io.BytesIO())
+                 for data in encoded + binary]
+
+    return {"json_bytes": sum(len(data) for data in encoded),
+            "binary_bytes": sum(len(data) for data in binary),
+            "gzip_bytes": sum(stat["gzip_bytes"] for stat in stats)}
+
+
+def encode_formats(case_data, new_case_data: dict,
+        builder: str="lean") -> (bytes, list):
+    """
+    Returns a tuple of the encoded columnar case data and the binary
+    containers of the case data and new case data, built as the Lambda
+    builds them for a CaseData, or from the dict's entries for the dict
+    builder.
+    """
+    if builder == "lean":
+        metric_arrays = case_data.get_metric_arrays()
+        columnar_case_data = ColumnarCaseData(metric_arrays)
+        binary_case_data = write_metric_arrays(metric_arrays)
+    else:
+        columnar_case_data = get_columnar_case_data(case_data)
+        binary_case_data = write_case_data(case_data)
+    return (b"".join(iter_json_chunks(columnar_case_data)),
+            [binary_case_data, write_new_case_data(new_case_data)])
+
+
+def build_lean(county_csv: str, state_csv: str, fips_data: dict,
+        timer: RunTimer, metrics: list=DEFAULT_METRICS) -> (CaseData, list):
+    """
+    Returns a tuple of the case data, as a CaseData, and the case matrices,
+    built with the same steps as build_case_data(), for states then counties.
+    """
+    dates = DateTable()
+    case_data = CaseData(dates)
+    inputs = [(state_csv, True), (county_csv, False)]
+    deaths = bool(get_metric_names(metrics, "deaths"))
+    sources = []
+
+    with timer.stage("ingest"):
+        for csv_text, is_state_file in inputs:
+            case_matrix = CaseMatrix(deaths=deaths)
+            arrivals = read_case_counts(csv.reader(io.StringIO(csv_text)),
+                case_matrix, is_state_file, dates)
+            case_matrix.correct_downward_revisions()
+            sources.append((case_matrix, arrivals))
+
+    with timer.stage("metrics"):
+        for case_matrix, arrivals in sources:
+            for names, matrix, _ in get_series_matrices(case_matrix,
+                    metrics):
+                if has_growth_metrics(names):
+                    calculate_growth_metrics(matrix, GROWTH_METRIC_DAYS,
+                        vectorized=True)
+            case_data.add(case_matrix, arrivals, fips_data, metrics)
+
+    return case_data, [case_matrix for case_matrix, _ in sources]
+
+
+def build_dict(county_csv: str, state_csv: str, fips_data: dict,
+        timer: RunTimer, metrics: list=DEFAULT_METRICS) -> (dict, list):
+    """
+    Returns a tuple of the case data, as a date-first dict, and the case
+    matrices, built with the same steps as build_covid_data(), for states
+    then counties.
+    """
+    dates = DateTable()
+    case_data = defaultdict(dict)
+    inputs = [(state_csv, True), (county_csv, False)]
+    deaths = bool(get_metric_names(metrics, "deaths"))
+    case_matrices = []
+
+    with timer.stage("ingest"):
+        for csv_text, is_state_file in inputs:
+            case_matrix = CaseMatrix(deaths=deaths)
+            case_data, case_matrix = record_case_counts(
+                csv.reader(io.StringIO(csv_text)), case_data, case_matrix,
+                False, is_state_file, dates, metrics)
+            correct_case_counts(case_data, case_matrix, False, dates,
+                metrics)
+            record_per_capita(case_data, case_matrix, fips_data, False,
+                dates, metrics)
+            record_increases(case_data, case_matrix, False, dates, metrics)
+            case_matrices.append(case_matrix)
+
+    with timer.stage("metrics"):
+        for case_matrix in case_matrices:
+            record_growth_metrics(case_data, case_matrix, False,
+                GROWTH_METRIC_DAYS, dates, vectorized=True, metrics=metrics)
+
+    return case_data, case_matrices
+
+
+def run_scenario(name: str, repeat: int, builder: str="lean",
+        metrics: list=DEFAULT_METRICS) -> dict:
+    """
+    Returns the results of benchmarking a scenario: its parameters, input
+    size, output size and the seconds and peak bytes of each stage.
+    """
+    county_csv, state_csv, fips_data = load_scenario(name)
+    seconds = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        timer = RunTimer(name)
+        with timer.stage("total"):
+            sizes = run_pipeline(county_csv, state_csv, fips_data, timer,
+                builder, metrics)
+        for stage, entry in timer.stages.items():
+            seconds[stage].append(entry["wall_ms"] / 1000)
+    memory_timer = RunTimer(name, trace_memory=True)
+    run_pipeline(county_csv, state_csv, fips_data, memory_timer, builder,
+                 metrics)
+    # Only the outermost stage measures peak memory, so the total is
+    # measured in a run of its own.
+    total_timer = RunTimer(name, trace_memory=True)
+    with total_timer.stage("total"):
+        run_pipeline(county_csv, state_csv, fips_data, total_timer, builder,
+                     metrics)
+    memory_timer.stages["total"] = total_timer.stages["total"]
+
+    return {
+        "params": SCENARIOS[name] or {"source": "source_data"},
+        "rows": {"counties": county_csv.count("\n") - 1,
+                 "states": state_csv.count("\n") - 1},
+        "sizes": sizes,
+        "stages": {stage: {"seconds": round(min(seconds[stage]), 4),
+                           "peak_bytes":
+                               memory_timer.stages[stage]["peak_bytes"]}
+                   for stage in STAGES}
+    }
+
+
+def get_configuration(results: dict) -> dict:
+    """
+    Returns the builder and metrics that produced results. Results from
+    before they were recorded were built lean with the default metrics.
+    """
+    return {"builder": results.get("builder", BUILDERS[0]),
+            "metrics": list(results.get("metrics", DEFAULT_METRICS))}
+
+
+def compare(results: dict, baseline: dict,
+        time_tolerance: float=TIME_TOLERANCE,
+        memory_tolerance: float=MEMORY_TOLERANCE) -> list:
+    """
+    Returns a description of each stage in results that regressed from the
+    baseline. Scenarios and stages missing from either are skipped, and so
+    are results from a different builder or metrics than the baseline's,
+    since they do different work.
+    """
+    regressions = []
+    if get_configuration(results) != get_configuration(baseline):
+        return regressions
+    for name, scenario in results["scenarios"].items():
+        baseline_scenario = baseline["scenarios"].get(name)
+        if baseline_scenario is None:
+            continue
+        for stage, result in scenario["stages"].items():
+            expected = baseline_scenario["stages"].get(stage)
+            if expected is None:
+                continue
+            seconds, expected_seconds = result["seconds"], expected["seconds"]
+            if seconds > expected_seconds * (1 + time_tolerance) and \
+                    seconds - expected_seconds > MIN_REGRESSION_SECONDS:
+                regressions.append("{} {}: {:.3f}s, baseline {:.3f}s".format(
+                    name, stage, seconds, expected_seconds))
+            peak, expected_peak = result["peak_bytes"], expected["peak_bytes"]
+            if peak > expected_peak * (1 + memory_tolerance):
+                regressions.append("{} {}: {} bytes, baseline {} bytes".format(
+                    name, stage, peak, expected_peak))
+    return regressions
+
+
+def get_ratios(results: dict, baseline: dict) -> dict:
+    """
+    Returns the ratio of each stage's seconds in results to the baseline's,
+    and of the encoded sizes, for each scenario in both, such as the cost of
+    deaths over a cases-only baseline.
+
+    Example:
+        {"medium": {"ingest": 1.21, ..., "total": 1.74, "json_bytes": 1.86}}
+    """
+    ratios = {}
+    for name, scenario in results["scenarios"].items():
+        baseline_scenario = baseline["scenarios"].get(name)
+        if baseline_scenario is None:
+            continue
+        ratios[name] = {
+            stage: round(result["seconds"] /
+                         baseline_scenario["stages"][stage]["seconds"], 2)
+            for stage, result in scenario["stages"].items()
+            if baseline_scenario["stages"].get(stage, {}).get("seconds")}
+        for size in ["json_bytes", "gzip_bytes"]:
+            ratios[name][size] = round(
+                scenario["sizes"][size] / baseline_scenario["sizes"][size], 2)
+    return ratios
+
+
+def get_environment(results: dict) -> str:
+    return "Python {}, numpy {}".format(results.get("python"),
+                                        results.get("numpy"))
+
+
+def print_scenario(name: str, scenario: dict) -> None:
+    print("{} ({} county rows, {} state rows, {} json bytes, {} binary bytes, "
+          "{} gzip bytes)".format(
+              name, scenario["rows"]["counties"], scenario["rows"]["states"],
+              scenario["sizes"]["json_bytes"],
+              scenario["sizes"]["binary_bytes"],
+              scenario["sizes"]["gzip_bytes"]))
+    for stage, result in scenario["stages"].items():
+        print("  {:<10} {:>8.3f}s {:>8.1f}MB".format(
+            stage, result["seconds"], result["peak_bytes"] / 1024 / 1024))
+
+
+def main(argv: list=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the data pipeline on synthetic and real data")
+    parser.add_argument("--scenario", nargs="+", choices=list(SCENARIOS),
+                        default=list(SCENARIOS),
+                        help="Scenarios to run. Default is all of them")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per scenario, of which the fastest counts")
+    parser.add_argument("--output",
+                        help="Path to write the results to as JSON")
+    parser.add_argument("--baseline",
+                        help="Path of the results to compare with. Default "
+                             "is baseline.json, or baseline_deaths.json "
+                             "with --deaths")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Write the results to the baseline instead of "
+                             "comparing with it")
+    parser.add_argument("--tolerance", type=float, default=TIME_TOLERANCE,
+                        help="How much slower than the baseline a stage can "
+                             "be, as a fraction")
+    parser.add_argument("--builder", choices=BUILDERS, default=BUILDERS[0],
+                        help="How the case data is built. Default is lean, "
+                             "as the Lambda does")
+    parser.add_argument("--deaths", action="store_true",
+                        help="Record every death metric as well as the case "
+                             "metrics")
+    args = parser.parse_args(argv)
+    metrics = ALL_METRICS if args.deaths else DEFAULT_METRICS
+
+    results = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "builder": args.builder,
+        "metrics": metrics,
+        "scenarios": {}
+    }
+    for name in args.scenario:
+        results["scenarios"][name] = run_scenario(name, args.repeat,
+                                                   args.builder, metrics)
+        print_scenario(name, results["scenarios"][name])
+
+    baseline_path = args.baseline or (
+        DEATHS_BASELINE_PATH if args.deaths else BASELINE_PATH)
+    if args.deaths and os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            cases_only = json.load(f)
+        if get_configuration(cases_only)["builder"] == args.builder:
+            results["cases_only_ratios"] = get_ratios(results, cases_only)
+            print("Deaths over the cases-only {}:".format(BASELINE_PATH))
+            for name, ratios in results["cases_only_ratios"].items():
+                print("  {:<8} {}".format(name, ", ".join(
+                    "{} {:.2f}x".format(key, ratio)
+                    for key, ratio in ratios.items())))
+
+    output = baseline_path if args.save_baseline else args.output
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print("Wrote results to {}".format(output))
+    if args.save_baseline or not os.path.exists(baseline_path):
+        return 0
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    configuration = get_configuration(baseline)
+    if get_configuration(results) != configuration:
+        print("Not comparing with {}, which was run with the {} builder and "
+              "metrics {}".format(baseline_path, configuration["builder"],
+                                  ", ".join(configuration["metrics"])))
+        return 0
+    if get_environment(results) != get_environment(baseline):
+        print("Comparing with {}, which was run on {}, not {}".format(
+            baseline_path, get_environment(baseline),
+            get_environment(results)))
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print("Regression: {}".format(regression))
+    if not regressions:
+        print("No regressions from {}".format(baseline_path))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""
+Synthetic case data shaped like the NYT's us-counties.csv and us-states.csv,
+for benchmarking the pipeline at sizes the real data hasn't reached yet.
+
+Each county's outbreak starts on a random day and its cumulative case count
+grows logistically from there, with some noise. Some days are revised down,
+as the NYT does when cases are found to be in error or reassigned, and some
+are missing altogether. States report the sum of their counties. Deaths
+are a fixed share of each county's cases, DEATH_RATE, so they're revised
+with them. Like the NYT data, some New York City rows have no FIPS and some
+counties are "Unknown".
+
+The same parameters and seed always generate the same data.
+
+Example:
+    county_input, state_input, fips_data = generate_case_data(
+        counties=3000, days=180, revision_rate=0.002, gap_rate=0.01)
+"""
+import math
+import random
+from datetime import date, timedelta
+
+COUNTY_HEADER = ["date", "county", "state", "fips", "cases", "deaths"]
+STATE_HEADER = ["date", "state", "fips", "cases", "deaths"]
+
+# The first day of the NYT data
+FIRST_DATE = date(2020, 1, 21)
+
+# The number of states and territories in the NYT data
+STATE_COUNT = 55
+
+# The share of counties that report an "Unknown" county, with no FIPS, too
+UNKNOWN_RATE = 0.05
+
+# The share of cases that are deaths. It isn't random, so the cases are the
+# same as they were before there were deaths.
+DEATH_RATE = 0.02
+
+
+def generate_case_data(counties: int, days: int, revision_rate: float=0.0,
+        gap_rate: float=0.0, seed: int=0) -> (list, list, dict):
+    """
+    Returns a tuple of county csv rows, state csv rows and fips_data (as in
+    fips_data.json) for the given number of counties and days, in date order
+    with a header first, as csv.reader would return them.
+
+    revision_rate is the chance that a county's count on a given day is
+    revised down below the previous day's, and gap_rate the chance that a
+    county is missing from a day.
+    """
+    rng = random.Random(seed)
+    states = ["{:02d}".format(state) for state in range(1, STATE_COUNT + 1)]
+    fips_data = {state: {"county": "", "state": "State " + state,
+                         "population": 0}
+                 for state in states}
+
+    outbreaks = []
+    for county in range(counties):
+        state = states[county % len(states)]
+        fips = "{}{:03d}".format(state, county // len(states) + 1)
+        population = int(10 ** rng.uniform(3, 6.5))
+        fips_data[fips] = {"county": "County " + fips,
+                           "state": fips_data[state]["state"],
+                           "population": population}
+        fips_data[state]["population"] += population
+        outbreaks.append({
+            "fips": fips,
+            "state": state,
+            "start": rng.randrange(days),
+            "peak": population * rng.uniform(0.001, 0.05),
+            "rate": rng.uniform(0.05, 0.3),
+            "unknown": rng.random() < UNKNOWN_RATE
+        })
+    # Like New York City, the first county reports without a FIPS
+    if outbreaks:
+        outbreaks[0]["fips"] = ""
+
+    county_input = [COUNTY_HEADER]
+    state_input = [STATE_HEADER]
+    for day in range(days):
+        date_string = (FIRST_DATE + timedelta(days=day)).isoformat()
+        state_cases = {}
+        state_deaths = {}
+        for outbreak in outbreaks:
+            if day < outbreak["start"]:
+                continue
+            cases = get_cases(outbreak, day, rng)
+            if rng.random() < revision_rate:
+                cases = max(outbreak.get("reported", cases) - 1 -
+                            rng.randrange(10), 0)
+            outbreak["reported"] = cases
+            deaths = int(cases * DEATH_RATE)
+            state_cases[outbreak["state"]] = \
+                state_cases.get(outbreak["state"], 0) + cases
+            state_deaths[outbreak["state"]] = \
+                state_deaths.get(outbreak["state"], 0) + deaths
+            if rng.random() < gap_rate:
+                continue
+
+            state_name = fips_data[outbreak["state"]]["state"]
+            if outbreak["fips"]:
+                county_name = fips_data[outbreak["fips"]]["county"]
+            else:
+                county_name = "New York City"
+            county_input.append([date_string, county_name, state_name,
+                                 outbreak["fips"], str(cases), str(deaths)])
+            if outbreak["unknown"]:
+                county_input.append([date_string, "Unknown", state_name, "",
+                                     str(cases // 10), str(deaths // 10)])
+
+        for state in sorted(state_cases):
+            state_input.append([date_string, fips_data[state]["state"],
+                                state, str(state_cases[state]),
+                                str(state_deaths[state])])
+
+    # States with no counties don't report
+    fips_data = {fips: entry for fips, entry in fips_data.items()
+                 if entry["population"]}
+    return county_input, state_input, fips_data
+
+
+def get_cases(outbreak: dict, day: int, rng: random.Random) -> int:
+    """
+    Returns the cumulative case count of an outbreak on a given day, which
+    never goes down unless revised.
+    """
+    elapsed = day - outbreak["start"]
+    expected = outbreak["peak"] / (1 + math.exp(-outbreak["rate"] *
+                                                (elapsed - 30)))
+    cases = max(int(expected * rng.uniform(0.95, 1.05)), 1)
+    return max(cases, outbreak.get("reported", 0))
@@ -1,104 +1,163 @@
-import json
+import os
 from datetime import datetime
-from gzip import GzipFile
-from io import BytesIO
 
 from chalice import Chalice, Rate
 import boto3
-import gzip
 
-from chalicelib.update_case_data import update_case_data
-from chalicelib.create_covid_json import generate_case_json
-from chalicelib.create_new_case_json import generate_new_case_json
-from chalicelib.push_to_s3 import upload_file, clear_cloudfront_cache
+from chalicelib.artifacts import DEFAULT_COMPRESSLEVEL
+from chalicelib.binary import write_metric_arrays, write_new_case_data
+from chalicelib.update_case_data import fetch_case_data, load_fetch_state, \
+    save_fetch_state
+from chalicelib.columnar import ColumnarCaseData
+from chalicelib.fips_data import FipsDataCache
+from chalicelib.metrics import DEFAULT_METRICS, parse_metrics
+from chalicelib.pipeline import generate_all_json
+from chalicelib.publish import LocalPublisher, S3Publisher
+from chalicelib.shards import write_shards
+from chalicelib.stage_timer import RunTimer, record_sizes, stage
+from chalicelib.storage import LocalStore, S3Store
 
 app = Chalice(app_name='charting_covid_data')
 
 CLOUDFRONT_DISTRIBUTION_ID = "EMZKVG33KBTNS"
 BUCKET = "charting-covid-prod"
 
+# Where the pipeline checkpoint and fetch state are kept between runs
+CHECKPOINT_PREFIX = "pipeline"
+LOCAL_CHECKPOINT_DIRECTORY = "/tmp/charting_covid_data"
+
+# The gzip level for the published JSON, from 0 (none) to 9 (smallest)
+COMPRESSLEVEL = int(os.environ.get("COMPRESSLEVEL", DEFAULT_COMPRESSLEVEL))
+
+# Comma separated ways to shard covid_data.json, alongside the full file, e.g.
+# "state" or "date,state". See chalicelib/shards.py
+SHARD_BY = [shard_by for shard_by in os.environ.get("SHARD_BY", "").split(",")
+            if shard_by]
+
+# Set TRACE_MEMORY=1 to measure the peak memory of each stage when debugging.
+# It's off by default, since it slows the run down
+TRACE_MEMORY = os.environ.get("TRACE_MEMORY", "0").lower() in ["1", "true"]
+
+# Comma separated stages to profile with cProfile, e.g.
+# "record_case_counts,record_growth_metrics". See chalicelib/stage_timer.py
+PROFILE_STAGES = [name for name in
+                  os.environ.get("PROFILE_STAGES", "").split(",") if name]
+# Profiles are written here, and to the bucket under PROFILE_PREFIX if
+# PROFILE_UPLOAD is set
+PROFILE_DIRECTORY = "/tmp/profiles"
+PROFILE_PREFIX = "profiles"
+PROFILE_UPLOAD = \
+    os.environ.get("PROFILE_UPLOAD", "").lower() in ["1", "true"]
+
+# Processes to calculate growth metrics in, a state at a time, see
+# chalicelib/parallel_metrics.py. Lambda has no /dev/shm for a process pool's
+# queues, so leave it at 1 there.
+METRIC_WORKERS = int(os.environ.get("METRIC_WORKERS", 1))
+
+# Comma separated metrics to publish for each date and FIPS, e.g.
+# "cases,deaths,increase,deaths_increase". Deaths are only read if there are
+# death metrics. See chalicelib/metrics.py
+METRICS = parse_metrics(os.environ.get("METRICS", ",".join(DEFAULT_METRICS)))
+
+# Kept between invocations while the container is warm, with a copy in /tmp,
+# so fips_data.json is only downloaded when it changes
+FIPS_DATA_CACHE = FipsDataCache(BUCKET,
+                                store=LocalStore(LOCAL_CHECKPOINT_DIRECTORY))
+
 # This gets set when lambda is run as a chron. If False it means we're running
 # locally
 event = False
 
 
-def write_dict_to_gzipped_json(data, output_filename):
-    json_str = json.dumps(data)
-    json_bytes = json_str.encode("utf-8")
-    with gzip.GzipFile(output_filename, "w") as output:
-        output.write(json_bytes)
-    return output_filename
-
-
 # For local development, uncomment app.route and index, and comment out
 # app.schedule and case_data
 # @app.route('/')
 # def index():
 @app.schedule(Rate(4, unit=Rate.HOURS))
 def case_data(event):
-    start = datetime.now()
-
-    # read population data from our s3 bucket
-    print("Get FIPS data")
-    print("time delta: {}".format((datetime.now() - start).seconds))
+    """
+    Fetches the NYT data once and writes both covid_data.json and
+    new_case_data.json from it.
+    """
     s3 = boto3.client("s3")
-    compressed_object = s3.get_object(Bucket=BUCKET, Key="data/fips_data.json")
-    bytestream = BytesIO(compressed_object['Body'].read())
-    fips_data = json.loads(GzipFile(None,
-        'rb', fileobj=bytestream).read().decode('utf-8'))
-
-    # fetch new cases
-    print("Getting case data")
-    print("time delta: {}".format((datetime.now() - start).seconds))
-    county_input, state_input = update_case_data()
-
-    # update case file
-    print("Updating cases")
-    print("time delta: {}".format((datetime.now() - start).seconds))
-    case_data = generate_case_json(county_input, state_input, fips_data, 5)
-    # if event, we are on s3 running as a chron
-    if event:
-        print("GZIP")
-        print("time delta: {}".format((datetime.now() - start).seconds))
-        case_json = write_dict_to_gzipped_json(case_data, "/tmp/covid_data.json.gz")
+    profile_stores = [LocalStore(PROFILE_DIRECTORY)]
+    if PROFILE_UPLOAD:
+        profile_stores.append(S3Store(BUCKET, PROFILE_PREFIX, client=s3))
+    with RunTimer("case_data", trace_memory=TRACE_MEMORY,
+                  profile_stages=PROFILE_STAGES,
+                  profile_stores=profile_stores):
+        if event:
+            store = S3Store(BUCKET, CHECKPOINT_PREFIX, client=s3)
+        else:
+            store = LocalStore(LOCAL_CHECKPOINT_DIRECTORY)
+        # FULL_REBUILD ignores the state saved by the last run, forcing us to
+        # fetch, compute and publish everything
+        full_rebuild = \
+            os.environ.get("FULL_REBUILD", "").lower() in ["1", "true"]
+
+        # fetch new cases, unless they haven't changed since the last run
+        print("Getting case data")
+        fetch_state = {} if full_rebuild else load_fetch_state(store)
+        case_input, fetch_state = fetch_case_data(fetch_state)
+        if case_input is None:
+            print("Case data unchanged, skipping update")
+            return "Case Data Unchanged"
+        county_input, state_input = case_input
+
+        # read population data from our s3 bucket
+        print("Get FIPS data")
+        with stage("fips_data"):
+            fips_data = FIPS_DATA_CACHE.get(s3)
+
+        # update case and new case files, incrementally from the last run's
+        # checkpoint unless FULL_REBUILD is set
+        print("Updating cases")
+        case_data, new_case_data = generate_all_json(county_input,
+            state_input, fips_data, 5, 50, checkpoint_store=store,
+            full_rebuild=full_rebuild, metric_workers=METRIC_WORKERS,
+            metrics=METRICS)
+        with stage("serialize"):
+            # both layouts come straight from the case matrices, a metric at
+            # a time, rather than from the case data's entries
+            metric_arrays = case_data.get_metric_arrays()
+            columnar_case_data = ColumnarCaseData(metric_arrays)
+            binary_data = [
+                ("covid_data.bin", write_metric_arrays(metric_arrays)),
+                ("new_case_data.bin", write_new_case_data(new_case_data))]
+        # if event, we are on s3 running as a chron
+        if event:
+            # gzip each artifact as it's encoded and stream it straight to S3
+            publisher = S3Publisher(BUCKET, client=s3,
+                                    compresslevel=COMPRESSLEVEL)
+        else:
+            publisher = LocalPublisher("../data")
         print("Attempting to upload")
-        print("time delta: {}".format((datetime.now() - start).seconds))
-        upload_file(case_json, destination="data", bucket="charting-covid-prod",
-            separator="/tmp")
+        with stage("publish"):
+            for name, data in [("covid_data.json", case_data),
+                               ("covid_data_columnar.json", columnar_case_data),
+                               ("new_case_data.json", new_case_data)]:
+                stats = publisher.publish_json(name, data)
+                record_sizes(name, stats)
+                print("Uploaded {}: {}".format(name, stats))
+            for name, data in binary_data:
+                stats = publisher.publish_bytes(name, data)
+                record_sizes(name, stats)
+                print("Uploaded {}: {}".format(name, stats))
+        with stage("publish_shards"):
+            for shard_by in SHARD_BY:
+                manifest = write_shards(case_data, shard_by,
+                                        publisher.publish_json)
+                print("Uploaded {} covid_data shards by {}".format(
+                    len(manifest["shards"]), shard_by))
         print("Uploaded case data")
-        print("time delta: {}".format((datetime.now() - start).seconds))
-        clear_cloudfront_cache()
-        print("Cache cleared")
-    else:
-        with open("../data/covid_data.json", "w") as output:
-            output.write(json.dumps(case_data))
-
-    print("time delta: {}".format((datetime.now() - start).seconds))
-    return "Case Update Succeeded"
-
-
-# For local development, uncomment app.route and index, and comment out
-# app.schedule and new_case_data
-# @app.route('/')
-# def index():
-@app.schedule(Rate(4, unit=Rate.HOURS))
-def new_case_data(event):
-    # fetch new cases
-    county_input, state_input = update_case_data()
-
-    # update data
-    new_case_data = generate_new_case_json(county_input, state_input, 50)
-    # if event, we are on s3 running as a chron
-    if event:
-        new_case_json = write_dict_to_gzipped_json(new_case_data,
-            "/tmp/new_case_data.json.gz")
-        upload_file(new_case_json, destination="data", bucket="charting-covid-prod",
-            separator="/tmp")
-    else:
-        with open("../data/new_case_data.json", "w") as output:
-            output.write(json.dumps(new_case_data))
+        # Invalidates only what changed in the cache
+        with stage("invalidate"):
+            publisher.finish()
 
-    return "New Case Update Succeeded"
+        # Only now that everything is published do we remember what we
+        # fetched
+        save_fetch_state(store, fetch_state)
+        return "Case Update Succeeded"
 
 
 @app.route("/dummy")
@@ -112,6 +171,9 @@ def dummy():
         ddb.get_object(Bucket="matthewparrilla.com")
         ddb.put_object(Bucket="matthewparrilla.com")
         ddb.put_object_acl(Bucket="matthewparrilla.com", ACL="public-read")
+        # Failed streaming uploads of the case data are aborted
+        ddb.abort_multipart_upload(Bucket="matthewparrilla.com",
+            Key="dontmatchever", UploadId="dontmatchever")
     except Exception as e:
         print("move along")
 
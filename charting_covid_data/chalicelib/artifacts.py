@@ -0,0 +1,306 @@
+"""
+Writes the data we publish, such as covid_data.json, gzipped.
+
+JSON is encoded a chunk at a time straight into a gzip stream, so the
+whole encoded string is never held in memory. The gzip stream can go to any
+binary file, or be uploaded to S3 as it's written with MultipartUpload,
+without a round trip through /tmp.
+
+Example:
+    stats = upload_json_gzip(case_data, "charting-covid-prod",
+                             "data/covid_data.json")
+    # {"json_bytes": 52428800, "gzip_bytes": 4194304, "sha256": "9f86...",
+    #  "parts": 1, "seconds": 3.2}
+"""
+import gzip
+import hashlib
+import json
+import time
+from collections.abc import Mapping
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+import boto3
+import brotli
+
+# The same as gzip's default. Lower levels are faster but compress less.
+DEFAULT_COMPRESSLEVEL = 9
+
+# How much encoded JSON to collect before compressing it
+CHUNK_SIZE = 64 * 1024
+
+# S3 requires every part of a multipart upload except the last to be at least
+# 5 MB
+MIN_PART_SIZE = 5 * 1024 * 1024
+PART_SIZE = 8 * 1024 * 1024
+
+# The same object settings upload_file() in push_to_s3.py uses for gzipped
+# JSON, other than the ContentType
+PUBLISHED_GZIP_ARGS = {
+    "ACL": "public-read",
+    "ContentEncoding": "gzip",
+    "CacheControl": "no-cache, max-age=0"
+}
+
+
+def iter_json_chunks(data, chunk_size: int=CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yields the JSON encoding of data as chunks of about chunk_size bytes. The
+    chunks join up to exactly json.dumps(data).encode("utf-8").
+
+    data can also be a Mapping that isn't a dict, such as CaseData (see
+    case_data.py), which is encoded as a dict of the same items would be, one
+    value at a time.
+    """
+    pending = []
+    pending_size = 0
+    for fragment in iter_json_fragments(data):
+        pending.append(fragment)
+        pending_size += len(fragment)
+        if pending_size >= chunk_size:
+            yield "".join(pending).encode("utf-8")
+            pending = []
+            pending_size = 0
+    if pending:
+        yield "".join(pending).encode("utf-8")
+
+
+def iter_json_fragments(data) -> Iterator[str]:
+    """
+    Yields the fragments of the JSON encoding of data, as
+    JSONEncoder.iterencode() does, for data that may be a Mapping.
+    """
+    encoder = json.JSONEncoder()
+    if isinstance(data, dict) or not isinstance(data, Mapping):
+        yield from encoder.iterencode(data)
+        return
+    yield "{"
+    for index, (key, value) in enumerate(data.items()):
+        if index:
+            yield ", "
+        yield encoder.encode(key)
+        yield ": "
+        yield from encoder.iterencode(value)
+    yield "}"
+
+
+class CountingWriter:
+    """
+    Passes writes through to a binary file, counting the bytes written.
+    """
+
+    def __init__(self, output: BinaryIO):
+        self.output = output
+        self.bytes_written = 0
+
+    def write(self, data: bytes) -> int:
+        self.output.write(data)
+        self.bytes_written += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        if hasattr(self.output, "flush"):
+            self.output.flush()
+
+
+class MultipartUpload:
+    """
+    A binary file-like object that uploads whatever is written to it to an S3
+    object, part_size bytes at a time, so at most one part is held in memory.
+
+    Use it as a context manager. The upload is completed when the block
+    exits, or aborted if it exits with an exception, so a failed write never
+    leaves a partial object behind. The multipart upload is only started once
+    there's a full part to upload; anything smaller is sent with a single
+    put_object() when the block exits.
+
+    Example:
+        with MultipartUpload(s3, "charting-covid-prod", "data/x.json.gz",
+                             ContentType="application/json",
+                             **PUBLISHED_GZIP_ARGS) as upload:
+            upload.write(data)
+    """
+
+    def __init__(self, client, bucket: str, key: str,
+            part_size: int=PART_SIZE, **create_args):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError("part_size must be at least {} bytes".format(
+                MIN_PART_SIZE))
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.create_args = create_args
+        self.upload_id = None
+        self.buffer = bytearray()
+        # The ETag and number of each part uploaded so far
+        self.parts = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.complete()
+        elif self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket,
+                Key=self.key, UploadId=self.upload_id)
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def flush(self) -> None:
+        # Parts have to be a minimum size, so there's nothing we can flush
+        # early.
+        pass
+
+    def _upload_part(self, body: bytes) -> None:
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key,
+                **self.create_args)["UploadId"]
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(Bucket=self.bucket, Key=self.key,
+            UploadId=self.upload_id, PartNumber=part_number, Body=body)
+        self.parts.append({"ETag": response["ETag"],
+                           "PartNumber": part_number})
+
+    def complete(self) -> None:
+        if not self.parts:
+            # It all fit in one part, so there's no need for a multipart
+            # upload.
+            self.client.put_object(Bucket=self.bucket, Key=self.key,
+                Body=bytes(self.buffer), **self.create_args)
+            self.buffer = bytearray()
+            return
+        if self.buffer:
+            self._upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.client.complete_multipart_upload(Bucket=self.bucket,
+            Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts})
+
+
+def write_gzip(chunks: Iterable[bytes], output: BinaryIO,
+        compresslevel: int=DEFAULT_COMPRESSLEVEL) -> dict:
+    """
+    Writes chunks of bytes to a binary file as a gzip stream. Returns stats
+    about what was written, including the sha256 of the uncompressed bytes:
+        {"bytes": 52428800, "gzip_bytes": 4194304, "sha256": "9f86...",
+         "seconds": 3.1}
+
+    The gzip header has no timestamp, so the same data always produces the
+    same bytes.
+    """
+    start = time.perf_counter()
+    counter = CountingWriter(output)
+    raw_bytes = 0
+    content_hash = hashlib.sha256()
+    with gzip.GzipFile(fileobj=counter, mode="wb",
+                       compresslevel=compresslevel, mtime=0) as compressed:
+        for chunk in chunks:
+            compressed.write(chunk)
+            raw_bytes += len(chunk)
+            content_hash.update(chunk)
+    return {
+        "bytes": raw_bytes,
+        "gzip_bytes": counter.bytes_written,
+        "sha256": content_hash.hexdigest(),
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+
+
+def json_stats(stats: dict) -> dict:
+    """
+    Returns the stats of write_gzip() for JSON, with bytes as json_bytes.
+    """
+    return {("json_bytes" if key == "bytes" else key): value
+            for key, value in stats.items()}
+
+
+def write_json_gzip(data, output: BinaryIO,
+        compresslevel: int=DEFAULT_COMPRESSLEVEL) -> dict:
+    """
+    Writes data to a binary file as gzipped JSON. Returns the same stats as
+    write_gzip(), with the size of the JSON as json_bytes.
+    """
+    return json_stats(write_gzip(iter_json_chunks(data), output,
+                                 compresslevel))
+
+
+def save_json(data, path: str) -> dict:
+    """
+    Writes data to a file at path as plain JSON, for local development.
+    Returns the same stats as write_json_gzip(), without gzip_bytes.
+    """
+    start = time.perf_counter()
+    json_bytes = 0
+    content_hash = hashlib.sha256()
+    with open(path, "wb") as output:
+        for chunk in iter_json_chunks(data):
+            output.write(chunk)
+            json_bytes += len(chunk)
+            content_hash.update(chunk)
+    return {
+        "json_bytes": json_bytes,
+        "sha256": content_hash.hexdigest(),
+        "seconds": round(time.perf_counter() - start, 3)
+    }
+
+
+def save_json_gzip(data, path: str,
+        compresslevel: int=DEFAULT_COMPRESSLEVEL) -> dict:
+    """
+    Writes data to a file at path as gzipped JSON. Returns the same stats as
+    write_json_gzip().
+    """
+    with open(path, "wb") as output:
+        return write_json_gzip(data, output, compresslevel)
+
+
+def upload_gzip(chunks: Iterable[bytes], bucket: str, key: str,
+        content_type: str, client=None,
+        compresslevel: int=DEFAULT_COMPRESSLEVEL,
+        part_size: int=PART_SIZE) -> dict:
+    """
+    Uploads chunks of bytes to S3 as a gzipped object, with the same public
+    settings upload_file() gives gzipped files. Returns the stats of
+    write_gzip(), plus the number of parts uploaded (0 if it was small enough
+    for a single put), with seconds covering the whole upload.
+    """
+    start = time.perf_counter()
+    client = client or boto3.client("s3")
+    with MultipartUpload(client, bucket, key, part_size,
+                         ContentType=content_type,
+                         **PUBLISHED_GZIP_ARGS) as upload:
+        stats = write_gzip(chunks, upload, compresslevel)
+    stats["parts"] = len(upload.parts)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+def upload_json_gzip(data, bucket: str, key: str, client=None,
+        compresslevel: int=DEFAULT_COMPRESSLEVEL,
+        part_size: int=PART_SIZE) -> dict:
+    """
+    Uploads data to S3 as gzipped JSON. Returns the same stats as
+    upload_gzip(), with the size of the JSON as json_bytes.
+    """
+    return json_stats(upload_gzip(iter_json_chunks(data), bucket, key,
+        "application/json", client, compresslevel, part_size))
+
+
+def decompress(data: bytes, content_encoding: Optional[str]) -> bytes:
+    """
+    Returns the bytes of an object on S3, given its ContentEncoding. The
+    deploy script uploads data such as fips_data.json as either gzip or
+    brotli, whichever is smaller.
+    """
+    if content_encoding == "br":
+        return brotli.decompress(data)
+    if content_encoding == "gzip":
+        return gzip.decompress(data)
+    return data
@@ -0,0 +1,223 @@
+"""
+A binary container for covid_data and new_case_data, which the browser can
+read straight into typed arrays rather than parsing JSON.
+
+The layout, with every number little-endian:
+    magic          4 bytes, b"CCDB"
+    version        uint32
+    header length  uint32
+    header         UTF-8 JSON, padded with spaces to a multiple of 8 bytes
+    columns        one contiguous int32 or float32 array per column, each
+                   starting on a multiple of 8 bytes
+
+The header holds the FIPS index and where to find each column:
+    {"kind": "covid_data",
+     "fips": ["53", "53061", ...],
+     "dates": ["2020-01-21", ...],
+     "columns": {
+        "cases": {"dtype": "int32", "offset": 0, "length": 1200},
+        ...
+     }
+    }
+offset is from the start of the columns, right after the header, so a
+column maps directly onto e.g.
+    new Int32Array(buffer, 12 + headerLength + offset, length)
+
+covid_data has a column for each metric, laid out like the columnar JSON
+(see columnar.py): the value for fips[i] on dates[d] is at d * len(fips) + i.
+Missing int32 values are MISSING_INT32 and missing float32 values are NaN.
+The death metrics only have columns if they're in the case data.
+
+new_case_data has an "increases" float32 column with every FIPS' increases
+one after another, and an "offsets" int32 column of len(fips) + 1 entries,
+where the increases for fips[i] are increases[offsets[i]:offsets[i + 1]].
+"""
+import json
+import struct
+
+import numpy as np
+
+from .columnar import get_columnar_case_data, get_metrics
+
+MAGIC = b"CCDB"
+VERSION = 1
+
+# The struct format of the magic, version and header length
+PREFIX_FORMAT = "<4sII"
+
+# Every column starts on a multiple of this many bytes, which is enough for
+# any typed array
+ALIGNMENT = 8
+
+MISSING_INT32 = np.iinfo(np.int32).min
+
+# The type of each covid_data metric column
+METRIC_DTYPES = {
+    "cases": "int32",
+    "increase": "int32",
+    "per_capita": "float32",
+    "growth_factor": "float32",
+    "doubling_time": "float32",
+    "deaths": "int32",
+    "deaths_increase": "int32",
+    "deaths_per_capita": "float32",
+    "deaths_growth_factor": "float32",
+    "deaths_doubling_time": "float32"
+}
+
+
+def padding(size: int) -> int:
+    """
+    Returns how many bytes it takes to pad size to a multiple of ALIGNMENT.
+    """
+    return -size % ALIGNMENT
+
+
+def write_container(header: dict, columns: dict) -> bytes:
+    """
+    Returns a container with the given header and columns, where columns maps
+    each column name to a 1-dimensional numpy array. The "columns" entry of
+    the header is filled in.
+    """
+    arrays = {name: np.ascontiguousarray(
+                  array, dtype=array.dtype.newbyteorder("<"))
+              for name, array in columns.items()}
+    header["columns"] = {}
+    offset = 0
+    for name, array in arrays.items():
+        header["columns"][name] = {"dtype": array.dtype.name,
+                                   "offset": offset, "length": len(array)}
+        offset += array.nbytes + padding(array.nbytes)
+
+    encoded_header = json.dumps(header).encode("utf-8")
+    encoded_header += b" " * padding(struct.calcsize(PREFIX_FORMAT) +
+                                     len(encoded_header))
+    parts = [struct.pack(PREFIX_FORMAT, MAGIC, VERSION, len(encoded_header)),
+             encoded_header]
+    for array in arrays.values():
+        # joined straight from the arrays' buffers, rather than copied out
+        parts.append(memoryview(array).cast("B"))
+        parts.append(b"\0" * padding(array.nbytes))
+    return b"".join(parts)
+
+
+def read_container(data: bytes) -> (dict, dict):
+    """
+    Returns a tuple of the header and the columns of a container written by
+    write_container(). The columns are read-only numpy arrays viewing data,
+    rather than copies of it.
+    """
+    magic, version, header_length = struct.unpack_from(PREFIX_FORMAT, data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Not a version {} container: {} {}".format(
+            VERSION, magic, version))
+    header_start = struct.calcsize(PREFIX_FORMAT)
+    columns_start = header_start + header_length
+    header = json.loads(
+        data[header_start:columns_start].decode("utf-8"))
+    columns = {}
+    for name, column in header["columns"].items():
+        dtype = np.dtype(column["dtype"]).newbyteorder("<")
+        columns[name] = np.frombuffer(data, dtype=dtype,
+            count=column["length"], offset=columns_start + column["offset"])
+    return header, columns
+
+
+def get_missing(metric: str):
+    """
+    Returns the value of a metric's column where there is no value.
+    """
+    return MISSING_INT32 if METRIC_DTYPES[metric] == "int32" else np.nan
+
+
+def write_case_data(case_data: dict) -> bytes:
+    """
+    Returns a container of date-first case data, as returned by
+    generate_case_json(). For a CaseData, write_metric_arrays() writes the
+    same container without building its entries.
+    """
+    columnar = get_columnar_case_data(case_data, significant_digits=None)
+    columns = {}
+    for metric in get_metrics(columnar):
+        missing = get_missing(metric)
+        columns[metric] = np.array(
+            [missing if value is None else value
+             for row in columnar[metric] for value in row],
+            dtype=METRIC_DTYPES[metric])
+    header = {"kind": "covid_data", "fips": columnar["fips"],
+              "dates": columnar["dates"]}
+    return write_container(header, columns)
+
+
+def write_metric_arrays(metric_arrays) -> bytes:
+    """
+    Returns a container of the case data in a CaseData's MetricArrays (see
+    case_data.py), the same as write_case_data() returns for the case data,
+    built a metric at a time from the dense arrays.
+    """
+    columns = {}
+    for metric in metric_arrays.metrics:
+        values, present = metric_arrays.get(metric)
+        column = values.astype(METRIC_DTYPES[metric])
+        column[~present] = get_missing(metric)
+        columns[metric] = column.ravel()
+    header = {"kind": "covid_data", "fips": metric_arrays.fips,
+              "dates": metric_arrays.dates}
+    return write_container(header, columns)
+
+
+def read_case_data(data: bytes) -> dict:
+    """
+    The reverse of write_case_data(). Returns the date-first case data in a
+    container. Floats only have float32 precision.
+    """
+    header, columns = read_container(data)
+    fips = header["fips"]
+    metrics = list(columns)
+    case_data = {}
+    for row, date_string in enumerate(header["dates"]):
+        start = row * len(fips)
+        values = {metric: columns[metric][start:start + len(fips)].tolist()
+                  for metric in metrics}
+        locations = {}
+        for column, fips_id in enumerate(fips):
+            entry = {}
+            for metric in metrics:
+                value = values[metric][column]
+                if METRIC_DTYPES[metric] == "int32":
+                    if value != MISSING_INT32:
+                        entry[metric] = value
+                elif value == value:  # Not NaN
+                    entry[metric] = value
+            if entry:
+                locations[fips_id] = entry
+        case_data[date_string] = locations
+    return case_data
+
+
+def write_new_case_data(new_case_data: dict) -> bytes:
+    """
+    Returns a container of new case data, as returned by
+    generate_new_case_json().
+    """
+    fips = list(new_case_data)
+    lengths = [len(new_case_data[fips_id]) for fips_id in fips]
+    columns = {
+        "offsets": np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32),
+        "increases": np.array([increase for fips_id in fips
+                               for increase in new_case_data[fips_id]],
+                              dtype=np.float32)
+    }
+    return write_container({"kind": "new_case_data", "fips": fips}, columns)
+
+
+def read_new_case_data(data: bytes) -> dict:
+    """
+    The reverse of write_new_case_data(). Returns the new case data in a
+    container. Increases only have float32 precision.
+    """
+    header, columns = read_container(data)
+    offsets = columns["offsets"].tolist()
+    increases = columns["increases"].tolist()
+    return {fips: increases[offsets[i]:offsets[i + 1]]
+            for i, fips in enumerate(header["fips"])}
@@ -0,0 +1,399 @@
+"""
+A memory-lean stand-in for the date-first case data dict that
+generate_case_json() returns.
+
+The dict holds a small dict of metrics for every date-FIPS pair, which for a
+year of county data is millions of Python objects, all alive at once until
+covid_data.json is written. CaseData keeps only what the metrics are
+calculated from: each input's corrected CaseMatrix, with its growth metrics
+and its deaths if there are death metrics (see metrics.py), and the rows
+that reported on each day, in the order they were read. The
+dict for a date is built when it's asked for and can be dropped as soon as
+it's been written:
+    case_data = CaseData()
+    build_case_data(state_input, case_data, fips_data, 5,
+                    is_state_file=True)
+    build_case_data(county_input, case_data, fips_data, 5)
+    case_data["2020-03-27"]
+    # {"53": {"cases": 4310, "per_capita": 0.00056, "increase": 580, ...},
+    #  "53061": {...}, ...}
+
+CaseData is a read-only Mapping with the same dates, FIPS, metrics and key
+order as the dict, so it compares equal to it and encodes to the same JSON
+with iter_json_chunks() (see artifacts.py). As in the dict, a revised day only
+has its corrected counts, the other series' metrics and any growth metrics,
+and the day before each reported date is there with no FIPS.
+"""
+from array import array
+from collections.abc import Mapping
+from itertools import compress
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .case_matrix import CaseMatrix
+from .columnar import METRICS as COLUMNAR_METRICS
+from .create_covid_json import calculate_growth_metrics, \
+    get_metric_values, get_revisions_summary, get_series_matrices, \
+    read_case_counts
+from .dates import DateTable
+from .metrics import ALL_METRICS, DEFAULT_METRICS, get_metric_names, \
+    has_growth_metrics
+from .stage_timer import stage
+
+
+class CaseSource:
+    """
+    The case matrix of one input file, states or counties, with the rows that
+    reported on each day, in the order they were read, and the metric names
+    and matrix of each series to output, from get_series_matrices().
+    """
+    __slots__ = ["case_matrix", "arrivals", "series", "selected"]
+
+    def __init__(self, case_matrix: CaseMatrix, arrivals: dict,
+            series: List[Tuple[dict, CaseMatrix]],
+            selected: Optional[np.ndarray]=None):
+        self.case_matrix = case_matrix
+        # Column -> array of rows
+        self.arrivals = arrivals
+        self.series = series
+        # Mask of the case matrix's rows in the case data, or None for all
+        self.selected = selected
+
+    def get_valid(self) -> np.ndarray:
+        """
+        Returns the mask of the case matrix's cells in the case data, its
+        valid cells in the selected rows.
+        """
+        valid = self.case_matrix.valid
+        if self.selected is None:
+            return valid
+        return valid & self.selected[:, np.newaxis]
+
+    def get_metric_columns(self, rows: np.ndarray, days: np.ndarray) -> list:
+        """
+        Returns a list of the name, values and presence of each metric for
+        the given date-FIPS pairs, in the order they're recorded. Presence
+        is a list of whether each pair has the metric, or None if they all
+        do. See get_metric_values() for which pairs have which metrics.
+        """
+        metrics = {}
+        for names, matrix in self.series:
+            for family, name in names.items():
+                values, present = get_metric_values(matrix, family, rows,
+                                                    days)
+                metrics[name] = (values.tolist(), None if present is None
+                                 else present.tolist())
+        return [(name,) + metrics[name] for name in ALL_METRICS
+                if name in metrics]
+
+    def add_locations(self, locations: dict, column: int) -> None:
+        """
+        Adds the FIPS -> metrics entries for a column to locations.
+        """
+        arrivals = self.arrivals.get(column)
+        if arrivals is None:
+            return
+        rows = np.frombuffer(arrivals, dtype=np.intc)
+        days = np.full(len(rows), column)
+        entries = [{} for _ in arrivals]
+        # A metric at a time, so each entry gets them in the same order.
+        for name, values, present in self.get_metric_columns(rows, days):
+            pairs = zip(entries, values)
+            if present is not None:
+                pairs = compress(pairs, present)
+            for entry, value in pairs:
+                entry[name] = value
+
+        fips = self.case_matrix.fips
+        locations.update(zip([fips[row] for row in arrivals], entries))
+
+    def get_first_arrivals(self, ranks: dict) -> dict:
+        """
+        Returns the FIPS -> (rank, position) of the first date each FIPS
+        reported on, by the rank of each day number in ranks, and the
+        position of the FIPS among the rows that reported that day. That's
+        where each FIPS first appears when the case data is read in the
+        order of ranks.
+        """
+        case_matrix = self.case_matrix
+        column_ranks = np.array(
+            [ranks.get(case_matrix.first_day + column, len(ranks))
+             for column in range(case_matrix.total_days)], dtype=np.int64)
+        valid_ranks = np.where(self.get_valid(), column_ranks, len(ranks))
+        first_columns = valid_ranks.argmin(axis=1)
+
+        positions = np.zeros(len(case_matrix), dtype=np.int64)
+        for column, arrivals in self.arrivals.items():
+            rows = np.frombuffer(arrivals, dtype=np.intc)
+            first = first_columns[rows] == column
+            positions[rows[first]] = np.nonzero(first)[0]
+
+        first_ranks = column_ranks[first_columns].tolist()
+        first_arrivals = zip(case_matrix.fips, first_ranks, positions.tolist())
+        if self.selected is not None:
+            first_arrivals = compress(first_arrivals, self.selected.tolist())
+        return {fips: (rank, position)
+                for fips, rank, position in first_arrivals}
+
+    def select(self, selected: np.ndarray) -> "CaseSource":
+        """
+        Returns a CaseSource of just the rows in selected, a mask of the
+        case matrix's rows, which share its case matrix.
+        """
+        if self.selected is not None:
+            selected = selected & self.selected
+        arrivals = {}
+        for column, rows in self.arrivals.items():
+            rows = np.frombuffer(rows, dtype=np.intc)
+            arrivals[column] = array("i", rows[selected[rows]].tobytes())
+        return CaseSource(self.case_matrix, arrivals, self.series, selected)
+
+
+class MetricArrays:
+    """
+    The case data as a dense array for each metric, with a row for each date
+    and a column for each FIPS, as in the columnar layout (see columnar.py),
+    built straight from the case matrices rather than a date at a time.
+
+    Dates are in chronological order, and FIPS in the order they first
+    appear in them. The metrics are the case metrics, then any others in the
+    case data, in the order they first appear. Each metric's array is only
+    built when it's asked for with get():
+        metric_arrays = case_data.get_metric_arrays()
+        values, present = metric_arrays.get("cases")
+        # values[d, i] is the cases for metric_arrays.fips[i] on
+        # metric_arrays.dates[d], if present[d, i]
+    """
+
+    def __init__(self, case_data: "CaseData"):
+        self.sources = case_data.sources
+        days = sorted(case_data.days)
+        date_rows = {day: row for row, day in enumerate(days)}
+        self.dates = [case_data.dates.iso(day) for day in days]
+        self.fips = case_data.get_fips(days)
+        fips_columns = {fips: column for column, fips in enumerate(self.fips)}
+
+        # The date row of each column, and the FIPS column of each row, of
+        # each case matrix
+        self.indexes = []
+        for source in self.sources:
+            case_matrix = source.case_matrix
+            self.indexes.append((
+                np.array([date_rows.get(case_matrix.first_day + column, -1)
+                          for column in range(case_matrix.total_days)],
+                         dtype=np.int64),
+                np.array([fips_columns[fips] for fips in case_matrix.fips],
+                         dtype=np.int64)))
+        self.metrics = self.get_metric_order()
+
+    def get_metric_order(self) -> list:
+        """
+        Returns the metrics in the order they first appear in the case data,
+        the case metrics first.
+        """
+        first_appearances = {}
+        for source_index, source in enumerate(self.sources):
+            date_rows, _ = self.indexes[source_index]
+            rows, columns = np.nonzero(source.get_valid())
+            for names, matrix in source.series:
+                for family, name in names.items():
+                    _, present = get_metric_values(matrix, family, rows,
+                                                   columns)
+                    present_rows, present_columns = (rows, columns) \
+                        if present is None \
+                        else (rows[present], columns[present])
+                    if not len(present_rows):
+                        continue
+                    dates = date_rows[present_columns]
+                    first_date = dates.min()
+                    first_rows = present_rows[dates == first_date]
+                    first_column = present_columns[dates == first_date][0]
+                    arrivals = np.frombuffer(source.arrivals[first_column],
+                                             dtype=np.intc)
+                    position = np.nonzero(np.isin(arrivals, first_rows))[0][0]
+                    first_appearances[name] = min(
+                        first_appearances.get(name, (np.inf,)),
+                        (int(first_date), source_index, int(position),
+                         ALL_METRICS.index(name)))
+        others = sorted((name for name in first_appearances
+                         if name not in COLUMNAR_METRICS),
+                        key=first_appearances.get)
+        return COLUMNAR_METRICS + others
+
+    def get(self, metric: str) -> (np.ndarray, np.ndarray):
+        """
+        Returns a tuple of the dense date x FIPS array of a metric's values,
+        and a mask of the date-FIPS pairs that have it.
+        """
+        shape = (len(self.dates), len(self.fips))
+        values = None
+        present = np.zeros(shape, dtype=bool)
+        for source, (date_rows, fips_columns) in zip(self.sources,
+                                                     self.indexes):
+            rows, columns = np.nonzero(source.get_valid())
+            cells = (date_rows[columns], fips_columns[rows])
+            # A later source's entry replaces the whole entry, as it would
+            # in the dict.
+            present[cells] = False
+            for names, matrix in source.series:
+                for family, name in names.items():
+                    if name != metric:
+                        continue
+                    source_values, source_present = get_metric_values(
+                        matrix, family, rows, columns)
+                    if values is None:
+                        values = np.zeros(shape, dtype=source_values.dtype)
+                    if source_present is None:
+                        values[cells] = source_values
+                        present[cells] = True
+                    else:
+                        values[tuple(index[source_present]
+                                     for index in cells)] = \
+                            source_values[source_present]
+                        present[cells] |= source_present
+        if values is None:
+            values = np.zeros(shape)
+        return values, present
+
+
+class CaseData(Mapping):
+    """
+    Date-first case data, {"YYYY-MM-DD": {"FIPS_ID": {"cases": X, ...}}},
+    built a date at a time from the case matrices of each input. Add the
+    inputs with build_case_data(), states first.
+    """
+
+    def __init__(self, dates: DateTable=None):
+        self.dates = DateTable() if dates is None else dates
+        self.sources = []
+        # Day number -> None, in the order each date first appeared in the
+        # dict, i.e. as an ordered set
+        self.days = {}
+
+    def add(self, case_matrix: CaseMatrix, arrivals: dict, fips_data: dict,
+            metrics: Iterable[str]=DEFAULT_METRICS) -> None:
+        """
+        Adds the case matrix of an input, corrected and with the growth
+        metrics in metrics, and the array of rows that reported on each
+        column, in the order they were read. Only the metrics in metrics are
+        output. An input without any rows adds nothing, as in the dict.
+        """
+        if not arrivals:
+            return
+        case_matrix.load_populations(fips_data)
+        series = [(names, matrix) for names, matrix, _ in
+                  get_series_matrices(case_matrix, metrics)]
+        self.sources.append(CaseSource(case_matrix, arrivals, series))
+
+        # The same order as the dict: each date as it's read, then the day
+        # before each reported date.
+        for column in arrivals:
+            self.days.setdefault(case_matrix.first_day + column)
+        for column in sorted(arrivals):
+            self.days.setdefault(case_matrix.first_day + column - 1)
+
+    def _day(self, date_string) -> int:
+        try:
+            day = self.dates.day(date_string)
+        except (TypeError, ValueError):
+            raise KeyError(date_string)
+        if day not in self.days:
+            raise KeyError(date_string)
+        return day
+
+    def __getitem__(self, date_string: str) -> dict:
+        day = self._day(date_string)
+        locations = {}
+        for source in self.sources:
+            source.add_locations(locations,
+                                 day - source.case_matrix.first_day)
+        return locations
+
+    def __contains__(self, date_string) -> bool:
+        try:
+            self._day(date_string)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.dates.iso(day) for day in list(self.days))
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def get_fips(self, days: Optional[list]=None) -> list:
+        """
+        Returns every FIPS, in the order they first appear when the dates
+        are read in the order of days, a list of day numbers, or in the order
+        of the case data by default.
+        """
+        if days is None:
+            days = list(self.days)
+        ranks = {day: rank for rank, day in enumerate(days)}
+        first_appearances = {}
+        for source_index, source in enumerate(self.sources):
+            for fips, (rank, position) in \
+                    source.get_first_arrivals(ranks).items():
+                first_appearances[fips] = min(
+                    first_appearances.get(fips, (len(ranks),)),
+                    (rank, source_index, position))
+        return sorted(first_appearances, key=first_appearances.get)
+
+    def select(self, fips: Iterable[str]) -> "CaseData":
+        """
+        Returns the case data of just the given FIPS, with every date, such
+        as a state and its counties. It shares the case matrices with this
+        case data, and is built a date at a time in the same way.
+        """
+        fips = set(fips)
+        selected = CaseData(self.dates)
+        selected.days = self.days
+        for source in self.sources:
+            rows = np.array([fips_id in fips
+                             for fips_id in source.case_matrix.fips],
+                            dtype=bool)
+            selected.sources.append(source.select(rows))
+        return selected
+
+    def get_metric_arrays(self) -> MetricArrays:
+        """
+        Returns the case data as a dense array for each metric, see
+        MetricArrays.
+        """
+        return MetricArrays(self)
+
+
+def build_case_data(csv_data: Iterable[list], case_data: CaseData,
+        fips_data: dict, growth_metric_days: int, is_state_file: bool=False,
+        vectorized_metrics: bool=False, previous: CaseMatrix=None,
+        metric_workers: int=1,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> CaseMatrix:
+    """
+    Adds an input's state or county csv data to case_data, the same data
+    build_covid_data() adds to a date-first dict, and returns its corrected
+    CaseMatrix, for the new case data and checkpoint.
+
+    The death counts are read in the same pass as the case counts if there
+    are death metrics in metrics, and growth metrics are only calculated for
+    a series that has them in metrics.
+    """
+    case_matrix = CaseMatrix(
+        deaths=bool(get_metric_names(metrics, "deaths")))
+    # The same stages as record_case_counts(), correct_case_counts() and
+    # record_growth_metrics() of build_covid_data()
+    with stage("record_case_counts"):
+        arrivals = read_case_counts(csv_data, case_matrix, is_state_file,
+                                    case_data.dates)
+    with stage("correct_case_counts"):
+        case_matrix.correct_downward_revisions()
+    print(get_revisions_summary(case_matrix.revision_counts()))
+    with stage("record_growth_metrics"):
+        for names, matrix, series_previous in get_series_matrices(
+                case_matrix, metrics, previous):
+            if has_growth_metrics(names):
+                calculate_growth_metrics(matrix, growth_metric_days,
+                    vectorized_metrics, series_previous, metric_workers)
+    case_data.add(case_matrix, arrivals, fips_data, metrics)
+    return case_matrix
@@ -0,0 +1,325 @@
+from typing import Optional
+
+import numpy as np
+
+
+class CaseMatrix:
+    """
+    A dense FIPS x day matrix of case counts.
+
+    Each FIPS location is interned to a row the first time it is seen, and
+    each column is a day, with column 0 being first_day, the day number (see
+    DateTable) of the earliest date in the input.
+    The NYC "-10003" pseudo-FIPS is treated like any other row.
+
+    A 0 is a valid case count, so gaps in the data are tracked in a separate
+    boolean mask rather than with a sentinel value in the counts themselves.
+    Days whose counts were corrected by correct_downward_revisions() are
+    tracked in a third mask.
+
+    Once calculated, the growth factor and doubling time for each FIPS and day
+    are kept alongside the counts (NaN where there is no metric), so they can
+    be checkpointed and reused by the next run.
+
+    Once loaded with load_populations(), the population of each FIPS is kept
+    as a vector aligned with the rows (NaN where it isn't known), so metrics
+    like the per capita case count are a single array division, see
+    per_capita().
+
+    A case matrix made with deaths=True also records the death count of each
+    row it's given, in deaths, a SeriesMatrix with the same FIPS and days. So
+    both are filled in one pass over the csv data, and the death counts get
+    the same corrections and metrics as the case counts.
+
+    Rows and days are allocated ahead of time, and the matrix grows as FIPS
+    locations and days are added, so it can be filled from a stream of rows
+    without knowing the date range up front. counts, valid and revised are
+    views of just the rows and days in use.
+
+    Example, for 3 days of data with a gap on the second day for 53061:
+        fips_index: {"53": 0, "53061": 1}
+        counts:     [[1, 1, 2],
+                     [1, 0, 1]]
+        valid:      [[True, True,  True],
+                     [True, False, True]]
+    """
+
+    def __init__(self, total_days: int=0, first_day: int=None,
+            initial_rows: int=64, initial_days: int=64, deaths: bool=False):
+        self.total_days = total_days
+        # The day number of column 0. If None, it's set by the first call to
+        # column().
+        self.first_day = first_day
+        # FIPS -> row, and row -> FIPS
+        self.fips_index = {}
+        self.fips = []
+        shape = (initial_rows, max(total_days, initial_days))
+        self._counts = np.zeros(shape, dtype=np.int32)
+        self._valid = np.zeros(shape, dtype=bool)
+        self._revised = np.zeros(shape, dtype=bool)
+        self.growth_factors = None
+        self.doubling_times = None
+        self.populations = None
+        self.deaths = SeriesMatrix(self) if deaths else None
+
+    def __len__(self) -> int:
+        return len(self.fips)
+
+    def __contains__(self, fips: str) -> bool:
+        return fips in self.fips_index
+
+    @property
+    def counts(self) -> np.ndarray:
+        return self._counts[:len(self.fips), :self.total_days]
+
+    @property
+    def valid(self) -> np.ndarray:
+        return self._valid[:len(self.fips), :self.total_days]
+
+    @property
+    def revised(self) -> np.ndarray:
+        return self._revised[:len(self.fips), :self.total_days]
+
+    def _resize(self, rows: int, days: int) -> None:
+        """
+        Reallocate the arrays with room for the given number of rows and days,
+        keeping what's been recorded so far.
+        """
+        used = (slice(0, len(self.fips)), slice(0, self.total_days))
+        for name in ["_counts", "_valid", "_revised"]:
+            array = getattr(self, name)
+            resized = np.zeros((rows, days), dtype=array.dtype)
+            resized[used] = array[used]
+            setattr(self, name, resized)
+        if self.deaths is not None:
+            self.deaths._resize(rows, days)
+
+    def _grow(self) -> None:
+        """
+        Double the number of rows available. Rows are allocated ahead of time
+        so interning a new FIPS doesn't copy the whole matrix every time.
+        """
+        rows, days = self._counts.shape
+        self._resize(max(rows * 2, 1), days)
+
+    def _grow_days(self, total_days: int) -> None:
+        """
+        Make room for at least total_days days, doubling the days available.
+        """
+        rows, days = self._counts.shape
+        self._resize(rows, max(days * 2, total_days))
+
+    def column(self, day: int) -> int:
+        """
+        Returns the column for a day number (see DateTable). If first_day
+        isn't set yet, this day becomes column 0.
+        """
+        if self.first_day is None:
+            self.first_day = day
+        column = day - self.first_day
+        if column < 0:
+            raise ValueError(
+                "Case data must be in date order, day {} is before {}".format(
+                    day, self.first_day))
+        return column
+
+    def row(self, fips: str) -> int:
+        """
+        Returns the row for the given FIPS, adding one if we haven't seen this
+        FIPS before.
+        """
+        index = self.fips_index.get(fips)
+        if index is None:
+            index = len(self.fips)
+            if index == self._counts.shape[0]:
+                self._grow()
+            self.fips_index[fips] = index
+            self.fips.append(fips)
+        return index
+
+    def set(self, fips: str, day: int, cases: int,
+            deaths: Optional[int]=None) -> bool:
+        """
+        Record the case count, and the death count if we record deaths, for a
+        FIPS on the given day (offset from first_day, see column()). Returns
+        True if there wasn't a count for that day yet, or False if this
+        replaced one.
+        """
+        index = self.row(fips)
+        if day >= self._counts.shape[1]:
+            self._grow_days(day + 1)
+        self.total_days = max(self.total_days, day + 1)
+        new = not self._valid[index, day]
+        self._counts[index, day] = cases
+        self._valid[index, day] = True
+        if self.deaths is not None:
+            self.deaths._counts[index, day] = deaths or 0
+        return new
+
+    def get(self, fips: str, day: int) -> Optional[int]:
+        """
+        Returns the case count for a FIPS on the given day, or None if there is
+        no count recorded.
+        """
+        index = self.fips_index.get(fips)
+        if index is None or day < 0 or day >= self.total_days or \
+                not self.valid[index, day]:
+            return None
+        return int(self.counts[index, day])
+
+    def inverse_chronological(self, fips: str, latest_day: int=None,
+            num_days: int=None) -> list:
+        """
+        Returns a list of case counts for a FIPS in inverse chronological
+        order, starting at latest_day and going back at most num_days days.
+        Days without a recorded count are None.
+
+        Example:
+            [45, 40, None, 25, 23, ...]
+        """
+        index = self.fips_index.get(fips)
+        if latest_day is None:
+            latest_day = self.total_days - 1
+        if index is None or latest_day < 0 or latest_day >= self.total_days:
+            return []
+        start = 0 if num_days is None else max(latest_day - num_days + 1, 0)
+        counts = self.counts[index, start:latest_day + 1].tolist()
+        valid = self.valid[index, start:latest_day + 1].tolist()
+        counts.reverse()
+        valid.reverse()
+        return [c if v else None for c, v in zip(counts, valid)]
+
+    def load_populations(self, fips_data: dict) -> np.ndarray:
+        """
+        Keeps the population of each row from fips_data (see
+        fips_data.json), for the deaths too if we record them, and returns
+        it. FIPS without a population, or with a population of 0, are NaN, so
+        anything divided by them is NaN too.
+
+        Load them once all the FIPS have been added.
+        """
+        populations = np.full(len(self.fips), np.nan)
+        for row, fips in enumerate(self.fips):
+            population = (fips_data or {}).get(fips, {}).get("population")
+            if population:
+                populations[row] = population
+        self.populations = populations
+        if self.deaths is not None:
+            self.deaths.populations = populations
+        return populations
+
+    def per_capita(self) -> np.ndarray:
+        """
+        Returns the case count per person of each FIPS and day, NaN where
+        there is no count or no population. See load_populations().
+        """
+        per_capita = self.counts / self.populations[:, np.newaxis]
+        per_capita[~self.valid] = np.nan
+        return per_capita
+
+    def correct_downward_revisions(self) -> np.ndarray:
+        """
+        Adjusts down any count that is higher than a later count for the same
+        FIPS, and returns a mask of the counts that were adjusted. The death
+        counts, if we record them, are corrected too, with their own mask.
+
+        A later, lower count means the earlier counts were in error, so each
+        count becomes the minimum of itself and every later count in the same
+        run of consecutive reported days. A gap in the data ends a run; counts
+        before a gap aren't adjusted by counts after it.
+
+        This is a backward running minimum over each FIPS series, so it takes
+        a single sweep over the days no matter how far back a revision goes.
+
+        Example, for one FIPS with a gap on the 4th day:
+            counts:    [10, 14, 12, --, 20, 18, 19]
+            corrected: [10, 12, 12, --, 18, 18, 19]
+        """
+        if self.deaths is not None:
+            self.deaths.correct_downward_revisions()
+        counts = self.counts.astype(np.int64)
+        valid = self.valid
+        if not counts.size:
+            return self.revised
+
+        # Number each run of consecutive reported days, and lift each run
+        # above all the runs before it. The running minimum can then never
+        # carry a count from one run back into an earlier one.
+        run_starts = valid.copy()
+        run_starts[:, 1:] &= ~valid[:, :-1]
+        runs = np.cumsum(run_starts, axis=1)
+        lowest = counts.min()
+        run_height = counts.max() - lowest + 1
+        lifted = np.where(valid, counts - lowest + runs * run_height,
+                          np.iinfo(np.int64).max)
+
+        running_minimum = np.minimum.accumulate(lifted[:, ::-1], axis=1)[:, ::-1]
+        corrected = running_minimum - runs * run_height + lowest
+
+        revised = valid & (corrected < counts)
+        self.counts[revised] = corrected[revised]
+        self.revised[revised] = True
+        return self.revised
+
+    def revision_counts(self) -> dict:
+        """
+        Returns the number of days revised by correct_downward_revisions() for
+        each FIPS that had any.
+
+        Example:
+            {"53061": 2, "36": 1, ...}
+        """
+        revised_days = self.revised.sum(axis=1).tolist()
+        return {fips: days for fips, days in zip(self.fips, revised_days)
+                if days}
+
+
+class SeriesMatrix(CaseMatrix):
+    """
+    A matrix of another count reported in the same rows as a case matrix,
+    such as deaths, which CaseMatrix.set() fills alongside the case counts.
+
+    It has its own counts, corrections and metrics, but its FIPS, days and
+    validity are always the case matrix's, so setting a count is a single
+    write.
+    """
+
+    def __init__(self, case_matrix: CaseMatrix):
+        self.case_matrix = case_matrix
+        self._counts = np.zeros_like(case_matrix._counts)
+        self._revised = np.zeros_like(case_matrix._revised)
+        self.growth_factors = None
+        self.doubling_times = None
+        self.populations = None
+        self.deaths = None
+
+    @property
+    def total_days(self) -> int:
+        return self.case_matrix.total_days
+
+    @property
+    def first_day(self) -> Optional[int]:
+        return self.case_matrix.first_day
+
+    @property
+    def fips_index(self) -> dict:
+        return self.case_matrix.fips_index
+
+    @property
+    def fips(self) -> list:
+        return self.case_matrix.fips
+
+    @property
+    def _valid(self) -> np.ndarray:
+        return self.case_matrix._valid
+
+    def _resize(self, rows: int, days: int) -> None:
+        used = (slice(0, len(self.fips)), slice(0, self.total_days))
+        for name in ["_counts", "_revised"]:
+            array = getattr(self, name)
+            resized = np.zeros((rows, days), dtype=array.dtype)
+            resized[used] = array[used]
+            setattr(self, name, resized)
+
+    def row(self, fips: str) -> int:
+        raise TypeError("Add FIPS with the case matrix's set()")
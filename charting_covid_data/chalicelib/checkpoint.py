@@ -0,0 +1,117 @@
+"""
+Saves and loads the case matrices from a pipeline run, so the next run can
+reuse the growth metrics that haven't changed (see update_growth_metrics()).
+
+A checkpoint is a single compressed .npz file holding, for each input file
+("states" and "counties"), the FIPS index, the corrected case counts and
+validity mask, the growth factor and doubling time arrays and the last date
+processed. If the death counts had growth metrics too (see
+CaseMatrix.deaths), they're saved the same way, as e.g. "states_deaths". A
+checkpoint is only used if it was made with the same growth_metric_days and
+CHECKPOINT_VERSION.
+"""
+from io import BytesIO
+import json
+
+import numpy as np
+
+from .case_matrix import CaseMatrix
+from .dates import DateTable
+
+
+CHECKPOINT_NAME = "pipeline_checkpoint.npz"
+# Bump this whenever the meaning of the saved arrays changes, so older
+# checkpoints are ignored rather than misread.
+CHECKPOINT_VERSION = 1
+
+ARRAYS = ["counts", "valid", "growth_factors", "doubling_times"]
+
+# Appended to the name of an input for its death counts
+DEATHS_SUFFIX = "_deaths"
+
+
+def save_checkpoint(store, case_matrices: dict, growth_metric_days: int,
+        dates: DateTable) -> int:
+    """
+    Saves a checkpoint of the given case matrices, keyed by input name, to the
+    store (see storage.py), and of their death counts. Only matrices with
+    growth metrics are saved. Returns the size of the checkpoint in bytes.
+    """
+    arrays = {}
+    metadata = {
+        "version": CHECKPOINT_VERSION,
+        "growth_metric_days": growth_metric_days,
+        "inputs": {}
+    }
+    matrices = []
+    for name, case_matrix in case_matrices.items():
+        matrices.append((name, case_matrix))
+        if case_matrix.deaths is not None:
+            matrices.append((name + DEATHS_SUFFIX, case_matrix.deaths))
+    for name, case_matrix in matrices:
+        if case_matrix.first_day is None or \
+                case_matrix.growth_factors is None:
+            # There was no data for this input, or no growth metrics to
+            # reuse.
+            continue
+        arrays["{}_fips".format(name)] = np.array(case_matrix.fips, dtype=str)
+        for array in ARRAYS:
+            arrays["{}_{}".format(name, array)] = getattr(case_matrix, array)
+        latest_day = case_matrix.first_day + case_matrix.total_days - 1
+        metadata["inputs"][name] = {
+            "first_day": case_matrix.first_day,
+            "total_days": case_matrix.total_days,
+            "last_processed_date": dates.iso(latest_day)
+        }
+    arrays["metadata"] = np.array(json.dumps(metadata))
+
+    output = BytesIO()
+    np.savez_compressed(output, **arrays)
+    store.write(CHECKPOINT_NAME, output.getvalue())
+    return output.tell()
+
+
+def load_checkpoint(store, growth_metric_days: int) -> dict:
+    """
+    Returns the case matrices saved by save_checkpoint(), keyed by input name,
+    each with its death counts as deaths if they were saved. Returns an empty
+    dict if there is no usable checkpoint in the store.
+    """
+    data = store.read(CHECKPOINT_NAME)
+    if data is None:
+        print("No checkpoint found")
+        return {}
+
+    case_matrices = {}
+    with np.load(BytesIO(data), allow_pickle=False) as arrays:
+        metadata = json.loads(str(arrays["metadata"]))
+        if metadata["version"] != CHECKPOINT_VERSION or \
+                metadata["growth_metric_days"] != growth_metric_days:
+            print("Ignoring incompatible checkpoint: {}".format(
+                {key: metadata[key]
+                 for key in ["version", "growth_metric_days"]}))
+            return {}
+
+        for name, info in metadata["inputs"].items():
+            fips = arrays["{}_fips".format(name)].tolist()
+            case_matrix = CaseMatrix(info["total_days"],
+                first_day=info["first_day"], initial_rows=len(fips))
+            for fips_id in fips:
+                case_matrix.row(fips_id)
+            case_matrix.counts[:] = arrays["{}_counts".format(name)]
+            case_matrix.valid[:] = arrays["{}_valid".format(name)]
+            case_matrix.growth_factors = \
+                arrays["{}_growth_factors".format(name)]
+            case_matrix.doubling_times = \
+                arrays["{}_doubling_times".format(name)]
+            case_matrices[name] = case_matrix
+            print("Loaded {} checkpoint through {}".format(
+                name, info["last_processed_date"]))
+
+    for name in list(case_matrices):
+        if name.endswith(DEATHS_SUFFIX):
+            deaths = case_matrices.pop(name)
+            case_matrix = case_matrices.get(name[:-len(DEATHS_SUFFIX)])
+            if case_matrix is not None:
+                case_matrix.deaths = deaths
+    return case_matrices
@@ -0,0 +1,145 @@
+"""
+A compact, columnar layout for the date-first case data in covid_data.json.
+
+Rather than repeating every metric name in every date-FIPS entry, the FIPS
+and dates are listed once, and each metric is a dense array with a row for
+each date and a column for each FIPS, with null where there is no value:
+    {"fips": ["53", "53061", ...],
+     "dates": ["2020-01-21", "2020-01-22", ...],
+     "cases": [[1, 1, ...], [1, null, ...], ...],
+     "increase": [[null, null, ...], [0, null, ...], ...],
+     "per_capita": ...,
+     "growth_factor": ...,
+     "doubling_time": ...
+    }
+
+So the cases for FIPS fips[i] on dates[d] are cases[d][i]. Floats are
+rounded to a number of significant digits, which is more precision than the
+site displays, but a lot fewer digits than repr() gives.
+
+The case metrics always have an array. Any other metric in the case data,
+such as "deaths" (see metrics.py), gets one after them.
+
+The layout of a CaseData (see case_data.py) is built straight from its case
+matrices with ColumnarCaseData, rather than from its entries.
+"""
+from collections.abc import Mapping
+from typing import Iterator, Optional
+
+# The metrics that are always in the layout, in the order they're written
+METRICS = ["cases", "increase", "per_capita", "growth_factor", "doubling_time"]
+
+# The keys of the layout that aren't metrics
+INDEX_KEYS = ["fips", "dates"]
+
+SIGNIFICANT_DIGITS = 6
+
+
+def round_significant(value, significant_digits: int):
+    """
+    Rounds a float to a number of significant digits. Other values, such as
+    int case counts, are returned as is.
+    """
+    if isinstance(value, float):
+        return float("{:.{}g}".format(value, significant_digits))
+    return value
+
+
+def get_columnar_case_data(case_data: dict,
+        significant_digits: Optional[int]=SIGNIFICANT_DIGITS) -> dict:
+    """
+    Returns date-first case data, as returned by generate_case_json(), in
+    the columnar layout. Dates are in chronological order and FIPS are in the
+    order they first appear. Pass significant_digits=None to keep floats at
+    full precision.
+    """
+    dates = sorted(case_data)
+    fips_index = {}
+    for date_string in dates:
+        for fips in case_data[date_string]:
+            if fips not in fips_index:
+                fips_index[fips] = len(fips_index)
+
+    columnar = {"fips": list(fips_index), "dates": dates}
+    for metric in METRICS:
+        columnar[metric] = [[None] * len(fips_index) for _ in dates]
+    for row, date_string in enumerate(dates):
+        for fips, entry in case_data[date_string].items():
+            column = fips_index[fips]
+            for metric, value in entry.items():
+                if significant_digits is not None:
+                    value = round_significant(value, significant_digits)
+                if metric not in columnar:
+                    columnar[metric] = [[None] * len(fips_index)
+                                        for _ in dates]
+                columnar[metric][row][column] = value
+    return columnar
+
+
+class ColumnarCaseData(Mapping):
+    """
+    The columnar layout of a CaseData, from its MetricArrays (see
+    case_data.py). It's equal to, and encodes to the same JSON as, what
+    get_columnar_case_data() returns for the same case data.
+
+    A metric's arrays are only built when it's asked for, so encoding the
+    layout with iter_json_chunks() (see artifacts.py) only holds one metric's
+    arrays at a time.
+    """
+
+    def __init__(self, metric_arrays,
+            significant_digits: Optional[int]=SIGNIFICANT_DIGITS):
+        self.metric_arrays = metric_arrays
+        self.significant_digits = significant_digits
+
+    def __getitem__(self, key: str) -> list:
+        if key == "fips":
+            return self.metric_arrays.fips
+        if key == "dates":
+            return self.metric_arrays.dates
+        if key not in self.metric_arrays.metrics:
+            raise KeyError(key)
+        values, present = self.metric_arrays.get(key)
+        rows = []
+        for row_values, row_present in zip(values, present):
+            row_values = row_values.tolist()
+            if self.significant_digits is not None:
+                row_values = [round_significant(value,
+                                                self.significant_digits)
+                              for value in row_values]
+            rows.append([value if is_present else None for value, is_present
+                         in zip(row_values, row_present.tolist())])
+        return rows
+
+    def __iter__(self) -> Iterator[str]:
+        yield from INDEX_KEYS
+        yield from self.metric_arrays.metrics
+
+    def __len__(self) -> int:
+        return len(INDEX_KEYS) + len(self.metric_arrays.metrics)
+
+
+def get_metrics(columnar: dict) -> list:
+    """
+    Returns the metrics that have an array in the columnar layout.
+    """
+    return [key for key in columnar if key not in INDEX_KEYS]
+
+
+def get_case_data(columnar: dict) -> dict:
+    """
+    The reverse of get_columnar_case_data(). Returns the date-first case data
+    for the columnar layout.
+    """
+    metrics = get_metrics(columnar)
+    case_data = {}
+    for row, date_string in enumerate(columnar["dates"]):
+        locations = {}
+        for column, fips in enumerate(columnar["fips"]):
+            entry = {metric: columnar[metric][row][column]
+                     for metric in metrics
+                     if columnar[metric][row][column] is not None}
+            if entry:
+                locations[fips] = entry
+        case_data[date_string] = locations
+    return case_data
@@ -1,96 +1,141 @@
+from array import array
 from collections import defaultdict
-from datetime import datetime, timedelta
 import math
 from statistics import mean
-from typing import Optional, Union
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
+
+from .case_matrix import CaseMatrix
+from .columnar import get_columnar_case_data
+from .dates import DateTable
+from .growth_metrics import MIN_CASE_COUNT, get_growth_metrics, \
+    update_growth_metrics
+from .metrics import DEFAULT_METRICS, SERIES, get_metric_names, \
+    has_growth_metrics
+from .parallel_metrics import get_partitioned_growth_metrics
+from .stage_timer import timed
 
-# The minimum number of cases needed for a given date-FIPS pair to produce a
-# growth factor and doubling time estimate.
-MIN_CASE_COUNT = 50
 
 Num = Union[int, float]
 
+# How many of the most revised FIPS the downward revisions summary lists
+REVISIONS_TOP = 5
+
 
 def set_case_count(output_data: dict, date: str, fips: str, cases: int,
-        output_fips_first: bool) -> None:
+        output_fips_first: bool, deaths: Optional[int]=None,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> None:
     """
-    Sets the given number of cases into output_data for a Date-FIPS combo.
+    Sets the given number of cases, and deaths if they were read, into
+    output_data for a Date-FIPS combo, as a new entry with whichever counts
+    are in metrics.
     Does this based on the output_fips_first option.
     """
+    entry = {}
+    if "cases" in metrics:
+        entry["cases"] = cases
+    if deaths is not None and "deaths" in metrics:
+        entry["deaths"] = deaths
     if output_fips_first:
         # output_data is keyed by FIPS, then date
         # {"56043":
         #    {"2020-03-27": {"cases": 12}, ...}
         # }
-        output_data[fips][date] = {"cases": cases}
+        output_data[fips][date] = entry
     else:
         # output_data is keyed by date, and then FIPS.
         # {"2020-03-27":
         #    {"56043": {"cases": 12}, ...}
         # }
-        output_data[date][fips] = {"cases": cases}
+        output_data[date][fips] = entry
 
 
-def get_case_count(output_data: dict, date: str, fips: str,
-        output_fips_first: bool) -> Optional[int]:
+def get_series_matrices(case_matrix: CaseMatrix, metrics: Iterable[str],
+        previous: CaseMatrix=None) -> List[Tuple[dict, CaseMatrix,
+                                                 Optional[CaseMatrix]]]:
     """
-    Returns the number of cases recorded in output_data for a given
-    Date-FIPS combination. If no entry, returns None.
+    Returns a list of the metric names (see get_metric_names()), the
+    CaseMatrix and the previous run's CaseMatrix, if any, of each series,
+    cases then deaths, that has metrics to record and was read into the case
+    matrix.
     """
-    if output_fips_first:
-        entry = output_data[fips].get(date, None)
-        if entry:
-            return entry["cases"]
-    else:
-        entry = output_data[date].get(fips, None)
-        if entry:
-            return entry["cases"]
-    return None
-
-
-def set_increase_count(output_data: dict, date: str, fips: str, increase: int,
-        output_fips_first: bool) -> None:
+    series_matrices = []
+    previous_matrices = [previous, previous.deaths] if previous is not None \
+        else [None, None]
+    for series, matrix, series_previous in zip(SERIES,
+            [case_matrix, case_matrix.deaths], previous_matrices):
+        names = get_metric_names(metrics, series)
+        if names and matrix is not None:
+            series_matrices.append((names, matrix, series_previous))
+    return series_matrices
+
+
+def get_metric_values(matrix: CaseMatrix, family: str, rows: np.ndarray,
+        days: np.ndarray) -> (np.ndarray, Optional[np.ndarray]):
     """
-    Sets the given increase count into output_data for a Date-FIPS combo.
-    Does this based on the output_fips_first option.
+    Returns a tuple of the values of a family of metrics (see metrics.py) for
+    the given date-FIPS pairs of a corrected series matrix, which must all
+    have a count, and a mask of the pairs that have the metric in the case
+    data, or None if they all do.
+
+    These are the rules for which entries of the case data get which
+    metrics, whether it's built as a dict (see build_covid_data()) or from
+    the case matrices (see case_data.py):
+        count          every entry
+        per_capita     entries with a population that weren't revised by
+                       correct_case_counts()
+        increase       entries with a count the day before that weren't
+                       revised
+        growth_factor  entries with a non-zero metric (see
+        doubling_time  calculate_growth_metrics())
+
+    Example, for two FIPS on day 3, the second without a population:
+        get_metric_values(matrix, "per_capita", np.array([0, 1]),
+                          np.array([3, 3]))
+        # (array([0.0011, nan]), array([True, False]))
     """
-    if output_fips_first:
-        # output_data is keyed by FIPS, then date
-        # {"56043":
-        #    {"2020-03-27": {"increase": 12}, ...}
-        # }
-        entry = output_data[fips][date]
-        entry["increase"] = increase
-    else:
-        # output_data is keyed by date, and then FIPS.
-        # {"2020-03-27":
-        #    {"56043": {"increase": 12}, ...}
-        # }
-        entry = output_data[date][fips]
-        entry["increase"] = increase
-
-
-def set_per_capita(output_data: dict, date: str, fips: str, cases: int,
-        population: int, output_fips_first: bool) -> None:
+    counts = matrix.counts[rows, days]
+    if family == "count":
+        return counts, None
+
+    not_revised = ~matrix.revised[rows, days]
+    if family == "per_capita":
+        # The same division as CaseMatrix.per_capita(), for just these pairs
+        values = counts / matrix.populations[rows]
+        return values, ~np.isnan(values) & not_revised
+    if family == "increase":
+        previous_days = np.maximum(days - 1, 0)
+        has_increase = (days > 0) & matrix.valid[rows, previous_days] & \
+            not_revised
+        return counts - matrix.counts[rows, previous_days], has_increase
+
+    all_values = matrix.growth_factors if family == "growth_factor" \
+        else matrix.doubling_times
+    values = all_values[rows, days]
+    return values, ~np.isnan(values) & (values != 0)
+
+
+def record_metric(output_data: dict, matrix: CaseMatrix, family: str,
+        name: str, output_fips_first: bool, dates: DateTable) -> dict:
     """
-    Sets the per capita case count into output_data for a Date-FIPS combo.
-    Does this based on the output_fips_first option.
+    Add a family of metrics of a series matrix to output_data as name, for
+    every date-FIPS pair that has it, see get_metric_values().
     """
-    if output_fips_first:
-        # output_data is keyed by FIPS, then date
-        # {"56043":
-        #    {"2020-03-27": {"per_capita": 0.12}, ...}
-        # }
-        entry = output_data[fips][date]
-        entry["per_capita"] = cases / population
-    else:
-        # output_data is keyed by date, and then FIPS.
-        # {"2020-03-27":
-        #    {"56043": {"per_capita": 0.12}, ...}
-        # }
-        entry = output_data[date][fips]
-        entry["per_capita"] = cases / population
+    rows, days = np.nonzero(matrix.valid)
+    values, present = get_metric_values(matrix, family, rows, days)
+    if present is not None:
+        rows, days, values = rows[present], days[present], values[present]
+
+    fips = matrix.fips
+    for row, day, value in zip(rows.tolist(), days.tolist(),
+            values.tolist()):
+        date_string = dates.iso(matrix.first_day + day)
+        if output_fips_first:
+            output_data[fips[row]][date_string][name] = value
+        else:
+            output_data[date_string][fips[row]][name] = value
+    return output_data
 
 
 def get_exp_growth_rate(final: Num, starting: Num, num_periods: Num) -> float:
@@ -205,12 +250,111 @@ def get_growth_factor(preceding_case_counts: list) -> Optional[float]:
     return None
 
 
-def record_growth_metrics(output_data: dict,
-        inverse_chronological_case_data: dict,
+def get_scalar_growth_metrics(counts: np.ndarray, valid: np.ndarray,
+        growth_metric_days: int) -> (np.ndarray, np.ndarray):
+    """
+    Returns the growth factor and doubling time arrays for FIPS x day arrays
+    of case counts and validity, like get_growth_metrics(), but calculated one
+    date-FIPS pair at a time with get_growth_factor() and
+    get_averaged_doubling_time().
+    """
+    growth_factors = np.full(counts.shape, np.nan)
+    doubling_times = np.full(counts.shape, np.nan)
+    count_rows = counts.tolist()
+    valid_rows = valid.tolist()
+    rows, days = np.nonzero(valid)
+    for row, day in zip(rows.tolist(), days.tolist()):
+        # The case counts over the preceding growth_metric_days days, latest
+        # first, as CaseMatrix.inverse_chronological() returns them.
+        start = max(day - growth_metric_days + 1, 0)
+        preceding_case_counts = [
+            count if is_valid else None for count, is_valid in zip(
+                count_rows[row][start:day + 1],
+                valid_rows[row][start:day + 1])]
+        preceding_case_counts.reverse()
+        if len(preceding_case_counts) != growth_metric_days or \
+                None in preceding_case_counts or \
+                preceding_case_counts[0] < MIN_CASE_COUNT:
+            continue
+
+        growth_factor = get_growth_factor(preceding_case_counts)
+        if growth_factor:
+            growth_factors[row, day] = growth_factor
+        doubling_time = get_averaged_doubling_time(preceding_case_counts)
+        if doubling_time:
+            doubling_times[row, day] = doubling_time
+    return growth_factors, doubling_times
+
+
+def calculate_growth_metrics(case_matrix: CaseMatrix, growth_metric_days: int,
+        vectorized: bool=False, previous: CaseMatrix=None,
+        workers: int=1) -> (np.ndarray, np.ndarray):
+    """
+    Calculates the growth factor and doubling time for every date-FIPS pair of
+    a case matrix, keeps them on the case matrix and returns them. NaN means
+    there is no metric.
+
+    See record_growth_metrics() for the vectorized and previous options;
+    previous is only used with vectorized=True. With more than one worker,
+    and no previous case matrix to update, the metrics are calculated a state
+    at a time in that many processes, see parallel_metrics.py.
+    """
+    metric_function = \
+        get_growth_metrics if vectorized else get_scalar_growth_metrics
+    if vectorized and previous is not None:
+        growth_factors, doubling_times = update_growth_metrics(
+            case_matrix, previous, growth_metric_days)
+    elif workers > 1:
+        growth_factors, doubling_times = get_partitioned_growth_metrics(
+            case_matrix, metric_function, growth_metric_days, workers)
+    else:
+        growth_factors, doubling_times = metric_function(
+            case_matrix.counts, case_matrix.valid, growth_metric_days)
+    case_matrix.growth_factors = growth_factors
+    case_matrix.doubling_times = doubling_times
+    return growth_factors, doubling_times
+
+
+def record_growth_metric_arrays(output_data: dict,
+        case_matrix: CaseMatrix, output_fips_first: bool,
+        growth_metric_days: int, dates: DateTable, vectorized: bool=True,
+        previous: CaseMatrix=None, workers: int=1,
+        names: dict=None) -> dict:
+    """
+    Add growth_factor and doubling_time to output_data, calculating them for
+    every date-FIPS pair of the case matrix first, with
+    calculate_growth_metrics().
+
+    If given the case matrix from a previous run (see checkpoint.py), only the
+    metrics affected by new or revised counts are recalculated, see
+    update_growth_metrics().
+
+    names are the metric names of the case matrix's series, as returned by
+    get_metric_names(), and only the growth metrics among them are recorded.
+    By default, both of the case growth metrics are.
+    """
+    if names is None:
+        names = get_metric_names(DEFAULT_METRICS, "cases")
+    growth_factors, doubling_times = calculate_growth_metrics(case_matrix,
+        growth_metric_days, vectorized, previous, workers)
+
+    for family in ["growth_factor", "doubling_time"]:
+        if family in names:
+            record_metric(output_data, case_matrix, family, names[family],
+                output_fips_first, dates)
+    return output_data
+
+
+@timed("record_growth_metrics")
+def record_growth_metrics(output_data: dict, case_matrix: CaseMatrix,
         output_fips_first: bool, growth_metric_days: int,
-        latest_date: datetime.date, total_days_of_data: int) -> dict:
+        dates: DateTable, vectorized: bool=False,
+        previous: CaseMatrix=None, workers: int=1,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> dict:
     """
-    Add growth_factor and doubling_time to output_data.
+    Add growth_factor and doubling_time to output_data, and the growth
+    metrics of deaths, if they're in metrics and were read into the case
+    matrix (see CaseMatrix.deaths).
 
     Growth factor is the average relative daily growth in new cases over the
     prior growth_metric_days days.
@@ -220,56 +364,103 @@ def record_growth_metrics(output_data: dict,
 
     Both of these metrics are explained further in get_growth_factor() and
     get_doubling_time().
+
+    By default these are calculated one date-FIPS pair at a time with
+    get_growth_factor() and get_averaged_doubling_time(), which are the
+    reference implementation. Passing vectorized=True calculates them for all
+    pairs at once with NumPy (see growth_metrics.py), which is much faster but
+    may differ from the reference in the last bit of a float, since NumPy's
+    log isn't guaranteed to round the same way as math.log. The vectorized
+    path can also reuse the metrics from a previous run's case matrix.
+
+    Passing workers > 1 calculates either kind of metric a state at a time
+    in that many processes (see parallel_metrics.py), with the same results.
+    """
+    for names, matrix, series_previous in get_series_matrices(case_matrix,
+            metrics, previous):
+        if has_growth_metrics(names):
+            record_growth_metric_arrays(output_data, matrix,
+                output_fips_first, growth_metric_days, dates, vectorized,
+                series_previous, workers, names)
+    return output_data
+
+
+def iter_case_rows(csv_data: Iterable[list], is_state_file: bool,
+        deaths: bool=False) -> Iterator[Tuple[str, str, int, Optional[int]]]:
+    """
+    Yields the date, FIPS, case count and death count of each row of NYT csv
+    data, header first, skipping rows without a FIPS. New York City, which the
+    NYT reports without one, gets the "-10003" pseudo-FIPS. The death count
+    is None unless deaths=True.
+
+    Example:
+        ("2020-03-28", "53061", 912, 23)
     """
-    for outer_key, entries in output_data.items():
-        for inner_key, cases_data in entries.items():
-            if output_fips_first:
-                fips_id = outer_key
-                date_string = inner_key
+    # Offsets of the data within the csv.
+    # Example: 2020-03-28,Snohomish,Washington,53061,912,23
+    DATE = 0
+    COUNTY = 1
+    FIPS = 2 if is_state_file else 3
+    CASES = 3 if is_state_file else 4
+    DEATHS = CASES + 1
+
+    rows = iter(csv_data)
+    # Skip the initial header line.
+    next(rows, None)
+    for row in rows:
+        # TODO(bhold): Handle KC
+        fips = row[FIPS]
+        if not fips:
+            if not is_state_file and row[COUNTY] == "New York City":
+                fips = "-10003"
             else:
-                fips_id = inner_key
-                date_string = outer_key
-
-            # Find the slice of inverse_chronological_case_data cooresponding
-            # to the preceding growth_metric_days days for this fips location.
-            this_date = datetime.strptime(date_string, '%Y-%m-%d').date()
-            start = (latest_date - this_date).days
-            end = min(start+growth_metric_days, total_days_of_data)
-            preceding_case_counts = \
-                inverse_chronological_case_data[fips_id][start:end]
-            if len(preceding_case_counts) != growth_metric_days or \
-                    None in preceding_case_counts or \
-                    preceding_case_counts[0] < MIN_CASE_COUNT:
-                # We don't have enough days of data, or have faulty data, or
-                # have less than the minimum number of cases to calculate
-                # a growth factor.
                 continue
+        yield row[DATE], fips, int(row[CASES] or 0), \
+            int(row[DEATHS] or 0) if deaths else None
 
-            growth_factor = get_growth_factor(preceding_case_counts)
-            if growth_factor:
-                if output_fips_first:
-                    output_data[fips_id][date_string]['growth_factor'] = \
-                        growth_factor
-                else:
-                    output_data[date_string][fips_id]['growth_factor'] = \
-                        growth_factor
-
-            doubling_time = get_averaged_doubling_time(preceding_case_counts)
-            if doubling_time:
-                if output_fips_first:
-                    output_data[fips_id][date_string]['doubling_time'] = \
-                        doubling_time
-                else:
-                    output_data[date_string][fips_id]['doubling_time'] = \
-                        doubling_time
-    return output_data
 
+def read_case_counts(csv_data: Iterable[list], case_matrix: CaseMatrix,
+        is_state_file: bool, dates: DateTable) -> dict:
+    """
+    Reads the case counts of csv data into case_matrix, and its death counts
+    too if it was made with deaths=True, and returns the array of rows that
+    reported on each column, in the order they were read. A row reported
+    twice on the same day keeps its first place and its last count, as it
+    would in a dict.
+
+    This is the one pass over the csv data, whether the case data is built
+    as a dict (see record_case_counts()) or as a CaseData (see case_data.py).
 
-def record_case_counts(csv_data: list, output_data: dict, fips_data: dict,
-        inverse_chronological_case_data: dict, output_fips_first: bool,
-        is_state_file: bool, latest_date: datetime.date) -> (dict, dict):
+    Example return value, of the rows of the case matrix by column:
+        {0: array("i", [0, 1]), 1: array("i", [0, 1, 2]), ...}
+    """
+    read_deaths = case_matrix.deaths is not None
+    arrivals = {}
+    for date_string, fips, cases, deaths in iter_case_rows(csv_data,
+            is_state_file, read_deaths):
+        # Store the number of cases in the case matrix at the column which
+        # represents the number of days since the earliest date.
+        column = case_matrix.column(dates.day(date_string))
+        if case_matrix.set(fips, column, cases, deaths):
+            rows = arrivals.get(column)
+            if rows is None:
+                rows = arrivals[column] = array("i")
+            rows.append(case_matrix.fips_index[fips])
+    return arrivals
+
+
+@timed("record_case_counts")
+def record_case_counts(csv_data: Iterable[list], output_data: dict,
+        case_matrix: CaseMatrix, output_fips_first: bool,
+        is_state_file: bool, dates: DateTable,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> (dict, CaseMatrix):
     """
-    Returns a tuple of case count data and inverse chronological case data.
+    Returns a tuple of case count data and the case matrix.
+
+    csv_data can be any iterable of parsed csv rows, header first, such as a
+    csv.reader over a file or a streamed download. Rows are consumed as they
+    come and never held in a list; they must be in date order, as the NYT
+    files are.
 
     The case count data records the number of cases for each date-FIPS pair
     in the input csv file into a dictionary.
@@ -285,97 +476,142 @@ def record_case_counts(csv_data: list, output_data: dict, fips_data: dict,
         ...
         }
 
-    The inverse_chronological_case_data is a dictionary of the format:
-        Key: FIPS
-        Value: List of inverse chronological case counts for that FIPS
+    The case matrix holds the case count for each FIPS and day. See
+    CaseMatrix. If it was made with deaths=True, the death counts are read
+    from the same rows into case_matrix.deaths, and "deaths" is recorded too
+    if it's in metrics. Only the counts in metrics are recorded in the case
+    count data, but every row gets an entry.
+
+    These are the counts as reported. Downward revisions are corrected
+    afterwards by correct_case_counts(), and per capita counts are added by
+    record_per_capita().
+    """
+    arrivals = read_case_counts(csv_data, case_matrix, is_state_file, dates)
+
+    # The entries are added in the order the rows were read.
+    deaths = case_matrix.deaths
+    for column, rows in arrivals.items():
+        date_string = dates.iso(case_matrix.first_day + column)
+        rows = np.frombuffer(rows, dtype=np.intc)
+        death_counts = deaths.counts[rows, column].tolist() \
+            if deaths is not None else [None] * len(rows)
+        for row, cases, death_count in zip(rows.tolist(),
+                case_matrix.counts[rows, column].tolist(), death_counts):
+            set_case_count(output_data, date_string, case_matrix.fips[row],
+                cases, output_fips_first, death_count, metrics)
+
+    return output_data, case_matrix
+
+
+@timed("correct_case_counts")
+def correct_case_counts(output_data: dict, case_matrix: CaseMatrix,
+        output_fips_first: bool, dates: DateTable,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> dict:
+    """
+    Corrects downward revisions in the case counts, and death counts,
+    recorded by record_case_counts(), and returns the number of days that
+    were revised for each FIPS.
+
+    Any preceding day with a case count higher than a later day's case count
+    is considered to be in error. The erroneous case(s) was either found to be
+    incorrect or was reassigned to another FIPS. We adjust these preceding
+    days down to the later count, see CaseMatrix.correct_downward_revisions().
+
+    A revised day only keeps its corrected counts in output_data, since the
+    per capita count and increase of a revised series were calculated from
+    the erroneous count. The other series keeps its per capita count and
+    increase, which are added afterwards.
+
+    Example return value, of the days with revised case counts:
+        {"53061": 2, "36": 1, ...}
+    """
+    revised = case_matrix.correct_downward_revisions()
+    deaths = case_matrix.deaths
+    if deaths is not None:
+        revised = revised | deaths.revised
+
+    rows, days = np.nonzero(revised)
+    death_counts = deaths.counts[rows, days].tolist() \
+        if deaths is not None else [None] * len(rows)
+    for row, day, cases, death_count in zip(rows.tolist(), days.tolist(),
+            case_matrix.counts[rows, days].tolist(), death_counts):
+        set_case_count(output_data, dates.iso(case_matrix.first_day + day),
+            case_matrix.fips[row], cases, output_fips_first, death_count,
+            metrics)
+
+    if not output_fips_first:
+        # Every reported date, and the day before it, gets an entry in the
+        # output, even if it's empty.
+        for day in np.nonzero(case_matrix.valid.any(axis=0))[0].tolist():
+            output_data[dates.iso(case_matrix.first_day + day - 1)]
+
+    return case_matrix.revision_counts()
+
+
+def get_revisions_summary(revisions: dict, top: int=REVISIONS_TOP) -> str:
+    """
+    Returns a one line summary of the revisions returned by
+    correct_case_counts(), for the log: the totals, and the top FIPS with the
+    most days revised.
 
     Example:
-        {"56043": [45, 40, 34, 25, 23, ...], ...}
+        "Downward revisions: 52 days across 31 FIPS, most in 53061: 6, 36: 4"
     """
-    # Offsets of the data within the csv.
-    # Example: 2020-03-28,Snohomish,Washington,53061,912,23
-    DATE = 0
-    COUNTY = 1
-    FIPS = 2 if is_state_file else 3
-    CASES = 3 if is_state_file else 4
+    summary = "Downward revisions: {} days across {} FIPS".format(
+        sum(revisions.values()), len(revisions))
+    most_revised = sorted(revisions.items(),
+                          key=lambda item: (-item[1], item[0]))[:top]
+    if most_revised:
+        summary += ", most in " + ", ".join(
+            "{}: {}".format(fips, days) for fips, days in most_revised)
+    return summary
+
+
+@timed("record_per_capita")
+def record_per_capita(output_data: dict, case_matrix: CaseMatrix,
+        fips_data: dict, output_fips_first: bool, dates: DateTable,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> dict:
+    """
+    Add the per capita case count to output_data, for every date-FIPS pair
+    with a population in fips_data that wasn't revised by
+    correct_case_counts(), and the per capita death count, if they're in
+    metrics.
+
+    The populations are loaded into the case matrix, aligned with its rows
+    (see CaseMatrix.load_populations()), so the per capita counts for every
+    pair are one array division.
+    """
+    case_matrix.load_populations(fips_data)
+    for names, matrix, _ in get_series_matrices(case_matrix, metrics):
+        if "per_capita" in names:
+            record_metric(output_data, matrix, "per_capita",
+                names["per_capita"], output_fips_first, dates)
+    return output_data
 
-    # Skip the initial header line.
-    for row in csv_data[1:]:
-        # TODO(bhold): Handle KC
-        if not row[FIPS]:
-            if not is_state_file and row[COUNTY] == "New York City":
-                row[FIPS] = "-10003"
-            else:
-                continue
 
-        cases = int(row[CASES] or 0)
-        set_case_count(output_data, row[DATE], row[FIPS], cases,
-            output_fips_first)
-
-        this_date = datetime.strptime(row[DATE], '%Y-%m-%d').date()
-        # Indicates how many previous days' case counts were adjusted
-        # down below, due to the current day's count being lower. In this
-        # case older counts were in error. Either the case(s) was
-        # incorrect or reassigned to another FIPS. This count indicates
-        # how many previous days' counts we need to adjust down in the
-        # inverse_chronological_case_data as well.
-        previous_days_adjusted_down = 0
-        previous_day = this_date - timedelta(days=1)
-        previous_day_string = previous_day.strftime('%Y-%m-%d')
-        previous_day_cases = get_case_count(output_data,
-            previous_day_string, row[FIPS], output_fips_first)
-        # Any preceding day with a case count higher than the
-        # current day's case count is considered to be in error.
-        # The erroneous case(s) was either found to be incorrect
-        # or was reassigned to another FIPS. We adjust these
-        # preceding days down to the count of the current.
-        while previous_day_cases and previous_day_cases > cases:
-            previous_days_adjusted_down += 1
-            set_case_count(output_data, previous_day_string,
-                row[FIPS], cases, output_fips_first)
-            # Reassign previous_day and previous_day_string to
-            # continue the loop, looking for preceding entries
-            # that were also higher than the current.
-            previous_day = previous_day - timedelta(days=1)
-            previous_day_string = \
-                previous_day.strftime('%Y-%m-%d')
-            previous_day_cases = get_case_count(output_data,
-                previous_day_string, row[FIPS], output_fips_first)
-
-        # Store the number of cases in the fips list at the position which
-        # represents the number of days since the latest (current) date.
-        day_offset = (latest_date - this_date).days
-        fips_row = inverse_chronological_case_data[row[FIPS]]
-        fips_row[day_offset] = cases
-        # If the previous days had an erroneous count (explained above),
-        # we adjust them down in this list as well.
-        if previous_days_adjusted_down > 0:
-            for i in range(1, previous_days_adjusted_down + 1):
-                fips_row[day_offset + i] = cases
-
-        if fips_data:
-            # Set the per-capita case count.
-            population = fips_data.get(row[FIPS], {}).get("population")
-            if population:
-                set_per_capita(output_data, row[DATE], row[FIPS], cases,
-                    population, output_fips_first)
-
-        # Set this days case increase.
-        preceding_counts = \
-            inverse_chronological_case_data[row[FIPS]][day_offset:day_offset + 2]
-        if len(preceding_counts) == 2 and None not in preceding_counts:
-            increase = preceding_counts[0] - preceding_counts[1]
-            set_increase_count(output_data, row[DATE], row[FIPS], increase,
-                output_fips_first)
-
-    return output_data, inverse_chronological_case_data
-
-
-def generate_covid_data(covid_data: list, output_data: dict, fips_data: dict,
-        growth_metric_days: int, output_fips_first: bool,
-        is_state_file: bool=False) -> dict:
-    """
-    For supplied list containing either state or county covid data,
+@timed("record_increases")
+def record_increases(output_data: dict, case_matrix: CaseMatrix,
+        output_fips_first: bool, dates: DateTable,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> dict:
+    """
+    Add the increase in cases from the previous day to output_data, for every
+    date-FIPS pair that has a count on the previous day and wasn't revised by
+    correct_case_counts(), and the increase in deaths, if they're in metrics.
+    """
+    for names, matrix, _ in get_series_matrices(case_matrix, metrics):
+        if "increase" in names:
+            record_metric(output_data, matrix, "increase", names["increase"],
+                output_fips_first, dates)
+    return output_data
+
+
+def generate_covid_data(covid_data: Iterable[list], output_data: dict,
+        fips_data: dict, growth_metric_days: int, output_fips_first: bool,
+        is_state_file: bool=False, vectorized_metrics: bool=False,
+        dates: DateTable=None, metric_workers: int=1,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> dict:
+    """
+    For supplied rows of either state or county covid data,
     this function will output a date-keyed dict in the format:
       {"YYYY-MM-DD":
          {"FIPS_ID": {"cases": X, "growth_factor": X.X}, ...}
@@ -399,41 +635,93 @@ def generate_covid_data(covid_data: list, output_data: dict, fips_data: dict,
          {"2020-03-27": {"cases": 12, "growth_factor": 1.19}, ...}
        ...
       }
-    """
-    # Offsets of the data within the csv.
-    # Example: 2020-03-28,Snohomish,Washington,53061,912,23
-    DATE = 0
 
-    earliest_date = \
-        datetime.strptime(covid_data[1][DATE], '%Y-%m-%d').date()
-    latest_date = datetime.strptime(
-        covid_data[-1][DATE], '%Y-%m-%d').date()
-    # Create an empty list for each entry with length being the total days
-    # we might have data for.
-    # This will store case count in reverse chronological order.
-    total_days_of_data = (latest_date - earliest_date).days + 1
-    inverse_chronological_case_data = \
-        defaultdict(lambda: [None] * total_days_of_data)
-
-    output_data, inverse_chronological_case_data = record_case_counts(
-            covid_data, output_data, fips_data,
-            inverse_chronological_case_data, output_fips_first, is_state_file,
-            latest_date)
-
-    output_data = record_growth_metrics(output_data,
-            inverse_chronological_case_data, output_fips_first,
-            growth_metric_days, latest_date, total_days_of_data)
+    Growth metrics are calculated with NumPy if vectorized_metrics=True, and
+    a state at a time in metric_workers processes if it's more than 1, see
+    record_growth_metrics().
 
+    Only the metrics in metrics are output, and deaths are only read if
+    there are death metrics among them, see metrics.py.
+
+    Dates are handled as day numbers internally, see DateTable. Pass the same
+    DateTable to each call in a run so each date is only parsed once.
+    """
+    output_data, _ = build_covid_data(covid_data, output_data, fips_data,
+        growth_metric_days, output_fips_first, is_state_file,
+        vectorized_metrics, dates, metric_workers=metric_workers,
+        metrics=metrics)
     return output_data
 
 
+def build_covid_data(covid_data: Iterable[list], output_data: dict,
+        fips_data: dict, growth_metric_days: int, output_fips_first: bool,
+        is_state_file: bool=False, vectorized_metrics: bool=False,
+        dates: DateTable=None, previous: CaseMatrix=None,
+        metric_workers: int=1,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> (dict, CaseMatrix):
+    """
+    Returns a tuple of the output of generate_covid_data() and the corrected
+    CaseMatrix it was calculated from, so the case counts can be reused
+    without reading the csv data again.
+
+    previous is an optional case matrix from an earlier run, with growth
+    metrics, for the same input file. When vectorized_metrics=True, growth
+    metrics that can't have changed since then are reused rather than
+    recalculated.
+
+    Cases and deaths are read in the same pass over the csv data, and each
+    step records the metrics of both, so deaths don't cost another parse.
+    """
+    if dates is None:
+        dates = DateTable()
+    # The case matrix grows a column for each day as the rows stream in.
+    case_matrix = CaseMatrix(
+        deaths=bool(get_metric_names(metrics, "deaths")))
+
+    output_data, case_matrix = record_case_counts(
+            covid_data, output_data, case_matrix,
+            output_fips_first, is_state_file, dates, metrics)
+    revisions = correct_case_counts(output_data, case_matrix,
+            output_fips_first, dates, metrics)
+    print(get_revisions_summary(revisions))
+    output_data = record_per_capita(output_data, case_matrix, fips_data,
+            output_fips_first, dates, metrics)
+    output_data = record_increases(output_data, case_matrix,
+            output_fips_first, dates, metrics)
+
+    output_data = record_growth_metrics(output_data, case_matrix,
+            output_fips_first, growth_metric_days, dates, vectorized_metrics,
+            previous, metric_workers, metrics)
+
+    return output_data, case_matrix
+
+
+@timed("case_data")
 def generate_case_json(county_input: list, state_input: list,
-        fips_data: dict, growth_metric_days: int) -> dict:
+        fips_data: dict, growth_metric_days: int,
+        vectorized_metrics: bool=False, columnar: bool=False,
+        metric_workers: int=1,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> dict:
+    """
+    Returns the date-first case data for both states and counties, as
+    published in covid_data.json, or in the compact layout of
+    covid_data_columnar.json if columnar=True (see columnar.py).
+
+    With metric_workers > 1, the growth metrics are calculated in that many
+    processes, partitioned by state, see parallel_metrics.py. metrics are the
+    metrics to output, see metrics.py.
+    """
     empty_data = defaultdict(dict)
+    dates = DateTable()
     state_data = generate_covid_data(
         state_input, empty_data, fips_data, growth_metric_days, False,
-        is_state_file=True)
+        is_state_file=True, vectorized_metrics=vectorized_metrics,
+        dates=dates, metric_workers=metric_workers, metrics=metrics)
     state_and_county_data = generate_covid_data(
-        county_input, state_data, fips_data, growth_metric_days, False)
+        county_input, state_data, fips_data, growth_metric_days, False,
+        vectorized_metrics=vectorized_metrics, dates=dates,
+        metric_workers=metric_workers, metrics=metrics)
 
+    if columnar:
+        return get_columnar_case_data(state_and_county_data)
     return state_and_county_data
@@ -1,44 +1,47 @@
 from collections import defaultdict
-from datetime import datetime
 import json
 import gzip
+from typing import Iterable
 
-from chalicelib.create_covid_json import record_case_counts, get_daily_increases
+from .case_matrix import CaseMatrix
+from .dates import DateTable
+from .create_covid_json import record_case_counts, get_daily_increases
+from .stage_timer import timed
 
 
-def generate_new_case_data(input_data: list, minimum_case_count: int,
-        is_state_file: bool=False) -> dict:
+def generate_new_case_data(input_data: Iterable[list], minimum_case_count: int,
+        is_state_file: bool=False, dates: DateTable=None) -> dict:
     """
     Outputs a dictionary from FIPS -> list of chronological daily case count
     increases.
 
     The increases are only recorded once this FIPS reached 50 cases.
     """
-    # Offsets of the data within the csv.
-    # Example: 2020-03-28,Snohomish,Washington,53061,912,23
-    DATE = 0
-
-    earliest_date = \
-        datetime.strptime(input_data[1][DATE], '%Y-%m-%d').date()
-    latest_date = datetime.strptime(
-        input_data[-1][DATE], '%Y-%m-%d').date()
-    # Create an empty list for each entry with length being the total days
-    # we might have data for.
-    # This will store case count in reverse chronological order.
-    total_days_of_data = (latest_date - earliest_date).days + 1
-    inverse_chronological_case_data = \
-        defaultdict(lambda: [None] *total_days_of_data)
+    if dates is None:
+        dates = DateTable()
+    # The case matrix grows a column for each day as the rows stream in.
+    case_matrix = CaseMatrix()
 
     # For the purposes of this script we don't care about the output
     # of the first return value, which is a dictionary of all case count
-    # data. We only want the chronological list of cases for each place
-    # that is output 2nd.
-    _, inverse_chronological_case_data = record_case_counts(
-            input_data, defaultdict(dict), False, inverse_chronological_case_data,
-            False, is_state_file, latest_date)
+    # data. We only want the case matrix that is output 2nd.
+    _, case_matrix = record_case_counts(
+            input_data, defaultdict(dict), case_matrix,
+            False, is_state_file, dates)
+    case_matrix.correct_downward_revisions()
+
+    return get_new_case_data(case_matrix, minimum_case_count)
+
 
+def get_new_case_data(case_matrix: CaseMatrix,
+        minimum_case_count: int) -> dict:
+    """
+    Returns the output of generate_new_case_data() for a CaseMatrix that has
+    already been read and corrected, e.g. by build_covid_data().
+    """
     output_data = {}
-    for fips, case_counts in inverse_chronological_case_data.items():
+    for fips in case_matrix.fips:
+        case_counts = case_matrix.inverse_chronological(fips)
         post_minimum_case_counts = \
             [i for i in case_counts if type(i) == int and i >= 50]
         # get_daily_increases will return only the differences from 1 day
@@ -68,13 +71,16 @@ def generate_new_case_data(input_data: list, minimum_case_count: int,
     return output_data
 
 
+@timed("new_case_data")
 def generate_new_case_json(counties_data: list, states_data: list,
         minimum_case_count: int) -> dict:
     print("Entered generate_new_case_json")
+    dates = DateTable()
     state_data = generate_new_case_data(
-        states_data, minimum_case_count, is_state_file=True)
+        states_data, minimum_case_count, is_state_file=True, dates=dates)
     print("Calculated state level new cases")
-    county_data = generate_new_case_data(counties_data, minimum_case_count)
+    county_data = generate_new_case_data(counties_data, minimum_case_count,
+        dates=dates)
     print("Calculated county level new cases")
     state_data.update(county_data)
     return state_data
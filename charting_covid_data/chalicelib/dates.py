@@ -0,0 +1,53 @@
+from datetime import date, datetime, timedelta
+
+
+# Days are counted from this date. It's fixed, rather than being the earliest
+# date in a given input, so day numbers mean the same thing on every run.
+EPOCH = date(2020, 1, 1)
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+class DateTable:
+    """
+    Interns 'YYYY-MM-DD' date strings as integer day numbers counted from
+    EPOCH, and back.
+
+    Every row of the NYT data carries a date string, but there are only a few
+    hundred distinct dates, so each distinct date is parsed or formatted once
+    and looked up from then on. Build one of these per run and work with day
+    numbers internally, only turning them back into strings for the output.
+
+    Example:
+        dates = DateTable()
+        dates.day("2020-01-21")  # 20
+        dates.iso(20)            # "2020-01-21"
+    """
+
+    def __init__(self):
+        # 'YYYY-MM-DD' -> day, and day -> 'YYYY-MM-DD'
+        self.days = {}
+        self.date_strings = {}
+
+    def day(self, date_string: str) -> int:
+        """
+        Returns the day number for a 'YYYY-MM-DD' string.
+        """
+        day = self.days.get(date_string)
+        if day is None:
+            this_date = datetime.strptime(date_string, DATE_FORMAT).date()
+            day = (this_date - EPOCH).days
+            self.days[date_string] = day
+            self.date_strings[day] = date_string
+        return day
+
+    def iso(self, day: int) -> str:
+        """
+        Returns the 'YYYY-MM-DD' string for a day number.
+        """
+        date_string = self.date_strings.get(day)
+        if date_string is None:
+            date_string = (EPOCH + timedelta(days=day)).strftime(DATE_FORMAT)
+            self.date_strings[day] = date_string
+            self.days[date_string] = day
+        return date_string
@@ -0,0 +1,119 @@
+"""
+Caches fips_data.json, the census population and names of each FIPS, across
+runs of the Lambda.
+
+The census data almost never changes, so rather than downloading and
+parsing it every run, a FipsDataCache keeps the parsed data, and its ETag,
+for as long as the Lambda container stays warm. Each run revalidates it with
+a conditional GET, which S3 answers with a 304 and no body if it's
+unchanged. So a hit costs one request, and no download or parse.
+
+The cache can also keep a copy in a store (see storage.py), such as /tmp,
+so a new process, e.g. a local run or a Lambda container whose module was
+reloaded, only has to read it from disk:
+    FIPS_DATA_CACHE = FipsDataCache("charting-covid-prod",
+                                    store=LocalStore("/tmp/charting_covid"))
+
+    def case_data(event):
+        fips_data = FIPS_DATA_CACHE.get(boto3.client("s3"))
+
+Hits and misses are counted in the run in progress, see stage_timer.py:
+    {..., "fips_data_cache_hits": 1, ...}
+"""
+import json
+from typing import Optional
+
+from botocore.exceptions import ClientError
+
+from .artifacts import decompress
+from .stage_timer import count
+
+FIPS_DATA_KEY = "data/fips_data.json"
+
+# The name of the copy of the parsed data and its ETag in the cache's store
+CACHE_NAME = "fips_data_cache.json"
+
+
+class FipsDataCache:
+    """
+    The parsed fips_data.json from an S3 bucket, revalidated by ETag each
+    time it's asked for.
+    """
+
+    def __init__(self, bucket: str, key: str=FIPS_DATA_KEY, store=None):
+        self.bucket = bucket
+        self.key = key
+        self.store = store
+        self.fips_data = None
+        self.etag = None
+        # Since the cache was created, i.e. since the container started
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> None:
+        """
+        Loads the copy of the data in the store, if there is one.
+        """
+        data = self.store.read(CACHE_NAME) if self.store else None
+        if data is None:
+            return
+        try:
+            cached = json.loads(data.decode("utf-8"))
+        except ValueError:
+            # A copy that was only partly written is as good as none.
+            print("Ignoring unreadable {}".format(CACHE_NAME))
+            return
+        self.fips_data = cached["fips_data"]
+        self.etag = cached["etag"]
+
+    def save(self) -> None:
+        """
+        Saves a copy of the data, and its ETag, to the store, if any.
+        """
+        if self.store:
+            self.store.write(CACHE_NAME, json.dumps(
+                {"etag": self.etag, "fips_data": self.fips_data}).encode(
+                    "utf-8"))
+
+    def fetch(self, client) -> Optional[dict]:
+        """
+        Returns the data in S3, or None if it has the same ETag as the data
+        we have.
+        """
+        request = {"Bucket": self.bucket, "Key": self.key}
+        if self.etag:
+            request["IfNoneMatch"] = self.etag
+        try:
+            response = client.get_object(**request)
+        except ClientError as e:
+            if self.etag and e.response["Error"]["Code"] in ["304",
+                                                             "NotModified"]:
+                return None
+            raise
+        fips_data = json.loads(decompress(response["Body"].read(),
+            response.get("ContentEncoding")).decode("utf-8"))
+        self.etag = response.get("ETag")
+        return fips_data
+
+    def get(self, client) -> dict:
+        """
+        Returns the parsed fips_data.json, downloading it only if it's
+        changed since we last did.
+        """
+        if self.fips_data is None:
+            self.load()
+        fips_data = self.fetch(client)
+        hit = fips_data is None
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.fips_data = fips_data
+            self.save()
+        # Both are counted, so a run with no misses logs a 0.
+        count("fips_data_cache_hits", int(hit))
+        count("fips_data_cache_misses", int(not hit))
+        print("fips_data cache {}: {} hits, {} misses since the container "
+              "started".format("hit" if hit else "miss", self.hits,
+                               self.misses))
+        return self.fips_data
@@ -0,0 +1,221 @@
+"""
+Batch computation of growth factor and doubling time for every FIPS and date
+in a CaseMatrix at once.
+
+This is a vectorized version of get_growth_factor() and
+get_averaged_doubling_time() in create_covid_json, which remain the reference
+implementation. Rather than slicing out a list of preceding case counts for
+each date-FIPS pair, we build growth_metric_days shifted views of the case
+matrix, where window[k] holds the case count k days before each date, and
+apply the same rules to all of them with array operations.
+"""
+import math
+
+import numpy as np
+
+from .case_matrix import CaseMatrix
+
+
+# The minimum number of cases needed for a given date-FIPS pair to produce a
+# growth factor and doubling time estimate.
+MIN_CASE_COUNT = 50
+
+
+def get_windows(counts: np.ndarray, valid: np.ndarray,
+        growth_metric_days: int) -> (list, np.ndarray):
+    """
+    Returns a list of shifted views of the case counts, latest first, and a
+    mask of the date-FIPS pairs that have enough data to compute growth
+    metrics.
+
+    window[k][row, i] is the case count k days before day i + growth_metric_days
+    - 1. This mirrors the preceding_case_counts list used by the scalar
+    functions, so window[0] is the latest count.
+    """
+    rows, total_days = counts.shape
+    counts = counts.astype(np.float64)
+
+    windows = []
+    has_data = np.ones((rows, total_days - growth_metric_days + 1), dtype=bool)
+    for k in range(growth_metric_days):
+        end = total_days - k
+        start = growth_metric_days - 1 - k
+        windows.append(counts[:, start:end])
+        has_data &= valid[:, start:end]
+
+    # We need a full window of data and at least the minimum number of cases
+    # to calculate growth metrics.
+    has_data &= windows[0] >= MIN_CASE_COUNT
+    return windows, has_data
+
+
+def get_growth_factors(windows: list, has_data: np.ndarray) -> np.ndarray:
+    """
+    The vectorized version of get_growth_factor(). Returns an array of growth
+    factors, with NaN where no growth factor could be calculated.
+    """
+    num_increases = len(windows) - 1
+    increases = []
+    # How many increases each date-FIPS pair has before we run into 3 equal
+    # case counts in a row, see get_daily_increases().
+    length = np.full(has_data.shape, num_increases)
+    for i in range(num_increases):
+        increase = windows[i] - windows[i + 1]
+        if i != 0:
+            # Estimate a "most likely" value for days with no increase from
+            # the exponential growth rate between the surrounding days.
+            next_count = windows[i - 1]
+            previous_count = windows[i + 1]
+            no_increase = (increase == 0) & (length == num_increases)
+            three_equal = no_increase & (next_count == previous_count)
+            length[three_equal] = i
+            estimate = no_increase & ~three_equal
+            exp_growth_rate = \
+                -np.log(previous_count[estimate] / next_count[estimate]) / 2
+            increase[estimate] = \
+                np.power(math.e, exp_growth_rate) * previous_count[estimate] - \
+                previous_count[estimate]
+        increases.append(increase)
+
+    # Every increase we use needs to be non-zero, since we divide by them.
+    nonzero = np.ones(has_data.shape, dtype=bool)
+    for i in range(num_increases):
+        nonzero &= (increases[i] != 0) | (length <= i)
+
+    # Average the ratio of each day's increase to the day before it. This is
+    # summed in order, the same as the scalar path.
+    total = np.zeros(has_data.shape)
+    for i in range(num_increases - 1):
+        used = length > i + 1
+        total[used] += increases[i][used] / increases[i + 1][used]
+    num_ratios = length - 1
+
+    growth_factors = np.full(has_data.shape, np.nan)
+    computed = has_data & nonzero & (num_ratios > 0)
+    growth_factors[computed] = total[computed] / num_ratios[computed]
+    return growth_factors
+
+
+def get_doubling_times(windows: list, has_data: np.ndarray) -> np.ndarray:
+    """
+    The vectorized version of get_averaged_doubling_time(). Returns an array of
+    doubling times, with NaN where no doubling time could be calculated.
+    """
+    latest_count = windows[0]
+    total = np.zeros(has_data.shape)
+    num_rates = np.zeros(has_data.shape, dtype=np.int64)
+    for i in range(1, len(windows)):
+        exp_growth_rate = -np.log(windows[i] / latest_count) / i
+        # Only positive growth rates produce a doubling time.
+        positive = has_data & (exp_growth_rate > 0)
+        total[positive] += \
+            math.log(2) / np.log(1 + exp_growth_rate[positive])
+        num_rates += positive
+
+    doubling_times = np.full(has_data.shape, np.nan)
+    computed = num_rates > 0
+    doubling_times[computed] = total[computed] / num_rates[computed]
+    return doubling_times
+
+
+def get_growth_metrics(counts: np.ndarray, valid: np.ndarray,
+        growth_metric_days: int) -> (np.ndarray, np.ndarray):
+    """
+    Returns a tuple of growth factor and doubling time arrays for the given
+    FIPS x day arrays of case counts and validity, such as a case matrix's
+    counts and valid. Date-FIPS pairs without a growth metric are NaN. The
+    results agree with get_growth_factor() and get_averaged_doubling_time()
+    to within floating point rounding.
+
+    Each date-FIPS pair only depends on the growth_metric_days days up to and
+    including it, so calculating a slice of the days gives exactly the same
+    results for those days as calculating all of them.
+
+    Likewise, a FIPS that never reaches MIN_CASE_COUNT has no growth metrics,
+    so only the rows that do are calculated. For death counts, that's most
+    of them skipped.
+    """
+    growth_factors = np.full(counts.shape, np.nan)
+    doubling_times = np.full(counts.shape, np.nan)
+    if counts.shape[1] < growth_metric_days or not counts.shape[0]:
+        return growth_factors, doubling_times
+
+    rows = np.nonzero((valid & (counts >= MIN_CASE_COUNT)).any(axis=1))[0]
+    if not len(rows):
+        return growth_factors, doubling_times
+    if len(rows) < counts.shape[0]:
+        counts = counts[rows]
+        valid = valid[rows]
+    else:
+        rows = slice(None)
+
+    # Comparisons and logs involving the NaN/inf of pairs we're going to
+    # discard anyway aren't worth warning about.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        windows, has_data = get_windows(counts, valid, growth_metric_days)
+        growth_factors[rows, growth_metric_days - 1:] = \
+            get_growth_factors(windows, has_data)
+        doubling_times[rows, growth_metric_days - 1:] = \
+            get_doubling_times(windows, has_data)
+    return growth_factors, doubling_times
+
+
+def update_growth_metrics(case_matrix: CaseMatrix, previous: CaseMatrix,
+        growth_metric_days: int) -> (np.ndarray, np.ndarray):
+    """
+    Returns the same growth factor and doubling time arrays as
+    get_growth_metrics() of the case matrix, reusing the metrics already calculated for a
+    previous run's case matrix wherever they can't have changed.
+
+    A growth metric only depends on the growth_metric_days days up to and
+    including its date, so we only recalculate metrics within that window of
+    a count that is new, or differs from the previous run's count. Usually
+    that's just the latest day, plus the days around any revisions.
+    """
+    rows = len(case_matrix)
+    total_days = case_matrix.total_days
+    counts = case_matrix.counts
+    valid = case_matrix.valid
+    growth_factors = np.full((rows, total_days), np.nan)
+    doubling_times = np.full((rows, total_days), np.nan)
+
+    # Everything has changed unless we find it in the previous run.
+    changed = np.ones((rows, total_days), dtype=bool)
+    matched = [(row, previous.fips_index[fips])
+               for row, fips in enumerate(case_matrix.fips)
+               if fips in previous.fips_index]
+    if matched and previous.first_day == case_matrix.first_day:
+        new_rows, old_rows = [np.array(side) for side in zip(*matched)]
+        days = min(previous.total_days, total_days)
+        old_counts = previous.counts[old_rows, :days]
+        old_valid = previous.valid[old_rows, :days]
+        unchanged = (valid[new_rows, :days] == old_valid) & \
+            (~old_valid | (counts[new_rows, :days] == old_counts))
+        changed[new_rows, :days] = ~unchanged
+        growth_factors[new_rows, :days] = \
+            previous.growth_factors[old_rows, :days]
+        doubling_times[new_rows, :days] = \
+            previous.doubling_times[old_rows, :days]
+
+    # The metrics affected by a changed count are those for its day and the
+    # growth_metric_days - 1 days after it.
+    affected = changed.copy()
+    for k in range(1, growth_metric_days):
+        affected[:, k:] |= changed[:, :-k]
+
+    # Recalculate each row from its first affected day on, grouping rows that
+    # start on the same day so each group is one batch.
+    has_affected = affected.any(axis=1)
+    first_affected = np.where(has_affected, affected.argmax(axis=1), -1)
+    for start in np.unique(first_affected[has_affected]).tolist():
+        group = np.nonzero(first_affected == start)[0]
+        # Include the days before start that its growth metrics look back on.
+        window_start = max(start - growth_metric_days + 1, 0)
+        group_growth_factors, group_doubling_times = get_growth_metrics(
+            counts[group, window_start:], valid[group, window_start:],
+            growth_metric_days)
+        offset = start - window_start
+        growth_factors[group, start:] = group_growth_factors[:, offset:]
+        doubling_times[group, start:] = group_doubling_times[:, offset:]
+
+    return growth_factors, doubling_times
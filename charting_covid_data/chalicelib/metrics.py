@@ -0,0 +1,102 @@
+"""
+The metrics recorded for each date-FIPS pair of the case data, and which of
+them are output.
+
+Each row of NYT csv data has a count of cases and of deaths. Each count is a
+series with the same families of metrics: the count itself, the count per
+capita, the increase from the previous day, and the growth factor and
+doubling time. The case metrics keep the names they've always had, and the
+death metrics are prefixed with "deaths_":
+    {"cases": 912, "deaths": 23, "per_capita": 0.0011, "deaths_per_capita":
+     0.000028, "increase": 40, "deaths_increase": 2, "growth_factor": 1.19,
+     "doubling_time": 3.2, "deaths_growth_factor": 1.4, ...}
+
+Pipeline functions take the metrics to output as a list of names. Any of
+them can be switched off by leaving it out, and a series with no metrics
+isn't read from the csv data at all. The default is the case metrics, as
+published in covid_data.json:
+    generate_case_json(county_input, state_input, fips_data, 5,
+                       metrics=DEFAULT_METRICS + ["deaths", "deaths_increase"])
+"""
+from typing import Iterable
+
+# The counts in each row of csv data, in the order they're recorded
+SERIES = ["cases", "deaths"]
+
+FAMILIES = ["count", "per_capita", "increase", "growth_factor",
+            "doubling_time"]
+
+# Every metric, in the order they're recorded into an entry. Growth factor
+# and doubling time are calculated together, so they're recorded together
+# for each series.
+ALL_METRICS = [
+    "cases", "deaths",
+    "per_capita", "deaths_per_capita",
+    "increase", "deaths_increase",
+    "growth_factor", "doubling_time",
+    "deaths_growth_factor", "deaths_doubling_time"
+]
+
+DEFAULT_METRICS = ["cases", "per_capita", "increase", "growth_factor",
+                   "doubling_time"]
+
+
+def get_metric_name(series: str, family: str) -> str:
+    """
+    Returns the name of a family of metrics for a series.
+
+    Example:
+        get_metric_name("cases", "increase")   # "increase"
+        get_metric_name("deaths", "increase")  # "deaths_increase"
+        get_metric_name("deaths", "count")     # "deaths"
+    """
+    if family == "count":
+        return series
+    if series == "cases":
+        return family
+    return "{}_{}".format(series, family)
+
+
+def get_metric_names(metrics: Iterable[str], series: str) -> dict:
+    """
+    Returns the name of each family of metrics of a series that's in
+    metrics, by family. Raises a ValueError for a name that isn't a metric.
+
+    Example:
+        get_metric_names(["cases", "deaths", "deaths_increase"], "deaths")
+        # {"count": "deaths", "increase": "deaths_increase"}
+    """
+    metrics = set(metrics)
+    unknown = metrics.difference(ALL_METRICS)
+    if unknown:
+        raise ValueError("Unknown metrics: {}".format(sorted(unknown)))
+    names = {}
+    for family in FAMILIES:
+        name = get_metric_name(series, family)
+        if name in metrics:
+            names[family] = name
+    return names
+
+
+def has_growth_metrics(names: dict) -> bool:
+    """
+    Returns whether the metric names of a series, as returned by
+    get_metric_names(), include a growth metric.
+    """
+    return "growth_factor" in names or "doubling_time" in names
+
+
+def parse_metrics(value: str) -> list:
+    """
+    Returns the metrics in a comma separated list of names, such as an
+    environment variable, in the order they're recorded. Raises a ValueError
+    for a name that isn't a metric.
+
+    Example:
+        parse_metrics("cases,deaths,increase")
+        # ["cases", "deaths", "increase"]
+    """
+    metrics = [name.strip() for name in value.split(",") if name.strip()]
+    for series in SERIES:
+        get_metric_names(metrics, series)
+    return [name for name in ALL_METRICS if name in metrics]
@@ -0,0 +1,69 @@
+"""
+Calculates the growth metrics of a CaseMatrix in worker processes, a state
+at a time.
+
+A FIPS's growth metrics only depend on its own case counts, so the rows of
+the case matrix are partitioned by state (see get_state_fips()), and each
+state's rows are sent to a ProcessPoolExecutor as two small arrays, its
+counts and validity, rather than as case data dicts. Each worker returns
+the state's growth factor and doubling time arrays, which are copied back
+into the rows they came from, so the result is the same however the work
+was scheduled:
+    growth_factors, doubling_times = get_partitioned_growth_metrics(
+        case_matrix, get_growth_metrics, 5, workers=4)
+
+The metric function is passed in, so either the vectorized
+get_growth_metrics() or the scalar get_scalar_growth_metrics() can be used.
+It must be a module-level function, so it can be pickled.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+import numpy as np
+
+from .case_matrix import CaseMatrix
+from .shards import get_state_fips
+
+
+def partition_by_state(fips: list) -> list:
+    """
+    Returns an array of the rows of each state and its counties, for a list
+    of FIPS, ordered by state FIPS.
+
+    Example:
+        partition_by_state(["53", "53061", "06", "06075"])
+        # [array([2, 3]), array([0, 1])]
+    """
+    partitions = {}
+    for row, fips_id in enumerate(fips):
+        partitions.setdefault(get_state_fips(fips_id), []).append(row)
+    return [np.array(partitions[state], dtype=np.intp)
+            for state in sorted(partitions)]
+
+
+def get_partitioned_growth_metrics(case_matrix: CaseMatrix,
+        metric_function: Callable, growth_metric_days: int,
+        workers: int) -> (np.ndarray, np.ndarray):
+    """
+    Returns the growth factor and doubling time arrays of the case matrix,
+    calculated by metric_function(counts, valid, growth_metric_days) for
+    each state in a pool of workers processes.
+    """
+    counts = case_matrix.counts
+    valid = case_matrix.valid
+    growth_factors = np.full(counts.shape, np.nan)
+    doubling_times = np.full(counts.shape, np.nan)
+    partitions = partition_by_state(case_matrix.fips)
+    if not partitions:
+        return growth_factors, doubling_times
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(metric_function,
+                               [counts[rows] for rows in partitions],
+                               [valid[rows] for rows in partitions],
+                               [growth_metric_days] * len(partitions))
+        for rows, (partition_growth_factors, partition_doubling_times) in \
+                zip(partitions, results):
+            growth_factors[rows] = partition_growth_factors
+            doubling_times[rows] = partition_doubling_times
+    return growth_factors, doubling_times
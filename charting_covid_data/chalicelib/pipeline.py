@@ -0,0 +1,77 @@
+from typing import Iterable
+
+from .case_data import CaseData, build_case_data
+from .checkpoint import load_checkpoint, save_checkpoint
+from .create_new_case_json import get_new_case_data
+from .dates import DateTable
+from .metrics import DEFAULT_METRICS
+from .stage_timer import stage
+
+
+def generate_all_json(county_input: Iterable[list],
+        state_input: Iterable[list], fips_data: dict, growth_metric_days: int,
+        minimum_case_count: int, vectorized_metrics: bool=True,
+        checkpoint_store=None, full_rebuild: bool=False,
+        metric_workers: int=1,
+        metrics: Iterable[str]=DEFAULT_METRICS) -> (CaseData, dict):
+    """
+    Returns a tuple of the case data (see generate_case_json()) and the new
+    case data (see generate_new_case_json()) for the same state and county
+    input.
+
+    Each input is only read once, so it can be an iterator of csv rows, such
+    as those returned by fetch_case_data(). The case matrix built for the case
+    data is reused for the new case data, rather than reading the csv data
+    again.
+
+    The case data is a CaseData (see case_data.py), which builds each date's
+    entries from the case matrices as they're read, rather than holding them
+    all at once. It's equal to, and encodes to the same JSON as, the dict
+    generate_case_json() returns.
+
+    If given a checkpoint_store (see storage.py), growth metrics are updated
+    incrementally from the checkpoint of the previous run where possible, and
+    a new checkpoint is saved for the next run. The output is identical to a
+    full rebuild, which can be forced with full_rebuild=True. Checkpoints are
+    only used with vectorized_metrics.
+
+    With metric_workers > 1, growth metrics that aren't updated from a
+    checkpoint are calculated in that many processes, a state at a time (see
+    parallel_metrics.py).
+
+    metrics are the metrics in the case data (see metrics.py). Deaths are
+    read in the same pass over each input as cases, if there are death
+    metrics, and their growth metrics are checkpointed with the cases'.
+    """
+    use_checkpoint = checkpoint_store is not None and vectorized_metrics
+    previous = {}
+    if use_checkpoint and not full_rebuild:
+        with stage("load_checkpoint"):
+            previous = load_checkpoint(checkpoint_store, growth_metric_days)
+
+    dates = DateTable()
+    case_data = CaseData(dates)
+    new_case_data = {}
+    case_matrices = {}
+    # States come first so that, as in generate_new_case_json(), county new
+    # case data is added after state new case data.
+    for name, csv_data, is_state_file in [("states", state_input, True),
+                                          ("counties", county_input, False)]:
+        with stage("case_data"):
+            case_matrix = build_case_data(csv_data, case_data, fips_data,
+                growth_metric_days, is_state_file=is_state_file,
+                vectorized_metrics=vectorized_metrics,
+                previous=previous.get(name), metric_workers=metric_workers,
+                metrics=metrics)
+        with stage("new_case_data"):
+            new_case_data.update(
+                get_new_case_data(case_matrix, minimum_case_count))
+        case_matrices[name] = case_matrix
+
+    if use_checkpoint:
+        with stage("save_checkpoint"):
+            checkpoint_size = save_checkpoint(checkpoint_store,
+                case_matrices, growth_metric_days, dates)
+        print("Saved checkpoint: {} bytes".format(checkpoint_size))
+
+    return case_data, new_case_data
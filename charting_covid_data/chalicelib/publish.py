@@ -0,0 +1,175 @@
+"""
+Publishes the data artifacts the site loads, such as covid_data.json.
+
+On S3, each artifact is published twice: under its plain name, such as
+data/covid_data.json, which isn't cached, and under a name with a hash of its
+content, such as data/covid_data.1a2b3c4d5e6f.json, which can be cached
+forever since its content never changes. data/manifest.json points at the
+hashed name of each artifact:
+    {"artifacts": {
+        "covid_data.json": {"path": "covid_data.1a2b3c4d5e6f.json",
+                            "sha256": "1a2b...", "bytes": 3582565,
+                            "gzip_bytes": 757113},
+        ...
+    }}
+Paths are relative to the data directory.
+
+Only the artifacts whose content changed, and the manifest, are invalidated
+in CloudFront, and nothing is invalidated if nothing changed.
+
+Both publishers have the same interface: publish_json(name, data) and
+publish_bytes(name, data, content_type) publish an artifact and return its
+stats, and finish() writes the manifest.
+"""
+import json
+import os
+
+import boto3
+from botocore.exceptions import ClientError
+
+from .artifacts import DEFAULT_COMPRESSLEVEL, PUBLISHED_GZIP_ARGS, \
+    iter_json_chunks, json_stats, save_json, upload_gzip
+from .push_to_s3 import clear_cloudfront_cache
+
+MANIFEST_NAME = "manifest.json"
+
+# How many hex digits of the sha256 go in a hashed name
+HASH_LENGTH = 12
+
+# Hashed artifacts never change, so they can be cached for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age={}, immutable".format(
+    60 * 60 * 24 * 365)
+
+
+def hashed_name(name: str, sha256: str) -> str:
+    """
+    Returns the content-hashed version of an artifact name.
+
+    Example:
+        hashed_name("covid_data/state/53.json", "1a2b3c4d5e6f7a8b...")
+        # "covid_data/state/53.1a2b3c4d5e6f.json"
+    """
+    stem, extension = os.path.splitext(name)
+    return "{}.{}{}".format(stem, sha256[:HASH_LENGTH], extension)
+
+
+class S3Publisher:
+    """
+    Publishes gzipped artifacts under prefix in an S3 bucket, and invalidates
+    those that changed since the last run in CloudFront.
+    """
+
+    def __init__(self, bucket: str, prefix: str="data", client=None,
+            compresslevel: int=DEFAULT_COMPRESSLEVEL):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client("s3")
+        self.compresslevel = compresslevel
+        # Manifest entries from the last run, and for this run's artifacts
+        self.previous = self.read_manifest()
+        self.artifacts = {}
+        # The names of artifacts whose content changed
+        self.changed = []
+
+    def key(self, name: str) -> str:
+        return "{}/{}".format(self.prefix, name)
+
+    def read_manifest(self) -> dict:
+        try:
+            stored = self.client.get_object(Bucket=self.bucket,
+                                            Key=self.key(MANIFEST_NAME))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ["NoSuchKey", "404"]:
+                return {}
+            raise
+        return json.loads(stored["Body"].read().decode("utf-8"))["artifacts"]
+
+    def publish(self, name: str, chunks, content_type: str) -> dict:
+        """
+        Publishes chunks of bytes as the artifact name. Returns the stats of
+        upload_gzip(), plus the hashed path.
+        """
+        key = self.key(name)
+        stats = upload_gzip(chunks, self.bucket, key, content_type,
+            self.client, self.compresslevel)
+        stats["path"] = hashed_name(name, stats["sha256"])
+
+        # An unchanged artifact is already published under its hashed name.
+        if self.previous.get(name, {}).get("sha256") != stats["sha256"]:
+            self.client.copy_object(Bucket=self.bucket,
+                Key=self.key(stats["path"]),
+                CopySource={"Bucket": self.bucket, "Key": key},
+                MetadataDirective="REPLACE", ContentType=content_type,
+                **dict(PUBLISHED_GZIP_ARGS,
+                       CacheControl=IMMUTABLE_CACHE_CONTROL))
+            self.changed.append(name)
+
+        self.artifacts[name] = {
+            "path": stats["path"],
+            "sha256": stats["sha256"],
+            "bytes": stats["bytes"],
+            "gzip_bytes": stats["gzip_bytes"]
+        }
+        return stats
+
+    def publish_json(self, name: str, data) -> dict:
+        return json_stats(self.publish(name, iter_json_chunks(data),
+                                       "application/json"))
+
+    def publish_bytes(self, name: str, data: bytes,
+            content_type: str="application/octet-stream") -> dict:
+        return self.publish(name, [data], content_type)
+
+    def finish(self) -> list:
+        """
+        Writes the manifest and invalidates the paths that changed. Returns
+        the invalidated paths, which are empty if nothing changed.
+        """
+        if not self.changed:
+            print("No artifacts changed, skipping invalidation")
+            return []
+
+        # Keep entries for artifacts we didn't publish this time, e.g. if
+        # sharding was turned off, so the paths they point at stay valid.
+        manifest = {"artifacts": dict(self.previous, **self.artifacts)}
+        self.client.put_object(Bucket=self.bucket,
+            Key=self.key(MANIFEST_NAME), Body=json.dumps(manifest),
+            ACL="public-read", ContentType="application/json",
+            CacheControl=PUBLISHED_GZIP_ARGS["CacheControl"])
+
+        paths = ["/" + self.key(name)
+                 for name in self.changed + [MANIFEST_NAME]]
+        clear_cloudfront_cache(paths)
+        return paths
+
+
+class LocalPublisher:
+    """
+    Writes artifacts as plain files in a local directory, for local
+    development. The manifest points at the plain names.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.artifacts = {}
+
+    def path(self, name: str) -> str:
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def publish_json(self, name: str, data) -> dict:
+        stats = save_json(data, self.path(name))
+        self.artifacts[name] = {"path": name, "sha256": stats["sha256"]}
+        return stats
+
+    def publish_bytes(self, name: str, data: bytes,
+            content_type: str="application/octet-stream") -> dict:
+        with open(self.path(name), "wb") as output:
+            output.write(data)
+        self.artifacts[name] = {"path": name}
+        return {"bytes": len(data)}
+
+    def finish(self) -> list:
+        save_json({"artifacts": self.artifacts}, self.path(MANIFEST_NAME))
+        return []
@@ -1,14 +1,35 @@
-import argparse
+import gzip
+import hashlib
 import mimetypes
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from io import BytesIO
 
 import boto3
+import brotli
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 # cache static assets for one year, rely on filename to break cache
-STATIC_ASSET_CACHE_CONTROL = "no-cache, max-age={}".format(60 * 60 * 24 * 365)
+STATIC_ASSET_CACHE_CONTROL = "public, max-age={}".format(60 * 60 * 24 * 365)
 CLOUDFRONT_DISTRIBUTION_ID = "EMZKVG33KBTNS"
 
+# How many files to upload at once
+MAX_WORKERS = 16
+# Most of our files are small enough to upload in a single request. Larger
+# ones are uploaded in parts, a few at a time.
+TRANSFER_CONFIG = TransferConfig(multipart_threshold=16 * 1024 * 1024,
+                                 multipart_chunksize=16 * 1024 * 1024,
+                                 max_concurrency=4)
+
+# Content types other than text/* that are worth compressing. Our other
+# images are already compressed.
+COMPRESSIBLE_TYPES = ["application/javascript", "application/json",
+                      "image/svg+xml"]
+
 
 def generate_object_name(destination, file_path, separator):
     """
@@ -31,22 +52,143 @@ def generate_object_name(destination, file_path, separator):
     return os.path.join(destination, file_path.split(separator)[1])
 
 
-def upload_file(file_name, destination="", bucket="ramble-prod", separator="/"):
+def get_digests(chunks):
+    """
+    Compute the digests we compare with an object on s3 to tell if what we're
+    uploading has changed.
+    :param chunks: An iterable of the bytes to upload
+    :return: A tuple of the hex sha256 and md5 of the bytes
+    """
+    sha256 = hashlib.sha256()
+    md5 = hashlib.md5()
+    for chunk in chunks:
+        sha256.update(chunk)
+        md5.update(chunk)
+    return sha256.hexdigest(), md5.hexdigest()
+
+
+def get_file_digests(file_name):
+    """
+    Compute the digests of a file, as with get_digests.
+    :param file_name: The local path of the file
+    :return: A tuple of the hex sha256 and md5 of the file
+    """
+    with open(file_name, "rb") as local_file:
+        return get_digests(iter(lambda: local_file.read(64 * 1024), b""))
+
+
+def gzip_compress(data):
+    """
+    Gzip bytes at the highest level. The timestamp is left out so the same
+    bytes always compress the same way, and can be seen to be unchanged.
+    """
+    output = BytesIO()
+    with gzip.GzipFile(fileobj=output, mode="wb", compresslevel=9,
+                       mtime=0) as gzip_file:
+        gzip_file.write(data)
+    return output.getvalue()
+
+
+def compress_file(file_name):
+    """
+    Compress a file with both gzip and brotli at their highest levels and
+    pick whichever is smallest. If webpack already gzipped the file, with
+    zopfli, as file_name.gz, that's a candidate too.
+    :param file_name: The local path of the file
+    :return: A tuple of the ContentEncoding and the compressed bytes, or None
+        and the file's own bytes if compressing doesn't make it smaller
+    """
+    with open(file_name, "rb") as local_file:
+        data = local_file.read()
+    variants = [(None, data),
+                ("gzip", gzip_compress(data)),
+                ("br", brotli.compress(data, quality=11))]
+    if os.path.exists(file_name + ".gz"):
+        with open(file_name + ".gz", "rb") as gzip_file:
+            variants.append(("gzip", gzip_file.read()))
+    # min() keeps the first of equal sizes, so we'd rather not compress
+    return min(variants, key=lambda variant: len(variant[1]))
+
+
+def is_compressible(content_type):
+    """
+    :param content_type: The ContentType we'd upload a file with, if any
+    :return: True if a file of this type is worth compressing
+    """
+    content_type = content_type or ""
+    return content_type.startswith("text/") or \
+        content_type in COMPRESSIBLE_TYPES
+
+
+def is_unchanged(s3, bucket, object_name, digests, extra_args):
+    """
+    Check with a HEAD request whether an object on s3 already has the content
+    and headers we're about to upload.
+    :param s3: The boto3 s3 client
+    :param bucket: The bucket the object is in
+    :param object_name: The object's name within the bucket
+    :param digests: The local file's digests, from get_file_digests
+    :param extra_args: The ExtraArgs we'd upload the file with
+    :return: True if uploading the file would change nothing
+    """
+    try:
+        head = s3.head_object(Bucket=bucket, Key=object_name)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ["NoSuchKey", "404"]:
+            return False
+        raise
+
+    for header in ["ContentType", "ContentEncoding", "CacheControl"]:
+        if head.get(header) != extra_args.get(header):
+            return False
+
+    sha256, md5 = digests
+    # Objects we've uploaded store their sha256. Otherwise the ETag of an
+    # object uploaded in a single part is its md5.
+    if "sha256" in head.get("Metadata", {}):
+        return head["Metadata"]["sha256"] == sha256
+    return head["ETag"].strip('"') == md5
+
+
+def create_s3_client(max_workers=MAX_WORKERS):
+    """
+    Create an s3 client that can be shared by max_workers threads, each
+    uploading with TRANSFER_CONFIG, without running out of connections.
+    :param max_workers: The number of threads that will share the client
+    :return: A boto3 s3 client
+    """
+    max_pool_connections = max_workers * TRANSFER_CONFIG.max_request_concurrency
+    return boto3.client("s3",
+                        config=Config(max_pool_connections=max_pool_connections))
+
+
+def new_upload_summary():
+    """
+    :return: A dict for upload_file to count what it uploaded and skipped in
+    """
+    return {"uploaded": 0, "unchanged": 0, "bytes_uploaded": 0,
+            "bytes_saved": 0, "bytes_compressed": 0}
+
+
+def upload_file(file_name, destination="", bucket="ramble-prod", separator="/",
+        s3=None, summary=None):
     """
-    Upload a file to an s3 bucket.
+    Upload a file to an s3 bucket, unless the object there is identical.
+    Files worth compressing are uploaded as their smallest compressed
+    variant, see compress_file.
     :param file_name: File to upload
     :param destination: The path in the bucket to upload file to
     :param bucket: Bucket to upload file to
     :param separator: Split the file name at this string, used to remove the
         local path from the file to upload.
+    :param s3: The boto3 s3 client to use, if not a new one
+    :param summary: A dict from new_upload_summary to count the file in
     :return The object name or an empty string if we didn't upload
     """
 
-    s3 = boto3.client("s3")
+    s3 = s3 or boto3.client("s3")
 
-    print("upload_file - file_name:   {}".format(file_name))
     object_name = generate_object_name(destination, file_name, separator)
-    print("upload_file - object_name: {}".format(object_name))
 
     extra_args = {
         "ACL": "public-read",
@@ -59,101 +201,170 @@ def upload_file(file_name, destination="", bucket="ramble-prod", separator="/"):
     if not ext:
         extra_args["ContentType"] = "text/html"
 
-    # Don't upload uncompressed JS
-    if ext == ".js":
+    # Our JS is cache busted by the ?timestamp it's loaded with, whether it's
+    # uploaded from webpack's gzipped file or compressed here
+    if ext in [".css", ".js", ".svg", ".jpg", ".jpeg", ".png"]:
+        extra_args["CacheControl"] = STATIC_ASSET_CACHE_CONTROL
+
+    # Webpack gzips our JS beside the original, which is a candidate for
+    # compressing the original, see compress_file
+    if ext == ".gz" and os.path.exists(os.path.splitext(file_name)[0]):
         return ""
 
-    if ext in [".css", ".svg", ".jpg", ".jpeg", ".png"]:
+    # Tell s3 our js or json file is gzipped, if only the gzipped file was
+    # built. Data files change under the same name, so they aren't cached.
+    if ext == ".gz" and fn.endswith(".js"):
+        extra_args["ContentEncoding"] = "gzip"
         extra_args["CacheControl"] = STATIC_ASSET_CACHE_CONTROL
-
-    # Tell s3 our js file is gzipped
-    if ext == ".gz" and (fn.endswith(".js") or fn.endswith(".json")):
+        object_name = fn
+    elif ext == ".gz" and fn.endswith(".json"):
         extra_args["ContentEncoding"] = "gzip"
         extra_args["CacheControl"] = "no-cache, max-age=0"
-
         object_name = fn
     elif ext == ".gz":  # ignore gzipped source maps
-        print("Exiting because GZIP")
         return ""
 
     # Use proper content-type for a JS source map
     if ext == ".map":
         extra_args["ContentType"] = "application/octet-stream"
 
-    s3.upload_file(file_name,
-                   bucket,
-                   object_name,
-                   ExtraArgs=extra_args)
-    print("Uploaded file: {}".format(object_name))
+    # Compress what's worth compressing, unless it's already compressed
+    size = os.path.getsize(file_name)
+    body = None
+    if "ContentEncoding" not in extra_args and \
+            is_compressible(extra_args["ContentType"]):
+        encoding, body = compress_file(file_name)
+        if encoding:
+            extra_args["ContentEncoding"] = encoding
+        print("Compressed {}: {} -> {} bytes ({})".format(
+            object_name, size, len(body), encoding or "uncompressed"))
+        if summary is not None:
+            summary["bytes_compressed"] += size - len(body)
+        size = len(body)
+
+    # Skip the upload if the object on s3 is already the same
+    if body is not None:
+        digests = get_digests([body])
+    else:
+        digests = get_file_digests(file_name)
+    if is_unchanged(s3, bucket, object_name, digests, extra_args):
+        print("Unchanged: {}".format(object_name))
+        if summary is not None:
+            summary["unchanged"] += 1
+            summary["bytes_saved"] += size
+        return ""
+    extra_args["Metadata"] = {"sha256": digests[0]}
+
+    if body is not None:
+        s3.upload_fileobj(BytesIO(body),
+                          bucket,
+                          object_name,
+                          ExtraArgs=extra_args,
+                          Config=TRANSFER_CONFIG)
+    else:
+        s3.upload_file(file_name,
+                       bucket,
+                       object_name,
+                       ExtraArgs=extra_args,
+                       Config=TRANSFER_CONFIG)
+    if summary is not None:
+        summary["uploaded"] += 1
+        summary["bytes_uploaded"] += size
     return object_name
 
 
-def clear_cloudfront_cache():
+def push_directory(directory, destination="", bucket="ramble-prod",
+        max_workers=MAX_WORKERS):
     """
-    Invalidates all files in our cloudfront cache
+    Upload every file in a directory to an s3 bucket, max_workers at a time,
+    sharing one s3 client. Object names are the same as upload_file gives
+    them one at a time.
+    :param directory: The local directory to upload
+    :param destination: The path in the bucket to upload files to
+    :param bucket: Bucket to upload files to
+    :param max_workers: How many files to upload at once
+    :return: A tuple of the sorted names of the objects uploaded, and a
+        summary as from new_upload_summary, plus the wall clock seconds taken
     """
+    file_paths = [os.path.join(root, filename)
+                  for root, _, filenames in os.walk(directory)
+                  for filename in filenames]
+    s3 = create_s3_client(max_workers)
+
+    def timed_upload(file_path):
+        # Each upload counts itself in its own summary, which we add up here
+        # rather than sharing one between threads.
+        file_summary = new_upload_summary()
+        start = time.perf_counter()
+        object_name = upload_file(file_path, destination, bucket=bucket,
+                                  separator=directory, s3=s3,
+                                  summary=file_summary)
+        return object_name, file_summary, time.perf_counter() - start
+
+    start = time.perf_counter()
+    uploaded_files = []
+    summary = new_upload_summary()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(timed_upload, file_path): file_path
+                   for file_path in file_paths}
+        for future in as_completed(futures):
+            object_name, file_summary, seconds = future.result()
+            for key, value in file_summary.items():
+                summary[key] += value
+            if object_name:
+                print("Uploaded: {} ({:.3f}s)".format(object_name, seconds))
+                uploaded_files.append(object_name)
+            else:
+                print("Skipped:  {} ({:.3f}s)".format(futures[future],
+                                                     seconds))
+    summary["seconds"] = time.perf_counter() - start
+    return sorted(uploaded_files), summary
+
+
+def print_upload_summary(summary):
+    """
+    Print what push_directory uploaded and skipped, and how fast.
+    :param summary: The summary returned by push_directory
+    """
+    megabytes_per_second = \
+        summary["bytes_uploaded"] / 1024 / 1024 / max(summary["seconds"], 1e-9)
+    print("Uploaded {uploaded} files ({bytes_uploaded} bytes), skipped "
+          "{unchanged} unchanged files ({bytes_saved} bytes saved) in "
+          "{seconds:.2f}s".format(**summary))
+    print("Compression saved {bytes_compressed} bytes".format(**summary))
+    print("Throughput: {:.2f} MB/s".format(megabytes_per_second))
+
+
+def clear_cloudfront_cache(paths=None):
+    """
+    Invalidates the given paths in our cloudfront cache, or all files if no
+    paths are given
+    """
+    paths = paths or ["/*"]
     client = boto3.client("cloudfront")
     client.create_invalidation(
         DistributionId=CLOUDFRONT_DISTRIBUTION_ID,
         InvalidationBatch={
             'Paths': {
-                'Quantity': 1,
-                'Items': ["/*"]
+                'Quantity': len(paths),
+                'Items': paths
             },
             # CallerReference needs to be a unique value in order to perform
             # an invalidation
             'CallerReference': str(int(datetime.now().timestamp()))
         }
     )
-    print("Cloudfront cache invalidated")
-
-
-argparse_description = """Push a directory to s3, maintaining the directory structure within the source directory at the destination on s3.
-
-If the provided directory has the following structure:
-test/
-  foo/
-    README.md
-  hello.txt
-
-and the destination is: "static", the following objects will get uploaded to s3:
-- static/test/foo/README.md
-- static/test/hello.txt"""
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description=argparse_description,
-                                     formatter_class=argparse.RawTextHelpFormatter)
-    parser.add_argument("--directory",
-                        default="dist",
-                        help="Path to directory to upload to S3")
-    parser.add_argument("--destination",
-                        default="",
-                        help="Path to save files to in S3 bucket. Default is bucket root")
-    parser.add_argument("--bucket",
-                        default="charting-covid-prod",
-                        help="Name of S3 bucket to update")
-    args = parser.parse_args()
-
-    confirm = False
-    if args.bucket == "charting-covid-prod":
-        confirm = input("Are you sure you want to deploy to production? (yes/no): ")
-
-    if confirm == "yes" or args.bucket != "charting-covid-prod":
-        for root, _, filenames in os.walk(args.directory):
-            for filename in filenames:
-                print(filename)
-                file_path = os.path.join(root, filename)
-                uploaded_file = upload_file(file_path,
-                                            args.destination,
-                                            bucket=args.bucket,
-                                            separator=args.directory)
-                if uploaded_file:
-                    print("Uploaded: {}".format(uploaded_file))
-                else:
-                    print("Skipped:  {}".format(file_path))
-
-        # if we deployed to producton, clear cloudfront cache and post to slack
-        if args.bucket == "charting-covid-prod":
-            clear_cloudfront_cache()
-    else:
-        print("Did not deploy")
+    print("Cloudfront cache invalidated: {}".format(paths))
+
+
+def get_invalidation_paths(object_names):
+    """
+    Returns the cloudfront paths to invalidate after uploading the given
+    objects. Every page of the site is served from index.html, so if that
+    changed we have to invalidate everything.
+    :param object_names: The names of the objects uploaded
+    :return: A list of paths, empty if nothing needs invalidating
+    """
+    if "index.html" in object_names:
+        return ["/*"]
+    return ["/" + object_name for object_name in object_names]
@@ -0,0 +1,120 @@
+"""
+Splits covid_data.json into smaller shards, so a page that only shows one
+state, or the latest date, doesn't have to download the whole national
+history.
+
+Each shard has the same date -> FIPS -> metrics layout as covid_data.json,
+restricted to one date or one state. A manifest lists the shards of each
+kind, with their size and sha256, e.g. covid_data/state/manifest.json:
+    {"shard_by": "state",
+     "shards": {
+        "53": {"path": "covid_data/state/53.json", "json_bytes": 40960,
+               "gzip_bytes": 4096, "sha256": "9f86..."},
+        ...
+     }
+    }
+
+Shards are made, and written, one at a time, so only one is held at once on
+top of the case data. A state shard of a CaseData (see case_data.py) is a
+CaseData of just the state's FIPS, so it's built a date at a time as it's
+encoded, like the case data itself.
+"""
+from typing import Callable, Iterable, Iterator, Tuple
+
+# The pseudo-FIPS the NYT data uses for the five boroughs together, see
+# record_case_counts()
+NYC_FIPS = "-10003"
+NEW_YORK_FIPS = "36"
+
+MANIFEST_NAME = "manifest.json"
+
+
+def get_state_fips(fips: str) -> str:
+    """
+    Returns the state FIPS for a state or county FIPS.
+    """
+    if fips == NYC_FIPS:
+        return NEW_YORK_FIPS
+    return fips[:2]
+
+
+def shard_by_date(case_data: dict) -> Iterator[Tuple[str, dict]]:
+    """
+    Yields a tuple of each date and the shard of date-first case data for
+    it.
+    """
+    for date_string, locations in case_data.items():
+        yield date_string, {date_string: locations}
+
+
+def get_state_fips_lists(fips_ids: Iterable[str]) -> dict:
+    """
+    Returns the given FIPS grouped by their state FIPS, in the order each
+    state first appears.
+    """
+    states = {}
+    for fips in fips_ids:
+        states.setdefault(get_state_fips(fips), []).append(fips)
+    return states
+
+
+def shard_by_state(case_data: dict) -> Iterator[Tuple[str, dict]]:
+    """
+    Yields a tuple of each state FIPS and the shard of date-first case data
+    with the state and its counties, in the order the states first appear.
+
+    Every shard has every date, as covid_data.json does, even those the state
+    has no data for.
+    """
+    if not isinstance(case_data, dict):
+        # a CaseData
+        for state_fips, fips_ids in \
+                get_state_fips_lists(case_data.get_fips()).items():
+            yield state_fips, case_data.select(fips_ids)
+        return
+
+    all_fips = dict.fromkeys(fips for locations in case_data.values()
+                             for fips in locations)
+    for state_fips, fips_ids in get_state_fips_lists(all_fips).items():
+        fips_ids = set(fips_ids)
+        yield state_fips, {
+            date_string: {fips: metrics for fips, metrics in locations.items()
+                          if fips in fips_ids}
+            for date_string, locations in case_data.items()}
+
+
+SHARD_BY = {
+    "date": shard_by_date,
+    "state": shard_by_state
+}
+
+
+def write_shards(case_data: dict, shard_by: str,
+        write: Callable[[str, dict], dict], prefix: str="covid_data") -> dict:
+    """
+    Writes each shard of case_data, and then the manifest, and returns the
+    manifest.
+
+    shard_by is one of SHARD_BY. write(path, data) writes data to a path
+    relative to the data directory, and returns its stats, like
+    publish_json() in publish.py. Shards are written to
+    "{prefix}/{shard_by}/{name}.json". If the stats have a "path", e.g. a
+    content-hashed one, that's the path the manifest lists.
+    """
+    if shard_by not in SHARD_BY:
+        raise ValueError("Can't shard by {}, expected one of {}".format(
+            shard_by, list(SHARD_BY)))
+
+    directory = "{}/{}".format(prefix, shard_by)
+    manifest = {"shard_by": shard_by, "shards": {}}
+    for name, shard in SHARD_BY[shard_by](case_data):
+        path = "{}/{}.json".format(directory, name)
+        stats = write(path, shard)
+        entry = {"path": stats.get("path", path)}
+        for key in ["json_bytes", "gzip_bytes", "sha256"]:
+            if key in stats:
+                entry[key] = stats[key]
+        manifest["shards"][name] = entry
+
+    write("{}/{}".format(directory, MANIFEST_NAME), manifest)
+    return manifest
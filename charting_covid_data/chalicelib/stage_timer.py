@@ -0,0 +1,263 @@
+"""
+Times each stage of a run, such as fetching the case data or publishing
+covid_data.json, and logs the results as a single JSON line at the end.
+
+The log line is in CloudWatch's embedded metric format, so each stage's
+wall time, CPU time and peak memory, each artifact's size and each
+counter, such as cache hits, become metrics without a metric filter:
+    {"_aws": {"Timestamp": 1586300000000, "CloudWatchMetrics": [...]},
+     "Run": "case_data", "Status": "ok",
+     "fetch_wall_ms": 812.5, "fetch_cpu_ms": 95.1,
+     "fetch_peak_bytes": 1048576, ...,
+     "covid_data.json_gzip_bytes": 757113, ...,
+     "fips_data_cache_hits": 1, ...,
+     "Stages": {"fetch": {"wall_ms": 812.5, "cpu_ms": 95.1,
+                          "peak_bytes": 1048576, "calls": 1}, ...}}
+
+Library code marks its stages with stage() or @timed(), which record into
+the run in progress, if any, and otherwise do nothing:
+    with RunTimer("case_data"):
+        case_input, fetch_state = fetch_case_data(fetch_state)
+        with stage("publish"):
+            stats = publisher.publish_json("covid_data.json", case_data)
+        record_sizes("covid_data.json", stats)
+        count("fips_data_cache_hits")
+
+A stage that runs more than once adds up its times. Peak memory is what
+tracemalloc sees a stage allocate, so only the outermost of nested stages
+measures it. Tracing slows down a run that allocates many small objects, so
+it's off unless asked for with trace_memory=True, and left out otherwise.
+
+Stages can also be profiled with cProfile, by name. Every call of a
+profiled stage goes into one profile, which is written to each of the
+profile stores (see storage.py) when the run ends, both as .pstats for
+pstats or snakeviz and as a text summary of the slowest functions:
+    stores = [LocalStore("/tmp/profiles")]
+    with RunTimer("case_data", profile_stages=["record_case_counts"],
+                  profile_stores=stores):
+        ...
+    # /tmp/profiles/case_data-20200407T120000-record_case_counts.pstats
+    # /tmp/profiles/case_data-20200407T120000-record_case_counts.txt
+Only one stage is profiled at a time, so a profiled stage nested in another
+isn't. Stages that aren't profiled don't pay for it.
+"""
+import cProfile
+import io
+import json
+import marshal
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from typing import Callable, Iterable, Optional
+
+# The CloudWatch namespace the metrics are published under
+NAMESPACE = "ChartingCovid"
+
+# How many of the slowest functions, by cumulative time, a profile's text
+# summary lists
+PROFILE_TOP = 30
+
+# The RunTimer in progress
+_active = None
+
+
+class RunTimer:
+    """
+    Records the stages of one run. Used as a context manager, stages marked
+    with stage() and @timed() record into it, and its log line is printed
+    when it exits.
+    """
+
+    def __init__(self, name: str, trace_memory: bool=False,
+            profile_stages: Iterable[str]=(), profile_stores: list=(),
+            profile_top: int=PROFILE_TOP):
+        self.name = name
+        self.trace_memory = trace_memory
+        self.profile_stages = set(profile_stages)
+        self.profile_stores = profile_stores
+        self.profile_top = profile_top
+        # Stage name -> cProfile.Profile, and whether one is running
+        self.profiles = {}
+        self.profiling = False
+        self.started = datetime.utcnow()
+        # Stage name -> {"wall_ms", "cpu_ms", "peak_bytes", "calls"}
+        self.stages = {}
+        # "<artifact>_<size>" -> bytes, e.g. "covid_data.json_gzip_bytes"
+        self.sizes = {}
+        # Counter name -> count, e.g. "fips_data_cache_hits"
+        self.counts = {}
+        self.status = "ok"
+        self.previous = None
+
+    def __enter__(self) -> "RunTimer":
+        global _active
+        self.previous = _active
+        _active = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active
+        _active = self.previous
+        if exc_type is not None:
+            self.status = "error"
+        self.write_profiles()
+        print(self.log_line())
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Times the body of a with block as the stage name.
+        """
+        # Only the outermost stage traces, so it owns the peak.
+        traced = self.trace_memory and not tracemalloc.is_tracing()
+        if traced:
+            tracemalloc.start()
+        profile = None
+        if name in self.profile_stages and not self.profiling:
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+            self.profiling = True
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                self.profiling = False
+            entry = self.stages.setdefault(name, {
+                "wall_ms": 0.0, "cpu_ms": 0.0, "peak_bytes": None,
+                "calls": 0})
+            entry["wall_ms"] += (time.perf_counter() - wall_start) * 1000
+            entry["cpu_ms"] += (time.process_time() - cpu_start) * 1000
+            entry["calls"] += 1
+            if traced:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                entry["peak_bytes"] = max(entry["peak_bytes"] or 0, peak)
+
+    def record_size(self, name: str, size: int) -> None:
+        self.sizes[name] = size
+
+    def count(self, name: str, increment: int=1) -> None:
+        self.counts[name] = self.counts.get(name, 0) + increment
+
+    def write_profiles(self) -> list:
+        """
+        Writes the .pstats and text summary of each profiled stage to the
+        profile stores, and returns their names.
+        """
+        names = []
+        stamp = self.started.strftime("%Y%m%dT%H%M%S")
+        for stage_name, profile in self.profiles.items():
+            prefix = "{}-{}-{}".format(self.name, stamp, stage_name)
+            summary = io.StringIO()
+            stats = pstats.Stats(profile, stream=summary)
+            stats.sort_stats("cumulative").print_stats(self.profile_top)
+            for name, data in [
+                    # The same as stats.dump_stats(), without a file
+                    (prefix + ".pstats", marshal.dumps(stats.stats)),
+                    (prefix + ".txt", summary.getvalue().encode("utf-8"))]:
+                for store in self.profile_stores:
+                    store.write(name, data)
+                names.append(name)
+        if names:
+            print("Wrote profiles: {}".format(names))
+        return names
+
+    def log_line(self) -> str:
+        """
+        Returns the run's results as a line of JSON in CloudWatch's embedded
+        metric format.
+        """
+        metrics = {}
+        units = {}
+        for name, entry in self.stages.items():
+            for key, unit in [("wall_ms", "Milliseconds"),
+                              ("cpu_ms", "Milliseconds"),
+                              ("peak_bytes", "Bytes")]:
+                if entry[key] is not None:
+                    metric = "{}_{}".format(name, key)
+                    metrics[metric] = round(entry[key], 1)
+                    units[metric] = unit
+        for name, size in self.sizes.items():
+            metrics[name] = size
+            units[name] = "Bytes"
+        for name, total in self.counts.items():
+            metrics[name] = total
+            units[name] = "Count"
+
+        stages = {name: dict(entry, wall_ms=round(entry["wall_ms"], 1),
+                             cpu_ms=round(entry["cpu_ms"], 1))
+                  for name, entry in self.stages.items()}
+        line = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [["Run"]],
+                    "Metrics": [{"Name": metric, "Unit": units[metric]}
+                                for metric in metrics]
+                }]
+            },
+            "Run": self.name,
+            "Status": self.status,
+            "Stages": stages
+        }
+        line.update(metrics)
+        return json.dumps(line)
+
+
+def active_run() -> Optional[RunTimer]:
+    return _active
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Times the body of a with block as the stage name of the run in progress,
+    if any.
+    """
+    if _active is None:
+        yield
+    else:
+        with _active.stage(name):
+            yield
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorates a function so each call is timed as the stage name of the run
+    in progress, if any.
+    """
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, increment: int=1) -> None:
+    """
+    Adds to a counter of the run in progress, if any, such as cache hits.
+    """
+    if _active is not None:
+        _active.count(name, increment)
+
+
+def record_sizes(artifact: str, stats: dict) -> None:
+    """
+    Records the sizes in an artifact's stats, such as those returned by
+    publish_json(), in the run in progress, if any.
+    """
+    if _active is None:
+        return
+    for key in ["bytes", "json_bytes", "gzip_bytes"]:
+        if key in stats:
+            _active.record_size("{}_{}".format(artifact, key), stats[key])
@@ -0,0 +1,62 @@
+"""
+Places to keep the pipeline's own state between runs, such as checkpoints,
+either on local disk or in our S3 bucket.
+
+Both stores have the same interface: read(name) returns the bytes saved under
+name, or None if there aren't any, and write(name, data) saves them.
+"""
+import os
+from typing import Optional
+
+import boto3
+from botocore.exceptions import ClientError
+
+
+class LocalStore:
+    """
+    Keeps files in a local directory, e.g. /tmp, for local development.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def read(self, name: str) -> Optional[bytes]:
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as stored:
+            return stored.read()
+
+    def write(self, name: str, data: bytes) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name), "wb") as stored:
+            stored.write(data)
+
+
+class S3Store:
+    """
+    Keeps objects under a prefix in an S3 bucket. Unlike the data we publish,
+    these objects are private.
+    """
+
+    def __init__(self, bucket: str, prefix: str="", client=None):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client("s3")
+
+    def key(self, name: str) -> str:
+        return "{}/{}".format(self.prefix, name) if self.prefix else name
+
+    def read(self, name: str) -> Optional[bytes]:
+        try:
+            stored = self.client.get_object(Bucket=self.bucket,
+                                            Key=self.key(name))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ["NoSuchKey", "404"]:
+                return None
+            raise
+        return stored["Body"].read()
+
+    def write(self, name: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self.key(name),
+                               Body=data)
@@ -1,15 +1,161 @@
-import requests
 import csv
-from io import StringIO
+import hashlib
+import io
+import json
+import tempfile
+from contextlib import ExitStack
+from typing import Optional
+
+import requests
+
+from .stage_timer import timed
+
+
+CASE_DATA_URLS = {
+    "counties": "https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv",
+    "states": "https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv"
+}
+
+# Where fetch_case_data() keeps the validators and fingerprint of each source
+FETCH_STATE_NAME = "fetch_state.json"
+
+CHUNK_SIZE = 64 * 1024
+
+
+class SpooledRows:
+    """
+    An iterator over the parsed rows of a spooled CSV file, which closes the
+    file once they've all been read. Call close() to free the file without
+    reading them, such as when they turn out not to be needed.
+    """
+
+    def __init__(self, spool):
+        self.spool = spool
+        spool.seek(0)
+        self.rows = csv.reader(
+            io.TextIOWrapper(spool, encoding="utf-8", newline=""))
+
+    def __iter__(self) -> "SpooledRows":
+        return self
+
+    def __next__(self) -> list:
+        try:
+            return next(self.rows)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        self.spool.close()
+
+
+def fetch_csv(url: str, previous: dict,
+        session) -> (Optional[SpooledRows], dict):
+    """
+    Fetches a CSV file, unless it hasn't changed since we last fetched it.
+
+    previous is the state returned by the last call for this url. Its ETag and
+    Last-Modified validators are sent as a conditional request, so an
+    unchanged file costs a 304 and no body.
+
+    Otherwise the body is streamed into a temporary file in chunks, hashing it
+    on the way through, so only one chunk is ever held in memory. The file is
+    closed if the download fails. Returns a tuple of SpooledRows over the
+    parsed rows (or None if the server said the file is unchanged) and the
+    new state for this url:
+        {"etag": "...", "last_modified": "...", "fingerprint": "..."}
+
+    The rows are parsed from the temporary file as they're consumed, so they
+    can be fed straight into record_case_counts() without building a list.
+    """
+    headers = {}
+    if previous.get("etag"):
+        headers["If-None-Match"] = previous["etag"]
+    if previous.get("last_modified"):
+        headers["If-Modified-Since"] = previous["last_modified"]
+
+    with session.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            return None, previous
+        response.raise_for_status()
+
+        fingerprint = hashlib.sha256()
+        spool = tempfile.TemporaryFile()
+        try:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                fingerprint.update(chunk)
+                spool.write(chunk)
+        except BaseException:
+            spool.close()
+            raise
+        state = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fingerprint": fingerprint.hexdigest()
+        }
+    return SpooledRows(spool), state
+
+
+@timed("fetch")
+def fetch_case_data(fetch_state: dict, session=None,
+        urls: dict=CASE_DATA_URLS) -> (Optional[list], dict):
+    """
+    Returns a tuple of [county rows, state rows] and the new fetch state, or
+    None instead of the rows if neither source has changed since the fetch
+    that fetch_state came from. The rows are SpooledRows (see fetch_csv()),
+    so each can only be read once. If we don't return them, their files are
+    closed here.
+
+    A source is unchanged if the server answers our conditional request with
+    a 304, or sends a body with the same fingerprint as last time. Pass an
+    empty fetch_state to always get the rows.
+
+    The new fetch state should only be saved (see save_fetch_state()) once the
+    rows have been fully processed, so a failed run is retried next time.
+    """
+    session = session or requests.Session()
+    rows = {}
+    new_state = {}
+    # Until the rows are returned, their spooled files are closed on the way
+    # out, whether the sources are unchanged or a fetch fails.
+    with ExitStack() as spools:
+        for name, url in urls.items():
+            previous = fetch_state.get(name, {})
+            rows[name], new_state[name] = fetch_csv(url, previous, session)
+            if rows[name] is not None:
+                spools.callback(rows[name].close)
+                print("Fetched {}: {}".format(name, new_state[name]))
+
+        unchanged = all(rows[name] is None or
+                        new_state[name]["fingerprint"] ==
+                        fetch_state.get(name, {}).get("fingerprint")
+                        for name in urls)
+        if unchanged:
+            return None, new_state
+
+        # We need every source to update, so fetch any the server told us
+        # were unchanged again, without the conditional request.
+        for name, url in urls.items():
+            if rows[name] is None:
+                rows[name], new_state[name] = fetch_csv(url, {}, session)
+                spools.callback(rows[name].close)
+        spools.pop_all()
+
+    return [rows["counties"], rows["states"]], new_state
+
+
+def load_fetch_state(store) -> dict:
+    """
+    Returns the fetch state saved in the store (see storage.py), if any.
+    """
+    data = store.read(FETCH_STATE_NAME)
+    return json.loads(data.decode("utf-8")) if data else {}
 
 
-def convert_to_list(scsv):
-    f = StringIO(scsv)
-    reader = csv.reader(f, delimiter=',')
-    return list(reader)
+def save_fetch_state(store, fetch_state: dict) -> None:
+    store.write(FETCH_STATE_NAME, json.dumps(fetch_state).encode("utf-8"))
 
 
 def update_case_data():
-    county_request = requests.get('https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv')
-    state_request = requests.get('https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv')
-    return [convert_to_list(county_request.text), convert_to_list(state_request.text)]
+    county_input, state_input = fetch_case_data({})[0]
+    return [list(county_input), list(state_input)]
@@ -1,14 +1,63 @@
 import argparse
 import csv
 import json
+import re
 
 
-# Offsets in the input CSV file.
-STATE_CODE = 3
-COUNTY_CODE = 4
-STATE_NAME = 5
-COUNTY_NAME = 6
-POPULATION = 18
+# The columns we use from the input CSV file, of roughly 170.
+STATE_CODE = "STATE"
+COUNTY_CODE = "COUNTY"
+STATE_NAME = "STNAME"
+COUNTY_NAME = "CTYNAME"
+POPULATION = "POPESTIMATE2019"
+COLUMNS = [STATE_CODE, COUNTY_CODE, STATE_NAME, COUNTY_NAME, POPULATION]
+
+
+def read_columns(lines, columns):
+    """
+    Yields a tuple of the given columns of each line of CSV, by the names in
+    the header line.
+
+    Each line is only split as far as the last column we need, so the rest of
+    it is never parsed. Lines with quotes are parsed with the csv module, in
+    case a quoted field has a comma in it.
+    """
+    header = next(csv.reader([next(lines)]))
+    offsets = [header.index(column) for column in columns]
+    last = max(offsets)
+    for line in lines:
+        if '"' in line:
+            row = next(csv.reader([line]))
+        else:
+            row = line.rstrip("\r\n").split(",", last + 1)
+        yield tuple(row[offset] for offset in offsets)
+
+
+def urlify_name(name):
+    """
+    Returns the URL slug for a state or county name, by the same rules as
+    urlifyName() in src/js/utilities.js: the first " County" is dropped,
+    whitespace becomes "-" and it's lower cased.
+
+    Example:
+        urlify_name("Bergen County")  # "bergen"
+        urlify_name("New Jersey")     # "new-jersey"
+    """
+    return re.sub(r"\s", "-", name.replace(" County", "", 1)).lower()
+
+
+def object_key_order(keys):
+    """
+    Returns keys in the order a browser lists the properties of an object
+    built in that order, e.g. with Object.keys(): keys that are array
+    indexes, such as "53061", come first in numeric order, then the rest,
+    such as "01001" and "-10003", in the order they were added.
+    """
+    def is_array_index(key):
+        return key.isdigit() and str(int(key)) == key and \
+            int(key) < 2 ** 32 - 1
+    indexes = sorted((key for key in keys if is_array_index(key)), key=int)
+    return indexes + [key for key in keys if not is_array_index(key)]
 
 
 def read_census_file(filename):
@@ -28,20 +77,17 @@ def read_census_file(filename):
         }
      ...
     """
-    with open(filename, encoding="ISO-8859-1") as csv_file:
-        reader = csv.reader(csv_file, delimiter=',')
+    with open(filename, encoding="ISO-8859-1", newline="") as csv_file:
         output_data = {}
         # We need to create one "county" for NYC since our case data does not
         # separate NYC into counties.
         nyc_county_fips = ['36005', '36047', '36061', '36081', '36085']
         nyc_population = 0
 
-        # Skip the first line (the table header).
-        next(reader)
-
-        for row in reader:
-            state_code = int(row[STATE_CODE])
-            county_code = int(row[COUNTY_CODE])
+        for state_code, county_code, state_name, county_name, population in \
+                read_columns(csv_file, COLUMNS):
+            state_code = int(state_code)
+            county_code = int(county_code)
             is_state = county_code == 0
 
             if is_state:
@@ -49,14 +95,12 @@ def read_census_file(filename):
             else:
                 fips_code = "{0:0=2d}{1:0=3d}".format(state_code, county_code)
 
-            state_name = row[STATE_NAME]
-            county_name = row[COUNTY_NAME]
             # If this row is for a state, then the county code will be 0.
             # We don't want to record a county name in this case.
             if is_state:
                 county_name = ""
 
-            population = int(row[POPULATION])
+            population = int(population)
 
             # Skip adding individual NYC counties since our case data doesn't
             # distinguish.
@@ -79,18 +123,63 @@ def read_census_file(filename):
         return output_data
 
 
-def generate_json(input_file, output_file):
+def get_url_indexes(fips_data):
+    """
+    Returns indexes of the FIPS in fips_data by their URLs, so the site can
+    look up a route's FIPS without searching all of them:
+    {"states": {"new-jersey": "34", ...},
+     "counties": {"new-jersey": {"bergen": "34003", ...}, ...},
+     "state_counties": {"34": ["34001", "34003", ...], ...}
+    }
+
+    States and counties are found by the slugs of their names (see
+    urlify_name()), and each state's counties are listed in the order the
+    site would list them by searching fips_data.json. Where two FIPS have
+    the same slug, the one the search would have found first wins.
+    """
+    states = {}
+    counties = {}
+    # State name -> county FIPS
+    counties_by_state = {}
+    for fips in object_key_order(list(fips_data)):
+        entry = fips_data[fips]
+        state_slug = urlify_name(entry["state"])
+        if entry["county"]:
+            counties.setdefault(state_slug, {}).setdefault(
+                urlify_name(entry["county"]), fips)
+            counties_by_state.setdefault(entry["state"], []).append(fips)
+        else:
+            states.setdefault(state_slug, fips)
+
+    state_counties = {fips: counties_by_state.get(entry["state"], [])
+                      for fips, entry in fips_data.items()
+                      if not entry["county"]}
+    return {"states": states, "counties": counties,
+            "state_counties": state_counties}
+
+
+def generate_json(input_file, output_file, index_file=None):
     state_and_county_data = read_census_file(input_file)
 
     with open(output_file, "w") as output:
         json.dump(state_and_county_data, output)
 
-
-parser = argparse.ArgumentParser()
-parser.add_argument("--input_file", help="File path to current county CSV.",
-    default="raw_county_census_data.csv")
-parser.add_argument("--output_file", help="File path to output JSON file.",
-    default="fips_data.json")
-args = parser.parse_args()
-
-generate_json(args.input_file, args.output_file)
+    if index_file:
+        with open(index_file, "w") as output:
+            json.dump(get_url_indexes(state_and_county_data), output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input_file",
+        help="File path to current county CSV.",
+        default="raw_county_census_data.csv")
+    parser.add_argument("--output_file",
+        help="File path to output JSON file.",
+        default="fips_data.json")
+    parser.add_argument("--index_file",
+        help="File path to output the URL indexes to, see get_url_indexes().",
+        default="fips_index.json")
+    args = parser.parse_args()
+
+    generate_json(args.input_file, args.output_file, args.index_file)
@@ -1,9 +1,195 @@
-import { json } from 'd3';
+import { buffer, json } from 'd3';
 import { urlifyName } from './utilities';
 
+// Which of the files holding the same case data to load: "binary" for
+// covid_data.bin and new_case_data.bin (see chalicelib/binary.py), "columnar"
+// for covid_data_columnar.json (see chalicelib/columnar.py), or "json" for
+// covid_data.json
+const CASE_DATA_FORMAT = "binary";
+
+// Every metric in the case data
+const METRICS = ["cases", "increase", "per_capita", "growth_factor", "doubling_time"];
+
+// Case data in the covid_data.json layout:
+//   {"2020-03-27": {"56043": {"cases": 12, "growth_factor": 1.19}, ...}, ...}
+class NestedCases {
+  constructor(caseData) {
+    this.caseData = caseData;
+  }
+
+  // return dates, most recent first
+  getDates() {
+    return Object.keys(this.caseData)
+      .sort((firstEl, secondEl) => new Date(secondEl) - new Date(firstEl));
+  }
+
+  // return {fips: {cases: 12, ...}, ...} for a date
+  getDateData(date) {
+    return this.caseData[date];
+  }
+
+  // return {cases: 12, ...} for a date and fips, or undefined
+  getEntry(date, fips) {
+    return this.caseData[date] && this.caseData[date][fips];
+  }
+}
+
+// Case data in the covid_data_columnar.json layout:
+//   {"fips": ["53", ...], "dates": ["2020-01-21", ...],
+//    "cases": [[1, ...], ...], ...}
+// where cases[d][i] is the cases for fips[i] on dates[d]. Entries are only
+// built when they're asked for, rather than expanding the whole layout up
+// front.
+class ColumnarCases {
+  constructor(columnar) {
+    this.columnar = columnar;
+    this.dateIndex = {};
+    columnar.dates.forEach((date, row) => { this.dateIndex[date] = row; });
+    this.fipsIndex = {};
+    columnar.fips.forEach((fips, column) => { this.fipsIndex[fips] = column; });
+    this.dateData = {};
+  }
+
+  getDates() {
+    return this.columnar.dates.slice().reverse();
+  }
+
+  getDateData(date) {
+    const row = this.dateIndex[date];
+    if (row === undefined) {
+      return undefined;
+    }
+    if (!this.dateData[date]) {
+      const locations = {};
+      this.columnar.fips.forEach((fips, column) => {
+        const entry = this.buildEntry(row, column);
+        if (entry) {
+          locations[fips] = entry;
+        }
+      });
+      this.dateData[date] = locations;
+    }
+    return this.dateData[date];
+  }
+
+  getEntry(date, fips) {
+    const row = this.dateIndex[date];
+    const column = this.fipsIndex[fips];
+    if (row === undefined || column === undefined) {
+      return undefined;
+    }
+    return this.buildEntry(row, column);
+  }
+
+  getValue(metric, row, column) {
+    return this.columnar[metric][row][column];
+  }
+
+  buildEntry(row, column) {
+    let entry;
+    METRICS.forEach((metric) => {
+      const value = this.getValue(metric, row, column);
+      if (value !== null) {
+        entry = entry || {};
+        entry[metric] = value;
+      }
+    });
+    return entry;
+  }
+}
+
+// The int32 value for a missing metric in a binary container
+const MISSING_INT32 = -2147483648;
+
+// Returns {header, columns} for a binary container, with each column an
+// Int32Array or Float32Array view of the buffer. Nothing is copied or parsed
+// other than the JSON header. See chalicelib/binary.py for the layout.
+export function readBinaryContainer(arrayBuffer) {
+  const prefix = new DataView(arrayBuffer, 0, 12);
+  const magic = String.fromCharCode(...new Uint8Array(arrayBuffer, 0, 4));
+  if (magic !== "CCDB" || prefix.getUint32(4, true) !== 1) {
+    throw new Error("Not a version 1 case data container");
+  }
+  const headerLength = prefix.getUint32(8, true);
+  const header = JSON.parse(
+    new TextDecoder().decode(new Uint8Array(arrayBuffer, 12, headerLength)));
+  const columnsStart = 12 + headerLength;
+  const columns = {};
+  Object.entries(header.columns).forEach(([name, column]) => {
+    const TypedArray = column.dtype === "int32" ? Int32Array : Float32Array;
+    columns[name] = new TypedArray(
+      arrayBuffer, columnsStart + column.offset, column.length);
+  });
+  return { header, columns };
+}
+
+// Case data in covid_data.bin. Like the columnar layout, but each metric is a
+// single typed array, where the value for fips[i] on dates[d] is at
+// d * fips.length + i.
+class BinaryCases extends ColumnarCases {
+  constructor(arrayBuffer) {
+    const { header, columns } = readBinaryContainer(arrayBuffer);
+    super(header);
+    this.columns = columns;
+  }
+
+  getValue(metric, row, column) {
+    const value = this.columns[metric][row * this.columnar.fips.length + column];
+    return value === MISSING_INT32 || Number.isNaN(value) ? null : value;
+  }
+}
+
+// Returns {fips: [increase, ...], ...} for new_case_data.bin, where each list
+// of increases is a Float32Array view of the buffer.
+export function readBinaryNewCases(arrayBuffer) {
+  const { header, columns } = readBinaryContainer(arrayBuffer);
+  const newCases = {};
+  header.fips.forEach((fips, i) => {
+    newCases[fips] = columns.increases.subarray(
+      columns.offsets[i], columns.offsets[i + 1]);
+  });
+  return newCases;
+}
+
+// data/manifest.json points at the content-hashed name of each artifact,
+// which is cached for a long time, see chalicelib/publish.py. Without a
+// manifest, fall back to the plain names.
+function loadManifest() {
+  return json("/data/manifest.json").catch(() => ({ artifacts: {} }));
+}
+
+async function getArtifactUrl(manifest, name) {
+  const { artifacts } = await manifest;
+  return artifacts[name] ? `/data/${artifacts[name].path}` : `/data/${name}?v=1.0`;
+}
+
+async function loadCases(manifest) {
+  if (CASE_DATA_FORMAT === "binary") {
+    const data = await buffer(await getArtifactUrl(manifest, "covid_data.bin"));
+    return new BinaryCases(data);
+  }
+  if (CASE_DATA_FORMAT === "columnar") {
+    const data = await json(await getArtifactUrl(manifest, "covid_data_columnar.json"));
+    return new ColumnarCases(data);
+  }
+  const data = await json(await getArtifactUrl(manifest, "covid_data.json"));
+  return new NestedCases(data);
+}
+
+async function loadNewCases(manifest) {
+  if (CASE_DATA_FORMAT === "binary") {
+    const data = await buffer(await getArtifactUrl(manifest, "new_case_data.bin"));
+    return readBinaryNewCases(data);
+  }
+  return json(await getArtifactUrl(manifest, "new_case_data.json"));
+}
+
 class DataManager {
-  constructor(fips, cases, countyOutline, newCases) {
+  constructor(fips, fipsIndex, cases, countyOutline, newCases) {
     this.fips = fips;
+    // Indexes of fips_data.json by URL, see get_url_indexes() in
+    // create_fips_json.py
+    this.fipsIndex = fipsIndex;
     this.cases = cases;
     this.countyOutline = countyOutline;
     this.newCases = newCases;
@@ -25,10 +211,8 @@ class DataManager {
   }
 
   async getFipsForStateUrl(urlStateName) {
-    const fips = await this.fips;
-    return Object.keys(fips).find(item => (
-      urlifyName(fips[item].state) === urlStateName
-    ));
+    const fipsIndex = await this.fipsIndex;
+    return fipsIndex.states[urlStateName];
   }
 
   async getUrlForFips(fips) {
@@ -40,13 +224,9 @@ class DataManager {
   }
 
   async getFipsForCountyUrl(urlCountyName, urlStateName) {
-    const fips = await this.fips;
-    return Object.keys(fips).find(item => (
-      // State in FIPS json is ex: New Jersey
-      urlifyName(fips[item].state) === urlStateName &&
-        // County in FIPS json is ex: Bergen County
-        urlifyName(fips[item].county) === urlCountyName
-    ));
+    const fipsIndex = await this.fipsIndex;
+    const counties = fipsIndex.counties[urlStateName];
+    return counties && counties[urlCountyName];
   }
 
   // return list of fips that represent all states
@@ -74,9 +254,8 @@ class DataManager {
   // return list of counties given a state fips
   async getCountiesGivenState(stateFips) {
     const fipsData = await this.fips;
-    return Object.keys(fipsData)
-      .filter(fips => (
-        fipsData[fips].county && fipsData[fips].state === fipsData[stateFips].state))
+    const fipsIndex = await this.fipsIndex;
+    return (fipsIndex.state_counties[stateFips] || [])
       .map(fips => ({
         ...fipsData[fips],
         fips
@@ -84,9 +263,8 @@ class DataManager {
   }
 
   async getDates() {
-    const caseData = await this.cases;
-    return Object.keys(caseData)
-      .sort((firstEl, secondEl) => new Date(secondEl) - new Date(firstEl));
+    const cases = await this.cases;
+    return cases.getDates();
   }
 
   async getFipsEntry(fips) {
@@ -97,8 +275,8 @@ class DataManager {
 
   async getDaysPriorData(daysPrior) {
     const sortedDates = await this.getDates();
-    const caseData = await this.cases;
-    return caseData[sortedDates[daysPrior]];
+    const cases = await this.cases;
+    return cases.getDateData(sortedDates[daysPrior]);
   }
 
   async getMostRecentData() {
@@ -112,12 +290,13 @@ class DataManager {
   async getCasesGivenFips(fips) {
     const cases = await this.cases;
     const dates = await this.getDates();
-    return dates.map(date => cases[date][fips]);
+    return dates.map(date => cases.getEntry(date, fips));
   }
 
   async getCasesGivenDateFips(date, fips) {
     const cases = await this.cases;
-    return (cases[date] && cases[date][fips] && cases[date][fips].cases) || null;
+    const entry = cases.getEntry(date, fips);
+    return (entry && entry.cases) || null;
   }
 
   async getPopulation(fips) {
@@ -126,15 +305,12 @@ class DataManager {
   }
 
   async getNewCasesGivenState(stateFips) {
-    const fipsData = await this.fips;
+    const fipsIndex = await this.fipsIndex;
     const newCasesData = await this.newCases;
-    const state = await this.getFipsStateName(stateFips);
     const cases = {};
-    Object.entries(fipsData).forEach(([fips, fipsInfo]) => {
-      // if this is our state and county and we have more than one day since
-      // cases went > 50, add data
-      if (fipsInfo.county && fipsInfo.state === state &&
-        newCasesData[fips] && newCasesData[fips].length > 1) {
+    (fipsIndex.state_counties[stateFips] || []).forEach((fips) => {
+      // if we have more than one day since cases went > 50, add data
+      if (newCasesData[fips] && newCasesData[fips].length > 1) {
         cases[fips] = newCasesData[fips];
       }
     });
@@ -166,10 +342,12 @@ class DataManager {
 }
 
 export default async function initDataManager() {
+  const manifest = loadManifest();
   window.dataManager = new DataManager(
     json("/data/fips_data.json"),
-    json("/data/covid_data.json?v=1.0"),
+    json("/data/fips_index.json"),
+    loadCases(manifest),
     json("/data/counties-albers-10m2.json"),
-    json("/data/new_case_data.json?v=1.0")
+    loadNewCases(manifest)
   );
 }
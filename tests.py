@@ -1,8 +1,56 @@
 import unittest
+import gzip
+import hashlib
+import json
 import math
+import os
+import pstats
+import tempfile
+import threading
 from collections import defaultdict
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO, StringIO
+from unittest import mock
 
-from charting_covid_data.chalicelib.create_covid_json import get_growth_factor, generate_covid_data
+import boto3
+import numpy as np
+try:
+    from moto import mock_aws
+except ImportError:  # moto < 5
+    from moto import mock_s3 as mock_aws
+
+import push_to_s3
+from create_fips_json import get_url_indexes, read_columns, urlify_name
+from benchmarks.run import compare, get_ratios
+from benchmarks.synthetic import COUNTY_HEADER, generate_case_data
+from charting_covid_data.chalicelib import push_to_s3 as lambda_push_to_s3
+from charting_covid_data.chalicelib.artifacts import MIN_PART_SIZE, \
+    decompress, iter_json_chunks, upload_json_gzip, write_json_gzip
+from charting_covid_data.chalicelib.binary import read_case_data, \
+    read_new_case_data, write_case_data, write_metric_arrays, \
+    write_new_case_data
+from charting_covid_data.chalicelib.case_matrix import CaseMatrix
+from charting_covid_data.chalicelib.columnar import ColumnarCaseData, \
+    get_case_data, get_columnar_case_data
+from charting_covid_data.chalicelib.create_covid_json import get_growth_factor, generate_covid_data, generate_case_json, \
+    get_revisions_summary
+from charting_covid_data.chalicelib.create_new_case_json import generate_new_case_json
+from charting_covid_data.chalicelib.dates import DateTable
+from charting_covid_data.chalicelib.fips_data import FipsDataCache
+from charting_covid_data.chalicelib.metrics import ALL_METRICS, \
+    DEFAULT_METRICS, get_metric_name
+from charting_covid_data.chalicelib.parallel_metrics import \
+    partition_by_state
+from charting_covid_data.chalicelib.pipeline import generate_all_json
+from charting_covid_data.chalicelib.publish import IMMUTABLE_CACHE_CONTROL, \
+    S3Publisher
+from charting_covid_data.chalicelib.shards import shard_by_state, \
+    write_shards
+from charting_covid_data.chalicelib.stage_timer import RunTimer, \
+    record_sizes, stage, timed
+from charting_covid_data.chalicelib.storage import LocalStore
+from charting_covid_data.chalicelib.update_case_data import fetch_case_data
 
 
 class TestDataMunging(unittest.TestCase):
@@ -62,5 +110,1050 @@ class TestDataMunging(unittest.TestCase):
                                              False),
                          expected_output)
 
+    def test_vectorized_growth_metrics(self):
+        # Includes a gap, a single day with no increase (which gets estimated)
+        # and three equal counts in a row (which don't).
+        counts = [40, 50, 60, 60, 75, 90, 90, 90, 100, 120, None, 130, 150,
+                  180, 200]
+        input = [['date', 'county', 'state', 'fips', 'cases', 'deaths']]
+        for day, count in enumerate(counts):
+            if count is not None:
+                input.append(['2020-03-{:02d}'.format(day + 1), 'Snohomish',
+                              'Washington', '53061', str(count), '0'])
+        fips_data = {
+            "53061": {"county": "Snohomish", "state": "Washington",
+                      "population": 100}
+        }
+
+        scalar = generate_covid_data([row[:] for row in input],
+                                     defaultdict(dict), fips_data, 5, False)
+        vectorized = generate_covid_data(
+            [row[:] for row in input], defaultdict(dict), fips_data, 5, False,
+            vectorized_metrics=True)
+
+        self.assertEqual(scalar.keys(), vectorized.keys())
+        for date, entries in scalar.items():
+            for fips, entry in entries.items():
+                self.assertEqual(entry.keys(), vectorized[date][fips].keys())
+                for metric, value in entry.items():
+                    self.assertAlmostEqual(
+                        value, vectorized[date][fips][metric], places=9)
+        self.assertIn("growth_factor", scalar["2020-03-09"]["53061"])
+        self.assertNotIn("growth_factor", scalar["2020-03-08"]["53061"])
+
+
+def make_test_input(counts: list) -> (list, list):
+    """
+    Returns county and state csv data for a single county with the given
+    daily case counts, starting on 2020-03-01.
+    """
+    county_input = [['date', 'county', 'state', 'fips', 'cases', 'deaths']]
+    state_input = [['date', 'state', 'fips', 'cases', 'deaths']]
+    for day, count in enumerate(counts):
+        date = '2020-03-{:02d}'.format(day + 1)
+        county_input.append(
+            [date, 'Snohomish', 'Washington', '53061', str(count), '0'])
+        state_input.append([date, 'Washington', '53', str(count * 2), '0'])
+    return county_input, state_input
+
+
+class TestPipeline(unittest.TestCase):
+    def test_generate_all_json(self):
+        counts = [40, 50, 60, 60, 75, 90, 85, 90, 100, 120, 130]
+        fips_data = {
+            "53": {"county": "", "state": "Washington", "population": 1000},
+            "53061": {"county": "Snohomish", "state": "Washington",
+                      "population": 100}
+        }
+
+        county_input, state_input = make_test_input(counts)
+        case_data, new_case_data = generate_all_json(
+            county_input, state_input, fips_data, 5, 50,
+            vectorized_metrics=False)
+
+        county_input, state_input = make_test_input(counts)
+        self.assertEqual(case_data, generate_case_json(
+            county_input, state_input, fips_data, 5))
+        county_input, state_input = make_test_input(counts)
+        self.assertEqual(new_case_data, generate_new_case_json(
+            county_input, state_input, 50))
+
+    def test_incremental_update(self):
+        counts = [40, 50, 60, 60, 75, 90, 85, 90, 100, 120, 130]
+        # The last day revises the previous two days down.
+        revised_counts = counts[:-1] + [110, 105]
+        fips_data = {}
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = LocalStore(directory)
+            county_input, state_input = make_test_input(counts)
+            generate_all_json(county_input, state_input, fips_data, 5, 50,
+                              checkpoint_store=store)
+
+            county_input, state_input = make_test_input(revised_counts)
+            incremental = generate_all_json(
+                county_input, state_input, fips_data, 5, 50,
+                checkpoint_store=store)
+            county_input, state_input = make_test_input(revised_counts)
+            full = generate_all_json(
+                county_input, state_input, fips_data, 5, 50,
+                checkpoint_store=store, full_rebuild=True)
+
+        for incremental_data, full_data in zip(incremental, full):
+            self.assertEqual(b"".join(iter_json_chunks(incremental_data)),
+                             b"".join(iter_json_chunks(full_data)))
+        self.assertEqual(incremental[0]["2020-03-12"]["53061"]["cases"], 105)
+
+    def test_metric_workers(self):
+        county_input, state_input, fips_data = generate_case_data(
+            counties=40, days=40, revision_rate=0.05, gap_rate=0.05)
+        for vectorized in [False, True]:
+            expected = generate_case_json(
+                [row[:] for row in county_input],
+                [row[:] for row in state_input], fips_data, 5,
+                vectorized_metrics=vectorized)
+            case_data = generate_case_json(
+                [row[:] for row in county_input],
+                [row[:] for row in state_input], fips_data, 5,
+                vectorized_metrics=vectorized, metric_workers=2)
+            self.assertEqual(json.dumps(case_data), json.dumps(expected))
+
+            case_data, _ = generate_all_json(
+                [row[:] for row in county_input],
+                [row[:] for row in state_input], fips_data, 5, 50,
+                vectorized_metrics=vectorized, metric_workers=2)
+            self.assertEqual(case_data, expected)
+
+        # New York City is partitioned with New York.
+        partitions = partition_by_state(["53", "53061", "-10003", "36"])
+        self.assertEqual([rows.tolist() for rows in partitions],
+                         [[2, 3], [0, 1]])
+
+    def test_case_data(self):
+        county_input, state_input, fips_data = generate_case_data(
+            counties=40, days=40, revision_rate=0.05, gap_rate=0.05)
+        case_data, _ = generate_all_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            fips_data, 5, 50)
+        expected = generate_case_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            fips_data, 5, vectorized_metrics=True)
+
+        self.assertEqual(case_data, expected)
+        # Dates, FIPS and metrics are in the same order too.
+        self.assertEqual(b"".join(iter_json_chunks(case_data, chunk_size=64)),
+                         json.dumps(expected).encode("utf-8"))
+        self.assertEqual(len(case_data), len(expected))
+        self.assertIn("2020-01-20", case_data)
+        self.assertEqual(case_data["2020-01-20"], {})
+        self.assertNotIn("2019-01-01", case_data)
+        self.assertNotIn("not a date", case_data)
+        with self.assertRaises(KeyError):
+            case_data["2019-01-01"]
+
+    def test_case_rows(self):
+        # Rows both builders read the same way: New York City without a
+        # FIPS, a row without a FIPS, a FIPS reported twice on one day, a
+        # missing count and a gap.
+        county_input = [
+            ["date", "county", "state", "fips", "cases", "deaths"],
+            ["2020-03-01", "Snohomish", "Washington", "53061", "60", "1"],
+            ["2020-03-01", "New York City", "New York", "", "70", "2"],
+            ["2020-03-01", "Unknown", "New York", "", "5", "0"],
+            ["2020-03-02", "New York City", "New York", "", "90", "3"],
+            ["2020-03-02", "Snohomish", "Washington", "53061", "65", "1"],
+            ["2020-03-02", "Snohomish", "Washington", "53061", "64", ""],
+            ["2020-03-04", "Snohomish", "Washington", "53061", "", "2"],
+            ["2020-03-04", "New York City", "New York", "", "110", "4"]]
+        state_input = [["date", "state", "fips", "cases", "deaths"]]
+        fips_data = {"53061": {"population": 1000},
+                     "-10003": {"population": 8000}}
+        for metrics in [DEFAULT_METRICS, ALL_METRICS]:
+            case_data, _ = generate_all_json(
+                [row[:] for row in county_input], state_input, fips_data, 2,
+                50, metrics=metrics)
+            expected = generate_case_json(
+                [row[:] for row in county_input], state_input, fips_data, 2,
+                vectorized_metrics=True, metrics=metrics)
+            self.assertEqual(b"".join(iter_json_chunks(case_data)),
+                             json.dumps(expected).encode("utf-8"))
+        self.assertEqual(list(expected["2020-03-02"]), ["-10003", "53061"])
+        self.assertEqual(expected["2020-03-02"]["53061"]["cases"], 64)
+        self.assertEqual(expected["2020-03-04"]["53061"]["cases"], 0)
+
+    def test_deaths(self):
+        county_input, state_input, fips_data = generate_case_data(
+            counties=40, days=40, revision_rate=0.05, gap_rate=0.05)
+        # With deaths the same as cases, every death metric is the same as
+        # its case metric.
+        for row in county_input[1:]:
+            row[5] = row[4]
+        for row in state_input[1:]:
+            row[4] = row[3]
+
+        case_data, _ = generate_all_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            fips_data, 5, 50, metrics=ALL_METRICS)
+        expected = generate_case_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            fips_data, 5, vectorized_metrics=True, metrics=ALL_METRICS)
+        self.assertEqual(b"".join(iter_json_chunks(case_data)),
+                         json.dumps(expected).encode("utf-8"))
+        cases_only = generate_case_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            fips_data, 5, vectorized_metrics=True)
+        for date, entries in expected.items():
+            for fips, entry in entries.items():
+                self.assertEqual(cases_only[date][fips], {
+                    metric: value for metric, value in entry.items()
+                    if metric in DEFAULT_METRICS})
+                self.assertEqual(cases_only[date][fips], {
+                    get_metric_name("cases", metric[len("deaths_"):]
+                                    or "count"): value
+                    for metric, value in entry.items()
+                    if metric.startswith("deaths")})
+        self.assertTrue(any("deaths_growth_factor" in entry
+                            for entries in expected.values()
+                            for entry in entries.values()))
+
+        # Any metric can be left out.
+        metrics = ["increase", "deaths"]
+        case_data, _ = generate_all_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            fips_data, 5, 50, metrics=metrics)
+        self.assertEqual(case_data, generate_case_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            fips_data, 5, vectorized_metrics=True, metrics=metrics))
+        self.assertEqual(
+            {metric for entries in case_data.values()
+             for entry in entries.values() for metric in entry}, {
+                "increase", "deaths"})
+        with self.assertRaises(ValueError):
+            generate_all_json(county_input, state_input, fips_data, 5, 50,
+                              metrics=["cases", "recovered"])
+
+    def test_incremental_deaths(self):
+        county_input, state_input, fips_data = generate_case_data(
+            counties=20, days=30, revision_rate=0.05, gap_rate=0.05)
+        last_date = county_input[-1][0]
+
+        with tempfile.TemporaryDirectory() as directory:
+            store = LocalStore(directory)
+            generate_all_json(
+                [row for row in county_input if row[0] != last_date],
+                [row for row in state_input if row[0] != last_date],
+                fips_data, 5, 50, checkpoint_store=store,
+                metrics=ALL_METRICS)
+            with redirect_stdout(StringIO()) as output:
+                incremental, _ = generate_all_json(
+                    county_input, state_input, fips_data, 5, 50,
+                    checkpoint_store=store, metrics=ALL_METRICS)
+            full, _ = generate_all_json(county_input, state_input, fips_data,
+                                        5, 50, metrics=ALL_METRICS)
+
+        self.assertIn("Loaded counties_deaths checkpoint", output.getvalue())
+        self.assertEqual(b"".join(iter_json_chunks(incremental)),
+                         b"".join(iter_json_chunks(full)))
+
+
+class CSVHandler(BaseHTTPRequestHandler):
+    """
+    Serves server.files, keyed by path, with an ETag if server.use_etags.
+    """
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        body = self.server.files[self.path].encode("utf-8")
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        if self.server.use_etags and \
+                self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.server.use_etags:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestFetchCaseData(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), CSVHandler)
+        self.server.files = {
+            "/us-counties.csv": "date,county,state,fips,cases,deaths\n"
+                                "2020-01-21,Snohomish,Washington,53061,1,0\n",
+            "/us-states.csv": "date,state,fips,cases,deaths\n"
+                              "2020-01-21,Washington,53,1,0\n"
+        }
+        self.server.requests = []
+        self.server.use_etags = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        root = "http://127.0.0.1:{}".format(self.server.server_port)
+        self.urls = {"counties": root + "/us-counties.csv",
+                     "states": root + "/us-states.csv"}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_conditional_fetch(self):
+        case_input, fetch_state = fetch_case_data({}, urls=self.urls)
+        county_rows, state_rows = [list(rows) for rows in case_input]
+        self.assertEqual(
+            county_rows[1],
+            ['2020-01-21', 'Snohomish', 'Washington', '53061', '1', '0'])
+        self.assertEqual(state_rows[1],
+                         ['2020-01-21', 'Washington', '53', '1', '0'])
+
+        # Nothing changed, so both requests get a 304.
+        unchanged, fetch_state = fetch_case_data(fetch_state, urls=self.urls)
+        self.assertIsNone(unchanged)
+
+        # Only the counties changed, but we need both inputs.
+        self.server.files["/us-counties.csv"] += \
+            "2020-01-22,Snohomish,Washington,53061,2,0\n"
+        case_input, fetch_state = fetch_case_data(fetch_state, urls=self.urls)
+        self.assertEqual(len(list(case_input[0])), 3)
+        self.assertEqual(len(list(case_input[1])), 2)
+
+    def test_fingerprint_without_etags(self):
+        self.server.use_etags = False
+        case_input, fetch_state = fetch_case_data({}, urls=self.urls)
+        self.assertIsNotNone(case_input)
+
+        unchanged, _ = fetch_case_data(fetch_state, urls=self.urls)
+        self.assertIsNone(unchanged)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_closes_spools(self):
+        self.server.use_etags = False
+        spools = []
+        temporary_file = tempfile.TemporaryFile
+
+        def spool():
+            spools.append(temporary_file())
+            return spools[-1]
+
+        target = "charting_covid_data.chalicelib.update_case_data." \
+            "tempfile.TemporaryFile"
+        with mock.patch(target, side_effect=spool):
+            case_input, fetch_state = fetch_case_data({}, urls=self.urls)
+            self.assertFalse(any(spool.closed for spool in spools))
+            for rows in case_input:
+                list(rows)
+            self.assertTrue(all(spool.closed for spool in spools))
+
+            # The rows of unchanged sources are never read
+            unchanged, _ = fetch_case_data(fetch_state, urls=self.urls)
+            self.assertIsNone(unchanged)
+            self.assertEqual(len(spools), 4)
+            self.assertTrue(all(spool.closed for spool in spools))
+
+            # Nor are those of a download that fails part way
+            def iter_content(chunk_size):
+                yield b"date,state,fips,cases,deaths\n"
+                raise IOError("Connection reset")
+
+            response = mock.MagicMock(status_code=200)
+            response.__enter__.return_value = response
+            response.iter_content = iter_content
+            session = mock.Mock()
+            session.get.return_value = response
+            with self.assertRaises(IOError):
+                fetch_case_data({}, session=session, urls=self.urls)
+            self.assertEqual(len(spools), 5)
+            self.assertTrue(all(spool.closed for spool in spools))
+
+
+class TestFipsDataCache(unittest.TestCase):
+    def setUp(self):
+        os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+        os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+        os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
+
+    def put(self, s3, fips_data):
+        s3.put_object(Bucket="test-bucket", Key="data/fips_data.json",
+                      Body=gzip.compress(json.dumps(fips_data).encode()),
+                      ContentEncoding="gzip")
+
+    @mock_aws
+    def test_get(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        fips_data = {"53061": {"population": 822083}}
+        self.put(s3, fips_data)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                mock.patch("builtins.print"):
+            store = LocalStore(directory)
+            cache = FipsDataCache("test-bucket", store=store)
+            with RunTimer("test") as timer:
+                first = cache.get(s3)
+                second = cache.get(s3)
+            self.assertEqual(first, fips_data)
+            # A hit is the data we already parsed.
+            self.assertIs(second, first)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            self.assertEqual(timer.counts, {"fips_data_cache_hits": 1,
+                                            "fips_data_cache_misses": 1})
+
+            # A new process starts from the copy in the store.
+            cache = FipsDataCache("test-bucket", store=store)
+            self.assertEqual(cache.get(s3), fips_data)
+            self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+            fips_data["53061"]["population"] += 1
+            self.put(s3, fips_data)
+            self.assertEqual(cache.get(s3), fips_data)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+class TestArtifacts(unittest.TestCase):
+    def setUp(self):
+        os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+        os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+        self.data = {"2020-01-21": {"53061": {"cases": 1, "per_capita": 0.5}},
+                     "2020-01-22": {}}
+
+    def test_write_json_gzip(self):
+        output = BytesIO()
+        stats = write_json_gzip(self.data, output)
+
+        expected = json.dumps(self.data).encode("utf-8")
+        self.assertEqual(gzip.decompress(output.getvalue()), expected)
+        self.assertEqual(stats["json_bytes"], len(expected))
+        self.assertEqual(stats["gzip_bytes"], len(output.getvalue()))
+
+        # No timestamp in the header, so the output is reproducible.
+        second_output = BytesIO()
+        write_json_gzip(self.data, second_output)
+        self.assertEqual(output.getvalue(), second_output.getvalue())
+
+    @mock_aws
+    def test_upload_json_gzip(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+
+        stats = upload_json_gzip(self.data, "test-bucket", "data/small.json",
+                                 client=s3)
+        uploaded = s3.get_object(Bucket="test-bucket", Key="data/small.json")
+        self.assertEqual(uploaded["ContentEncoding"], "gzip")
+        self.assertEqual(uploaded["ContentType"], "application/json")
+        self.assertEqual(json.loads(gzip.decompress(uploaded["Body"].read())),
+                         self.data)
+        # Small enough for a single put_object().
+        self.assertEqual(stats["parts"], 0)
+
+        # Uncompressed, this spans more than one part.
+        large_data = {str(i): "x" * 1000 for i in range(6000)}
+        stats = upload_json_gzip(large_data, "test-bucket", "data/large.json",
+                                 client=s3, compresslevel=0,
+                                 part_size=MIN_PART_SIZE)
+        uploaded = s3.get_object(Bucket="test-bucket", Key="data/large.json")
+        self.assertEqual(json.loads(gzip.decompress(uploaded["Body"].read())),
+                         large_data)
+        self.assertEqual(stats["parts"], 2)
+
+
+class TestPublish(unittest.TestCase):
+    def setUp(self):
+        os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+        os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+
+    def publish(self, s3, artifacts):
+        publisher = S3Publisher("test-bucket", client=s3)
+        for name, data in artifacts.items():
+            publisher.publish_json(name, data)
+        with mock.patch("charting_covid_data.chalicelib.publish."
+                        "clear_cloudfront_cache") as clear_cloudfront_cache:
+            paths = publisher.finish()
+        self.assertEqual(clear_cloudfront_cache.called, bool(paths))
+        return paths
+
+    @mock_aws
+    def test_publish_changed_artifacts(self):
+        s3 = boto3.client("s3", region_name="us-east-1")
+        s3.create_bucket(Bucket="test-bucket")
+        artifacts = {"covid_data.json": {"2020-03-01": {}},
+                     "new_case_data.json": {"53": [1, 2]}}
+
+        paths = self.publish(s3, artifacts)
+        self.assertEqual(paths, ["/data/covid_data.json",
+                                 "/data/new_case_data.json",
+                                 "/data/manifest.json"])
+        manifest = json.loads(s3.get_object(
+            Bucket="test-bucket",
+            Key="data/manifest.json")["Body"].read())["artifacts"]
+        sha256 = hashlib.sha256(
+            json.dumps(artifacts["covid_data.json"]).encode()).hexdigest()
+        self.assertEqual(manifest["covid_data.json"]["path"],
+                         "covid_data.{}.json".format(sha256[:12]))
+        hashed = s3.get_object(
+            Bucket="test-bucket",
+            Key="data/" + manifest["covid_data.json"]["path"])
+        self.assertEqual(hashed["CacheControl"], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(hashed["ContentEncoding"], "gzip")
+        self.assertEqual(json.loads(gzip.decompress(hashed["Body"].read())),
+                         artifacts["covid_data.json"])
+
+        # Nothing changed, so nothing is invalidated.
+        self.assertEqual(self.publish(s3, artifacts), [])
+
+        artifacts["new_case_data.json"]["53"].append(3)
+        self.assertEqual(self.publish(s3, artifacts),
+                         ["/data/new_case_data.json", "/data/manifest.json"])
+
+
+class TestPushToS3(unittest.TestCase):
+    def setUp(self):
+        os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+        os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+        os.environ["AWS_DEFAULT_REGION"] = "us-east-1"
+        self.directory = tempfile.TemporaryDirectory()
+        self.files = {"index": b"<html></html>",
+                      "static/style.css": b"body {}",
+                      "static/bundle.js.gz": gzip.compress(b"let x;")}
+        for name, content in self.files.items():
+            self.write(name, content)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as output:
+            output.write(content)
+
+    def deploy(self, module, s3):
+        summary = module.new_upload_summary()
+        uploaded = [module.upload_file(
+                        os.path.join(self.directory.name, name),
+                        bucket="test-bucket", separator=self.directory.name,
+                        s3=s3, summary=summary)
+                    for name in sorted(self.files)]
+        return [name for name in uploaded if name], summary
+
+    @mock_aws
+    def test_skip_unchanged(self):
+        for module in [push_to_s3, lambda_push_to_s3]:
+            s3 = boto3.client("s3", region_name="us-east-1")
+            s3.create_bucket(Bucket="test-bucket")
+
+            uploaded, summary = self.deploy(module, s3)
+            self.assertEqual(uploaded,
+                             ["index", "static/bundle.js", "static/style.css"])
+            self.assertEqual(summary["uploaded"], 3)
+
+            uploaded, summary = self.deploy(module, s3)
+            self.assertEqual(uploaded, [])
+            self.assertEqual(summary["unchanged"], 3)
+            self.assertEqual(summary["bytes_saved"],
+                             sum(len(content)
+                                 for content in self.files.values()))
+
+            self.write("static/style.css", b"body {color: red}")
+            uploaded, summary = self.deploy(module, s3)
+            self.assertEqual(uploaded, ["static/style.css"])
+            self.assertEqual(summary["unchanged"], 2)
+
+            # Objects without a stored digest are compared by ETag.
+            s3.put_object(Bucket="test-bucket", Key="index",
+                          Body=self.files["index"], ContentType="text/html")
+            uploaded, summary = self.deploy(module, s3)
+            self.assertEqual(uploaded, [])
+
+            for key in ["index", "static/bundle.js", "static/style.css"]:
+                s3.delete_object(Bucket="test-bucket", Key=key)
+            s3.delete_bucket(Bucket="test-bucket")
+            self.write("static/style.css", self.files["static/style.css"])
+
+    @mock_aws
+    def test_push_directory(self):
+        for module in [push_to_s3, lambda_push_to_s3]:
+            s3 = boto3.client("s3", region_name="us-east-1")
+            s3.create_bucket(Bucket="test-bucket")
+
+            # Uploaded concurrently, with the same names as one at a time
+            uploaded, summary = module.push_directory(
+                self.directory.name, bucket="test-bucket", max_workers=4)
+            self.assertEqual(uploaded,
+                             ["index", "static/bundle.js", "static/style.css"])
+            self.assertEqual(summary["uploaded"], 3)
+            self.assertEqual(summary["bytes_uploaded"],
+                             sum(len(content)
+                                 for content in self.files.values()))
+
+            uploaded, summary = module.push_directory(
+                self.directory.name, bucket="test-bucket", max_workers=4)
+            self.assertEqual(uploaded, [])
+            self.assertEqual(summary["unchanged"], 3)
+
+            for key in ["index", "static/bundle.js", "static/style.css"]:
+                s3.delete_object(Bucket="test-bucket", Key=key)
+            s3.delete_bucket(Bucket="test-bucket")
+
+    @mock_aws
+    def test_compress(self):
+        script = b"function square(x) { return x * x; }\n" * 200
+        self.write("static/app.js", script)
+        self.write("static/app.js.gz", gzip.compress(script, compresslevel=1))
+        for module in [push_to_s3, lambda_push_to_s3]:
+            s3 = boto3.client("s3", region_name="us-east-1")
+            s3.create_bucket(Bucket="test-bucket")
+
+            summary = module.new_upload_summary()
+            uploaded = [module.upload_file(
+                            os.path.join(self.directory.name, name),
+                            bucket="test-bucket",
+                            separator=self.directory.name, s3=s3,
+                            summary=summary)
+                        for name in ["static/app.js", "static/app.js.gz"]]
+            # The gzipped file is only a candidate for compressing the script
+            self.assertEqual(uploaded, ["static/app.js", ""])
+
+            stored = s3.get_object(Bucket="test-bucket", Key="static/app.js")
+            body = stored["Body"].read()
+            self.assertIn(stored["ContentEncoding"], ["gzip", "br"])
+            # Cached the same as when webpack's gzipped file was uploaded
+            self.assertEqual(stored["CacheControl"],
+                             lambda_push_to_s3.STATIC_ASSET_CACHE_CONTROL)
+            self.assertEqual(decompress(body, stored["ContentEncoding"]),
+                             script)
+            self.assertEqual(summary["bytes_uploaded"], len(body))
+            self.assertEqual(summary["bytes_compressed"],
+                             len(script) - len(body))
+
+            # Compression is deterministic, so the script is unchanged
+            self.assertEqual(module.upload_file(
+                os.path.join(self.directory.name, "static/app.js"),
+                bucket="test-bucket", separator=self.directory.name, s3=s3),
+                "")
+
+            s3.delete_object(Bucket="test-bucket", Key="static/app.js")
+            s3.delete_bucket(Bucket="test-bucket")
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        self.case_data = {
+            "2020-03-01": {"53": {"cases": 10}, "53061": {"cases": 8}},
+            "2020-03-02": {"53": {"cases": 12}, "53061": {"cases": 9},
+                           "36": {"cases": 1}, "-10003": {"cases": 1}}
+        }
+        self.written = {}
+
+    def write(self, path, data):
+        self.written[path] = data
+        return {"json_bytes": len(json.dumps(data)), "sha256": path}
+
+    def test_shard_by_state(self):
+        manifest = write_shards(self.case_data, "state", self.write)
+
+        self.assertEqual(list(manifest["shards"]), ["53", "36"])
+        self.assertEqual(manifest["shards"]["36"]["path"],
+                         "covid_data/state/36.json")
+        # Every shard has every date, and NYC is part of New York.
+        self.assertEqual(
+            self.written["covid_data/state/36.json"],
+            {"2020-03-01": {},
+             "2020-03-02": {"36": {"cases": 1}, "-10003": {"cases": 1}}})
+        self.assertEqual(self.written["covid_data/state/manifest.json"],
+                         manifest)
+
+    def test_shard_by_date(self):
+        manifest = write_shards(self.case_data, "date", self.write)
+
+        self.assertEqual(list(manifest["shards"]),
+                         ["2020-03-01", "2020-03-02"])
+        self.assertEqual(self.written["covid_data/date/2020-03-01.json"],
+                         {"2020-03-01": self.case_data["2020-03-01"]})
+        self.assertEqual(
+            manifest["shards"]["2020-03-01"]["json_bytes"],
+            len(json.dumps({"2020-03-01": self.case_data["2020-03-01"]})))
+
+    def test_case_data_shards(self):
+        county_input, state_input, fips_data = generate_case_data(
+            counties=40, days=20, revision_rate=0.05, gap_rate=0.05)
+        case_data, _ = generate_all_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            fips_data, 5, 50)
+        expected = json.loads(b"".join(iter_json_chunks(case_data)))
+
+        # Shards are made one at a time, and a state's shard of a CaseData
+        # is a CaseData of just its FIPS.
+        shards = shard_by_state(case_data)
+        state_fips, shard = next(shards)
+        self.assertEqual(list(shard), list(case_data))
+        self.assertEqual(shard.get_fips(),
+                         [fips for fips in case_data.get_fips()
+                          if fips.startswith(state_fips)])
+
+        for shard_by in ["state", "date"]:
+            written = {}
+
+            def write(path, data):
+                written[path] = b"".join(iter_json_chunks(data))
+                return {"json_bytes": len(written[path]), "sha256": path}
+
+            manifest = write_shards(case_data, shard_by, write)
+            self.assertEqual(
+                manifest, write_shards(expected, shard_by, self.write))
+            for path, data in written.items():
+                self.assertEqual(data,
+                                 json.dumps(self.written[path]).encode())
+
+
+class TestFipsIndex(unittest.TestCase):
+    def test_read_columns(self):
+        lines = iter(["SUMLEV,STATE,COUNTY,CTYNAME,POP\n",
+                      "050,53,061,Snohomish County,822083\n",
+                      '050,36,061,"New York, County",1628706\n'])
+        self.assertEqual(
+            list(read_columns(lines, ["CTYNAME", "STATE"])),
+            [("Snohomish County", "53"), ("New York, County", "36")])
+
+    def test_url_indexes(self):
+        fips_data = {
+            "53": {"state": "Washington", "county": ""},
+            "53061": {"state": "Washington", "county": "Snohomish County"},
+            "36": {"state": "New York", "county": ""},
+            "36001": {"state": "New York", "county": "Albany County"},
+            "-10003": {"state": "New York", "county": "New York City"},
+            "02": {"state": "Alaska", "county": ""}
+        }
+        indexes = get_url_indexes(fips_data)
+
+        self.assertEqual(urlify_name("St. Louis County"), "st.-louis")
+        self.assertEqual(indexes["states"],
+                         {"washington": "53", "new-york": "36", "alaska": "02"})
+        self.assertEqual(
+            indexes["counties"],
+            {"washington": {"snohomish": "53061"},
+             "new-york": {"albany": "36001", "new-york-city": "-10003"}})
+        # In the order Object.keys() lists them in the browser
+        self.assertEqual(indexes["state_counties"],
+                         {"53": ["53061"], "36": ["36001", "-10003"], "02": []})
+
+
+class TestColumnar(unittest.TestCase):
+    def test_columnar_case_json(self):
+        county_input, state_input = make_test_input([50, 51, 52, 60, 70])
+        fips_data = {"53061": {"population": 100}, "53": {"population": 700}}
+        case_data = generate_case_json(county_input, state_input, fips_data,
+                                       3)
+
+        columnar = generate_case_json(county_input, state_input, fips_data,
+                                      3, columnar=True)
+        self.assertEqual(columnar["fips"], ["53", "53061"])
+        self.assertEqual(columnar["dates"], sorted(case_data))
+        self.assertEqual(columnar["cases"][-1], [140, 70])
+        self.assertEqual(columnar["increase"][0], [None, None])
+        # Floats are rounded to 6 significant digits.
+        self.assertEqual(columnar["per_capita"][-1], [0.2, 0.7])
+        self.assertAlmostEqual(
+            columnar["growth_factor"][-1][1],
+            case_data[columnar["dates"][-1]]["53061"]["growth_factor"], 5)
+        self.assertEqual(
+            get_case_data(get_columnar_case_data(case_data, None)), case_data)
+
+    def test_metric_arrays(self):
+        county_input, state_input, fips_data = generate_case_data(
+            counties=40, days=40, revision_rate=0.05, gap_rate=0.05)
+        for metrics in [DEFAULT_METRICS, ALL_METRICS, ["increase", "deaths"]]:
+            case_data, _ = generate_all_json(
+                [row[:] for row in county_input],
+                [row[:] for row in state_input], fips_data, 5, 50,
+                metrics=metrics)
+            expected = generate_case_json(
+                [row[:] for row in county_input],
+                [row[:] for row in state_input], fips_data, 5,
+                vectorized_metrics=True, metrics=metrics)
+            metric_arrays = case_data.get_metric_arrays()
+
+            # The layouts built from the case matrices are the same as the
+            # ones built from the dict, down to the order of their keys.
+            self.assertEqual(
+                b"".join(iter_json_chunks(ColumnarCaseData(metric_arrays))),
+                json.dumps(get_columnar_case_data(expected)).encode("utf-8"))
+            self.assertEqual(write_metric_arrays(metric_arrays),
+                             write_case_data(expected))
+
+
+class TestBinary(unittest.TestCase):
+    def assertAlmostEqualData(self, first, second):
+        # Floats only survive with float32 precision.
+        if isinstance(first, dict):
+            self.assertEqual(sorted(first), sorted(second))
+            for key in first:
+                self.assertAlmostEqualData(first[key], second[key])
+        elif isinstance(first, list):
+            self.assertEqual(len(first), len(second))
+            for first_value, second_value in zip(first, second):
+                self.assertAlmostEqualData(first_value, second_value)
+        else:
+            self.assertTrue(math.isclose(first, second, rel_tol=1e-6),
+                            "{} != {}".format(first, second))
+
+    def test_round_trip(self):
+        county_input, state_input = make_test_input([50, 51, 52, 60, 70, 70])
+        fips_data = {"53061": {"population": 100}, "53": {"population": 700}}
+        case_data = generate_case_json(county_input, state_input, fips_data,
+                                       3)
+        new_case_data = generate_new_case_json(county_input, state_input, 50)
+
+        self.assertAlmostEqualData(read_case_data(write_case_data(case_data)),
+                                   case_data)
+        self.assertAlmostEqualData(
+            read_new_case_data(write_new_case_data(new_case_data)),
+            new_case_data)
+
+
+class TestCaseMatrix(unittest.TestCase):
+    def test_gaps_and_growth(self):
+        case_matrix = CaseMatrix(3, initial_rows=1)
+        case_matrix.set("53061", 0, 1)
+        case_matrix.set("53061", 2, 0)
+        case_matrix.set("-10003", 1, 12)
+
+        self.assertEqual(case_matrix.fips, ["53061", "-10003"])
+        self.assertEqual(case_matrix.get("53061", 0), 1)
+        self.assertIsNone(case_matrix.get("53061", 1))
+        self.assertEqual(case_matrix.get("53061", 2), 0)
+        self.assertIsNone(case_matrix.get("53", 0))
+        self.assertEqual(case_matrix.inverse_chronological("53061"),
+                         [0, None, 1])
+        self.assertEqual(case_matrix.inverse_chronological("-10003", 1, 5),
+                         [12, None])
+
+    def test_correct_downward_revisions(self):
+        case_matrix = CaseMatrix(7)
+        for day, cases in enumerate([10, 14, 12, None, 20, 18, 19]):
+            if cases is not None:
+                case_matrix.set("53061", day, cases)
+        case_matrix.set("53", 0, 5)
+
+        case_matrix.correct_downward_revisions()
+
+        self.assertEqual(case_matrix.inverse_chronological("53061"),
+                         [19, 18, 18, None, 12, 12, 10])
+        self.assertEqual(case_matrix.revision_counts(), {"53061": 2})
+
+    def test_revisions_summary(self):
+        revisions = {"53061": 2, "36": 6, "36001": 2, "02": 1}
+        self.assertEqual(get_revisions_summary(revisions, top=3),
+                         "Downward revisions: 11 days across 4 FIPS, most in "
+                         "36: 6, 36001: 2, 53061: 2")
+        self.assertEqual(get_revisions_summary({}),
+                         "Downward revisions: 0 days across 0 FIPS")
+
+    def test_grows_from_stream(self):
+        case_matrix = CaseMatrix(initial_rows=1, initial_days=1)
+        for day in range(80, 180):
+            case_matrix.set("53061", case_matrix.column(day), day)
+
+        self.assertEqual(case_matrix.first_day, 80)
+        self.assertEqual(case_matrix.total_days, 100)
+        self.assertEqual(case_matrix.counts.shape, (1, 100))
+        self.assertEqual(case_matrix.inverse_chronological("53061", 1),
+                         [81, 80])
+        with self.assertRaises(ValueError):
+            case_matrix.column(79)
+
+    def test_per_capita(self):
+        case_matrix = CaseMatrix(2)
+        case_matrix.set("53061", 0, 10)
+        case_matrix.set("53061", 1, 20)
+        case_matrix.set("53", 1, 30)
+        case_matrix.set("-10003", 0, 40)
+        fips_data = {"53061": {"population": 1000}, "53": {"population": 0}}
+
+        populations = case_matrix.load_populations(fips_data)
+        self.assertEqual(populations[0], 1000)
+        # No population, or a population of 0, is NaN.
+        self.assertTrue(math.isnan(populations[1]))
+        self.assertTrue(math.isnan(populations[2]))
+        per_capita = case_matrix.per_capita()
+        self.assertEqual(per_capita[0].tolist(), [10 / 1000, 20 / 1000])
+        self.assertTrue(np.isnan(per_capita[1:]).all())
+
+
+class TestDateTable(unittest.TestCase):
+    def test_day_numbers(self):
+        dates = DateTable()
+        self.assertEqual(dates.day("2020-01-01"), 0)
+        self.assertEqual(dates.day("2020-03-01"), 60)
+        self.assertEqual(dates.iso(60), "2020-03-01")
+        self.assertEqual(dates.iso(-1), "2019-12-31")
+
+
+class TestStageTimer(unittest.TestCase):
+    def test_log_line(self):
+        @timed("square")
+        def square(x):
+            return x * x
+
+        # Stages outside a run do nothing
+        self.assertEqual(square(3), 9)
+
+        with mock.patch("builtins.print") as mock_print:
+            with RunTimer("test", trace_memory=True):
+                for x in range(3):
+                    square(x)
+                with stage("outer"):
+                    with stage("inner"):
+                        data = [0] * 100000
+                record_sizes("covid_data.json",
+                             {"json_bytes": 100, "gzip_bytes": 10,
+                              "sha256": "1a2b"})
+                county_input, state_input = make_test_input([40, 50, 60])
+                generate_all_json(county_input, state_input, {}, 5, 50)
+        line = json.loads(mock_print.call_args_list[-1][0][0])
+
+        self.assertEqual(line["Run"], "test")
+        self.assertEqual(line["Status"], "ok")
+        self.assertEqual(line["Stages"]["square"]["calls"], 3)
+        self.assertEqual(line["Stages"]["case_data"]["calls"], 2)
+        # generate_all_json() records the same steps as build_covid_data()
+        for name in ["record_case_counts", "correct_case_counts",
+                     "record_growth_metrics", "new_case_data"]:
+            self.assertEqual(line["Stages"][name]["calls"], 2)
+        # Only the outermost stage measures memory
+        self.assertGreater(line["outer_peak_bytes"], len(data) * 8)
+        self.assertIsNone(line["Stages"]["inner"]["peak_bytes"])
+        self.assertNotIn("inner_peak_bytes", line)
+        self.assertEqual(line["covid_data.json_gzip_bytes"], 10)
+
+        metrics = line["_aws"]["CloudWatchMetrics"][0]["Metrics"]
+        for metric in metrics:
+            self.assertIn(metric["Name"], line)
+        self.assertIn({"Name": "square_wall_ms", "Unit": "Milliseconds"},
+                      metrics)
+        self.assertIn({"Name": "covid_data.json_json_bytes", "Unit": "Bytes"},
+                      metrics)
+
+        # Memory isn't traced unless asked for
+        with mock.patch("builtins.print") as mock_print:
+            with RunTimer("test"):
+                with stage("outer"):
+                    data = [0] * 100000
+        line = json.loads(mock_print.call_args_list[-1][0][0])
+        self.assertIsNone(line["Stages"]["outer"]["peak_bytes"])
+        self.assertNotIn("outer_peak_bytes", line)
+
+    def test_profile(self):
+        county_input, state_input = make_test_input([40, 50, 60])
+        with tempfile.TemporaryDirectory() as directory:
+            # pstats prints the summary, so only stdout is silenced
+            with redirect_stdout(StringIO()):
+                with RunTimer("test", profile_stages=["case_data",
+                                                      "record_case_counts"],
+                              profile_stores=[LocalStore(directory)]):
+                    generate_all_json(county_input, state_input, {}, 5, 50)
+            # record_case_counts runs inside case_data, which is already
+            # being profiled.
+            names = sorted(os.listdir(directory))
+            self.assertEqual(len(names), 2)
+            self.assertTrue(names[0].startswith("test-"))
+            self.assertTrue(names[0].endswith("-case_data.pstats"))
+            self.assertTrue(names[1].endswith("-case_data.txt"))
+
+            stats = pstats.Stats(os.path.join(directory, names[0]))
+            self.assertIn("read_case_counts",
+                          [function for _, _, function in stats.stats])
+            with open(os.path.join(directory, names[1])) as summary:
+                self.assertIn("build_case_data", summary.read())
+
+        # The stages of the example in app.py's PROFILE_STAGES
+        with tempfile.TemporaryDirectory() as directory:
+            with redirect_stdout(StringIO()):
+                with RunTimer("test", profile_stages=[
+                        "record_case_counts", "record_growth_metrics"],
+                        profile_stores=[LocalStore(directory)]):
+                    generate_all_json(county_input, state_input, {}, 5, 50)
+            names = [name for name in os.listdir(directory)
+                     if name.endswith(".pstats")]
+            self.assertEqual(
+                sorted(name.rsplit("-", 1)[1] for name in names),
+                ["record_case_counts.pstats", "record_growth_metrics.pstats"])
+            stats = pstats.Stats(os.path.join(directory, [
+                name for name in names
+                if name.endswith("-record_growth_metrics.pstats")][0]))
+            self.assertIn("calculate_growth_metrics",
+                          [function for _, _, function in stats.stats])
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_synthetic_data(self):
+        params = {"counties": 40, "days": 40, "revision_rate": 0.05,
+                  "gap_rate": 0.05}
+        county_input, state_input, fips_data = generate_case_data(**params)
+        self.assertEqual((county_input, state_input, fips_data),
+                         generate_case_data(**params))
+        self.assertEqual(county_input[0], COUNTY_HEADER)
+        dates = [row[0] for row in county_input[1:]]
+        self.assertEqual(dates, sorted(dates))
+
+        # The synthetic data has revisions and gaps for the pipeline to
+        # handle, and it handles them the same way as the reference.
+        case_data, new_case_data = generate_all_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            fips_data, 5, 50, vectorized_metrics=False)
+        self.assertEqual(case_data, generate_case_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            fips_data, 5))
+        self.assertEqual(new_case_data, generate_new_case_json(
+            [row[:] for row in county_input], [row[:] for row in state_input],
+            50))
+        revised = [entry for entries in case_data.values()
+                   for entry in entries.values() if list(entry) == ["cases"]]
+        self.assertTrue(revised)
+
+    def test_compare(self):
+        baseline = {"scenarios": {"small": {"stages": {
+            "ingest": {"seconds": 1.0, "peak_bytes": 1000},
+            "gzip": {"seconds": 0.01, "peak_bytes": 1000}}}}}
+        results = {"scenarios": {"small": {"stages": {
+            "ingest": {"seconds": 2.0, "peak_bytes": 1000},
+            "gzip": {"seconds": 0.02, "peak_bytes": 2000}}},
+            "nyt": {"stages": {}}}}
+        self.assertEqual(compare(results, baseline), [
+            "small ingest: 2.000s, baseline 1.000s",
+            "small gzip: 2000 bytes, baseline 1000 bytes"])
+
+        # Results from another builder or other metrics aren't compared,
+        # and a baseline without them was run lean with the default
+        # metrics.
+        self.assertEqual(
+            compare(dict(results, builder="lean", metrics=DEFAULT_METRICS),
+                    baseline), compare(results, baseline))
+        self.assertEqual(compare(dict(results, builder="dict"), baseline), [])
+        self.assertEqual(compare(dict(results, metrics=ALL_METRICS),
+                                 baseline), [])
+        self.assertEqual(
+            compare(dict(results, metrics=ALL_METRICS),
+                    dict(baseline, metrics=ALL_METRICS)),
+            compare(results, baseline))
+
+    def test_get_ratios(self):
+        cases_only = {"scenarios": {"small": {
+            "sizes": {"json_bytes": 100, "gzip_bytes": 10},
+            "stages": {"ingest": {"seconds": 1.0, "peak_bytes": 1000},
+                       "gzip": {"seconds": 0.5, "peak_bytes": 1000}}}}}
+        deaths = {"scenarios": {"small": {
+            "sizes": {"json_bytes": 187, "gzip_bytes": 15},
+            "stages": {"ingest": {"seconds": 1.2, "peak_bytes": 1100},
+                       "gzip": {"seconds": 0.9, "peak_bytes": 1000},
+                       "formats": {"seconds": 0.1, "peak_bytes": 10}}},
+            "nyt": {"sizes": {}, "stages": {}}}}
+        self.assertEqual(get_ratios(deaths, cases_only), {"small": {
+            "ingest": 1.2, "gzip": 1.8, "json_bytes": 1.87,
+            "gzip_bytes": 1.5}})
+
+
 if __name__ == "__main__":
     unittest.main()